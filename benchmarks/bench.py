@@ -0,0 +1,399 @@
+"""
+シミュレーターのスループットとQUBO求解のレイテンシを計測するベンチマーク
+
+リポジトリのルートで実行する.
+
+    python -m benchmarks.bench run -o results/bench.json            # 既定の規模で計測
+    python -m benchmarks.bench run --full -o results/bench_full.json # 100x100まで計測
+    python -m benchmarks.bench run --only micro                      # 名前に"micro"を含むものだけ
+    python -m benchmarks.bench run --only import                     # コールドスタート(インポート時間)のみ
+    python -m benchmarks.bench compare results/base.json results/bench.json --threshold 0.1
+
+`run`は各ベンチマークの所要時間(中央値・最小値)をJSONで書き出す.
+`compare`は2つの結果の中央値を比べ, `threshold`を超えて遅くなったものを回帰として表示し, 終了コード1を返す.
+"""
+from __future__ import annotations
+from dataclasses import dataclass, field, replace
+from functools import lru_cache
+from time import perf_counter
+from typing import Any, Callable, Dict, List
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+
+import numpy as np
+
+
+@dataclass
+class Benchmark:
+    """
+    1つのベンチマーク
+
+    `setup()`が返した値を`run(state)`に渡して時間を計る. `setup`は計測に含まれない.
+    `run`が状態を変更する場合は`fresh=True`とし, 毎回`setup`し直す.
+    `units`は1回の`run`で処理する量(ステップ数など)で, スループット(`units`/秒)の計算に用いる.
+    """
+    name: str
+    setup: Callable[[], Any]
+    run: Callable[[Any], Any]
+    params: Dict[str, Any] = field(default_factory=dict)
+    units: int = 1
+    unit: str = "call"
+    repeat: int = 5
+    fresh: bool = False
+
+
+def _seeded(seed: int, simparams=None, coefficient=None, mapgenparam=None):
+    """
+    `param.apply_seed`で`seed`から互いに独立なシードを与えた(シミュレーション, サンプラー, マップ生成)の設定を返す
+
+    省略した設定は既定値から作る. 3つに同じ整数を渡すと乱数列が相関するため, 各ベンチマークはこれを通して設定を作る
+    """
+    from param import Coefficient, MapGenerationParam, SimulationParams, apply_seed
+    return apply_seed(seed, SimulationParams() if simparams is None else simparams,
+                      Coefficient() if coefficient is None else coefficient,
+                      MapGenerationParam() if mapgenparam is None else mapgenparam)
+
+
+def _init_map(size: int, car_count: int, seed: int, engine: int | None = None):
+    from param import MapGenerationParam, VEHICLE_ENGINE_LIST
+    from simulator import simulation_init
+    _, _, mapgenparam = _seeded(seed, mapgenparam=MapGenerationParam(
+        car_count=car_count, vehicle_engine=VEHICLE_ENGINE_LIST if engine is None else engine))
+    return simulation_init(mapgenparam, width=size, height=size)
+
+
+@lru_cache(maxsize=None)
+def _warm_map(size: int, car_count: int, seed: int, warmup: int = 60):
+    """
+    固定サイクルで`warmup`ステップ進め, 交差点に待機車両がある状態のマップを返す
+
+    状態を変更しないベンチマークの間で共有するためキャッシュする
+    """
+    from param import Coefficient, SimulationParams, UPDATE_STRATEGY_FIXED
+    from simulator import simulation
+    mapinfo, edge_traffics, node_traffics = _init_map(size, car_count, seed)
+    simparams, coefficient, _ = _seeded(seed, SimulationParams(
+        update_strategy=UPDATE_STRATEGY_FIXED, simulation_time=warmup, verbose=False, record_edges=False))
+    simulation(simparams, coefficient, mapinfo, edge_traffics, node_traffics)
+    return mapinfo, edge_traffics, node_traffics
+
+
+def simulation_benchmarks(full: bool, seed: int) -> List[Benchmark]:
+    """
+    `simulation()`のステップ/秒を, 信号更新の方針・マップサイズ・車両数ごとに計測する
+    """
+    from param import (Coefficient, SimulationParams,
+                       UPDATE_STRATEGY_FIXED, UPDATE_STRATEGY_RANDOM, UPDATE_STRATEGY_QUBO)
+    from simulator import simulation
+
+    strategies = {
+        "fixed": (UPDATE_STRATEGY_FIXED, [6, 20, 50, 100] if full else [6, 20, 50]),
+        "random": (UPDATE_STRATEGY_RANDOM, [6, 20, 50, 100] if full else [6, 20, 50]),
+        "qubo": (UPDATE_STRATEGY_QUBO, [6, 20, 50, 100] if full else [6, 10, 20]),
+    }
+    densities = [1, 5]
+    """1ノードあたりの車両数"""
+    steps = 50
+
+    benchmarks = []
+    for label, (strategy, sizes) in strategies.items():
+        for size in sizes:
+            for density in densities:
+                car_count = density*size*size
+                simparams, coefficient, _ = _seeded(
+                    seed, SimulationParams(update_strategy=strategy, simulation_time=steps, verbose=False, record_edges=False),
+                    Coefficient(num_sweeps=1000))
+                benchmarks.append(Benchmark(
+                    name=f"simulation/{label}/{size}x{size}/cars{car_count}",
+                    setup=lambda size=size, car_count=car_count: _init_map(size, car_count, seed),
+                    run=lambda state, simparams=simparams, coefficient=coefficient: simulation(simparams, coefficient, *state),
+                    params={"strategy": label, "size": size, "car_count": car_count, "steps": steps},
+                    units=steps, unit="step",
+                    repeat=1 if label == "qubo" or size >= 50 else 3, fresh=True,
+                ))
+    return benchmarks
+
+
+def partitioned_benchmarks(full: bool, seed: int) -> List[Benchmark]:
+    """
+    `simulation_partitioned()`のステップ/秒を, マップサイズ・タイル数ごとに計測する (固定サイクル)
+    """
+    from param import Coefficient, SimulationParams, UPDATE_STRATEGY_FIXED
+    from partitioned import simulation_partitioned
+
+    sizes = [100, 200] if full else [50, 100]
+    tile_counts = sorted({1, os.cpu_count() or 1})
+    density = 5
+    steps = 50
+
+    benchmarks = []
+    for size in sizes:
+        car_count = density*size*size
+        simparams, coefficient, _ = _seeded(seed, SimulationParams(
+            update_strategy=UPDATE_STRATEGY_FIXED, simulation_time=steps, verbose=False, record_edges=False))
+        for tiles in tile_counts:
+            benchmarks.append(Benchmark(
+                name=f"partitioned/fixed/{size}x{size}/cars{car_count}/tiles{tiles}",
+                setup=lambda size=size, car_count=car_count: _init_map(size, car_count, seed),
+                run=lambda state, simparams=simparams, coefficient=coefficient, tiles=tiles: simulation_partitioned(
+                    simparams, coefficient, *state, tiles=tiles),
+                params={"strategy": "fixed", "size": size, "car_count": car_count, "steps": steps, "tiles": tiles},
+                units=steps, unit="step", repeat=1,
+            ))
+    return benchmarks
+
+
+def micro_benchmarks(full: bool, seed: int) -> List[Benchmark]:
+    """
+    QUBOの項の生成, 流出可能台数の取得, 求解, フレーム描画の所要時間を計測する
+    """
+    from param import Coefficient, SAMPLER_EXACT
+    from solving.solve_sa import get_flowable_count, q1, q2, q3, solve_main
+    from visualize import TrafficVisualizer
+
+    _, coefficient, _ = _seeded(seed)
+    benchmarks = []
+    for size in ([6, 20, 50, 100] if full else [6, 20, 50]):
+        setup = lambda size=size: _warm_map(size, 3*size*size, seed)
+        params = {"size": size}
+        benchmarks += [
+            Benchmark(f"micro/q1/{size}x{size}", setup,
+                      lambda s: q1(s[1], s[2], s[0], coefficient.lambda1), params, repeat=20),
+            Benchmark(f"micro/q2/{size}x{size}", setup,
+                      lambda s: q2(60, s[1], s[2], s[0], coefficient.lambda2, coefficient.lambda2t,
+                                   coefficient.lambda2f, coefficient.tau_threshold), params, repeat=20),
+            Benchmark(f"micro/q3/{size}x{size}", setup,
+                      lambda s: q3(s[1], s[2], s[0], coefficient.lambda3), params, repeat=20),
+            Benchmark(f"micro/get_flowable_count/{size}x{size}", setup,
+                      lambda s: [get_flowable_count(nt, mode) for nt in s[2].values() for mode in range(1, 7)],
+                      params, units=size*size*6, unit="lookup", repeat=20),
+        ]
+    for size in ([6, 20, 50] if full else [6, 20]):
+        benchmarks.append(Benchmark(
+            f"micro/solve_main/{size}x{size}",
+            lambda size=size: _warm_map(size, 3*size*size, seed),
+            lambda s: solve_main(coefficient, 60, s[1], s[2], s[0], verbose=False),
+            {"size": size, "num_reads": coefficient.num_reads, "num_sweeps": coefficient.num_sweeps},
+            repeat=3,
+        ))
+    # タイル分割での求解 (一辺5ノードのタイル, 境界をずらして2回)
+    tiled = replace(coefficient, solve_tile_size=5)
+    for size in ([20, 50, 100] if full else [20]):
+        benchmarks.append(Benchmark(
+            f"micro/solve_main_tiled/{size}x{size}",
+            lambda size=size: _warm_map(size, 3*size*size, seed),
+            lambda s: solve_main(tiled, 60, s[1], s[2], s[0], verbose=False),
+            {"size": size, "num_reads": tiled.num_reads, "num_sweeps": tiled.num_sweeps,
+             "solve_tile_size": tiled.solve_tile_size, "solve_tile_rounds": tiled.solve_tile_rounds},
+            repeat=3,
+        ))
+    # タイルごとの厳密解法 (一辺5ノードのタイル)
+    exact = replace(tiled, sampler=SAMPLER_EXACT)
+    for size in ([20, 50] if full else [20]):
+        benchmarks.append(Benchmark(
+            f"micro/solve_main_exact_tiled/{size}x{size}",
+            lambda size=size: _warm_map(size, 3*size*size, seed),
+            lambda s: solve_main(exact, 60, s[1], s[2], s[0], verbose=False),
+            {"size": size, "solve_tile_size": exact.solve_tile_size, "solve_tile_rounds": exact.solve_tile_rounds},
+            repeat=3,
+        ))
+
+    def frame_setup(size: int):
+        from param import SimulationParams, UPDATE_STRATEGY_FIXED
+        from simulator import simulation
+        mapinfo, edge_traffics, node_traffics = _init_map(size, 3*size*size, seed)
+        simparams, _, _ = _seeded(seed, SimulationParams(update_strategy=UPDATE_STRATEGY_FIXED, simulation_time=20,
+                                                         verbose=False))
+        history = simulation(simparams, coefficient, mapinfo, edge_traffics, node_traffics)
+        visualizer = TrafficVisualizer()
+        # 描画器の生成(静的部分の描画)は1回きりのため計測から除く
+        visualizer._generate_frame(history[0], mapinfo)
+        return visualizer, history[-1], mapinfo
+
+    for size in ([6, 20] if full else [6]):
+        benchmarks.append(Benchmark(
+            f"micro/generate_frame/{size}x{size}",
+            lambda size=size: frame_setup(size),
+            lambda s: s[0]._generate_frame(s[1], s[2]),
+            {"size": size}, unit="frame", repeat=10,
+        ))
+    return benchmarks
+
+
+IMPORT_TARGETS = ["simulator", "headless", "solving.solve_sa", "visualize"]
+"""インポート時間を計測するモジュール"""
+
+OPTIONAL_MODULES = ["matplotlib", "PIL", "IPython", "dimod", "neal"]
+"""インポート時に読み込まれたかを記録する重い依存パッケージ"""
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _python(code: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, check=True)
+
+
+def import_benchmarks(full: bool, seed: int) -> List[Benchmark]:
+    """
+    新しいインタープリターでモジュールをインポートするまでの時間(コールドスタート)を計測する
+
+    `import/(interpreter)`はインタープリターの起動のみの時間. 
+    各ベンチマークの`params["loaded_optional"]`にはインポート後に読み込まれていた重い依存パッケージを記録する
+    """
+    def loaded_optional(module: str) -> List[str]:
+        code = (f"import sys, {module}; "
+                f"print(','.join(m for m in {OPTIONAL_MODULES!r} if m in sys.modules))")
+        return [m for m in _python(code).stdout.strip().split(",") if m]
+
+    benchmarks = [Benchmark("import/(interpreter)", lambda: None, lambda _: _python("pass"), repeat=5)]
+    for module in IMPORT_TARGETS:
+        params = {"module": module}
+        benchmarks.append(Benchmark(
+            f"import/{module}",
+            lambda module=module, params=params: params.update(loaded_optional=loaded_optional(module)),
+            lambda _, module=module: _python(f"import {module}"),
+            params, repeat=5,
+        ))
+    return benchmarks
+
+
+SUITES = {
+    "simulation": simulation_benchmarks,
+    "partitioned": partitioned_benchmarks,
+    "micro": micro_benchmarks,
+    "import": import_benchmarks,
+}
+"""ベンチマーク群の名前と生成関数"""
+
+
+def measure(benchmark: Benchmark) -> Dict[str, Any]:
+    """
+    `benchmark`を`repeat`回実行し, 所要時間の統計を返す
+    """
+    times = []
+    state = None if benchmark.fresh else benchmark.setup()
+    for _ in range(benchmark.repeat):
+        if benchmark.fresh:
+            state = benchmark.setup()
+        # 計測対象のprintは結果に含めない
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = perf_counter()
+            benchmark.run(state)
+            times.append(perf_counter() - start)
+    median = statistics.median(times)
+    return {
+        "name": benchmark.name,
+        "params": benchmark.params,
+        "repeat": benchmark.repeat,
+        "times": times,
+        "median": median,
+        "min": min(times),
+        "unit": benchmark.unit,
+        "throughput": benchmark.units/median if median > 0 else None,
+    }
+
+
+def environment() -> Dict[str, Any]:
+    """
+    計測環境 (比較時の参考情報)
+    """
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def run(output_path: str, full: bool = False, only: str | None = None, seed: int = 0) -> Dict[str, Any]:
+    """
+    全ベンチマークを実行して結果をJSONで`output_path`へ書き出し, その内容を返す
+    """
+    benchmarks = [b for suite in SUITES.values() for b in suite(full, seed)]
+    if only:
+        benchmarks = [b for b in benchmarks if only in b.name]
+
+    results = []
+    for i, benchmark in enumerate(benchmarks, start=1):
+        result = measure(benchmark)
+        results.append(result)
+        throughput = f" ({result['throughput']:.1f} {result['unit']}/s)" if result["unit"] != "call" else ""
+        print(f"[{i}/{len(benchmarks)}] {benchmark.name}: {result['median']*1000:.2f} ms{throughput}")
+
+    report = {"environment": environment(), "seed": seed, "full": full, "results": results}
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Benchmark results saved to: {output_path}")
+    return report
+
+
+def compare(base_path: str, new_path: str, threshold: float = 0.1) -> List[str]:
+    """
+    2つの結果の中央値を比べて表を表示し, `threshold`(相対値)を超えて遅くなったベンチマーク名を返す
+    """
+    with open(base_path, encoding="utf-8") as f:
+        base = {r["name"]: r for r in json.load(f)["results"]}
+    with open(new_path, encoding="utf-8") as f:
+        new = {r["name"]: r for r in json.load(f)["results"]}
+
+    regressions = []
+    print(f"{'benchmark':<48} {'base [ms]':>11} {'new [ms]':>11} {'ratio':>7}")
+    for name in sorted(base.keys() & new.keys()):
+        ratio = new[name]["median"]/base[name]["median"] if base[name]["median"] > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + threshold:
+            flag = "  REGRESSION"
+            regressions.append(name)
+        elif ratio < 1/(1 + threshold):
+            flag = "  improved"
+        print(f"{name:<48} {base[name]['median']*1000:>11.2f} {new[name]['median']*1000:>11.2f} {ratio:>7.2f}{flag}")
+    for name in sorted(base.keys() - new.keys()):
+        print(f"{name:<48} (missing in {new_path})")
+    for name in sorted(new.keys() - base.keys()):
+        print(f"{name:<48} (new)")
+
+    print(f"{len(regressions)} regression(s) over {threshold:.0%}")
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run benchmarks and write JSON")
+    run_parser.add_argument("-o", "--output", default="results/bench.json")
+    run_parser.add_argument("--full", action="store_true", help="include grids up to 100x100 for every strategy")
+    run_parser.add_argument("--only", default=None, help="run only benchmarks whose name contains this string")
+    run_parser.add_argument("--seed", type=int, default=0)
+
+    compare_parser = commands.add_parser("compare", help="compare two JSON results")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="relative slowdown of the median that counts as a regression")
+
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        run(args.output, full=args.full, only=args.only, seed=args.seed)
+        return 0
+    return 1 if compare(args.base, args.new, args.threshold) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,241 @@
+"""
+参照実装と高速化した実装が, 同じシードで同じ履歴を生成するかを検査する
+
+参照実装はエッジごとのPythonリスト(`VEHICLE_ENGINE_LIST`)で車両を管理する.
+リポジトリのルートで実行する.
+
+    python equivalence.py                                    # 全エンジン・全方針を6x6で検査
+    python equivalence.py --engines 1 --strategies 1 2 --size 20 --cars 2000 --steps 300 --seeds 0 1 2
+    python equivalence.py --engines --tiles 1 4              # 領域分割(partitioned.py)のスカラー値を検査
+
+`--engines`の各方式では, 初期状態の`edge_traffics[...].vehicles`をリストとして書き換えた後の履歴も検査する.
+
+不一致があれば最初の数件を表示し, 終了コード1を返す.
+"""
+from __future__ import annotations
+from dataclasses import replace
+from typing import Any, Dict, List
+import argparse
+import math
+import sys
+
+from param import *
+
+
+ENGINE_NAMES = {
+    VEHICLE_ENGINE_LIST: "list",
+    VEHICLE_ENGINE_ARRAY: "array",
+    VEHICLE_ENGINE_EVENT: "event",
+}
+"""車両管理方式の表示名"""
+
+STRATEGY_NAMES = {
+    UPDATE_STRATEGY_QUBO: "qubo",
+    UPDATE_STRATEGY_FIXED: "fixed",
+    UPDATE_STRATEGY_RANDOM: "random",
+}
+"""信号更新の方針の表示名"""
+
+IGNORED_KEYS = ("solve_time",)
+"""実行ごとに変わるため比較しない記録"""
+
+SCALAR_KEYS = ("time", "timewasted", "step_flow_out", "pre_outflow_waiting", "flowout_ratio", "remain_ratio")
+"""領域分割の実行(`simulation_partitioned`)と比較する記録"""
+
+
+def run_history(engine: int, mapgenparam: MapGenerationParam, simparams: SimulationParams,
+                coefficient: Coefficient, width: int = 6, height: int = 6) -> List[Dict[str, Any]]:
+    """
+    車両管理方式`engine`でシミュレーションを実行し, 履歴を返す
+
+    各パラメータの`seed`が同じであれば, 方式によらず同じ乱数列が使われる
+    """
+    from simulator import simulation, simulation_init
+    mapinfo, edge_traffics, node_traffics = simulation_init(replace(mapgenparam, vehicle_engine=engine),
+                                                            width=width, height=height)
+    return simulation(replace(simparams, verbose=False), coefficient, mapinfo, edge_traffics, node_traffics)
+
+
+def run_partitioned_history(tiles: int, mapgenparam: MapGenerationParam, simparams: SimulationParams,
+                            coefficient: Coefficient, width: int = 6, height: int = 6) -> List[Dict[str, Any]]:
+    """
+    マップを`tiles`個に分割してシミュレーションを実行し, 履歴を返す
+
+    `simulation()`と乱数の割り当てを揃えるため`match_serial=True`で実行する
+    """
+    from partitioned import simulation_partitioned
+    from simulator import simulation_init
+    mapinfo, edge_traffics, node_traffics = simulation_init(mapgenparam, width=width, height=height)
+    return simulation_partitioned(replace(simparams, verbose=False), coefficient, mapinfo, edge_traffics, node_traffics,
+                                  tiles=tiles, match_serial=True)
+
+
+def edit_vehicles(edge_traffics: Dict) -> List[List[float]]:
+    """
+    先頭の数本の有向エッジの`vehicles`を`list`の操作(追加, 挿入, 代入, 削除)で書き換え, 全エッジの車両位置を返す
+    """
+    first, second, third = (edge_traffics[key].vehicles for key in list(edge_traffics)[:3])
+    first.append(1.5)
+    first.extend([2.5, 3.5])
+    second.append(4.0)
+    second.insert(0, 0.25)
+    second[-1] = 6.0
+    del second[0]
+    third.clear()
+    third += [1.0, 2.0, 3.0]
+    del third[:1]
+    return [list(traffic.vehicles) for traffic in edge_traffics.values()]
+
+
+def run_edited_history(engine: int, mapgenparam: MapGenerationParam, simparams: SimulationParams,
+                       coefficient: Coefficient, width: int = 6, height: int = 6):
+    """
+    車両管理方式`engine`で初期状態を`edit_vehicles`で書き換えてからシミュレーションを実行し,
+    (書き換え後の車両位置, 履歴)を返す
+    """
+    from simulator import simulation, simulation_init
+    mapinfo, edge_traffics, node_traffics = simulation_init(replace(mapgenparam, vehicle_engine=engine),
+                                                            width=width, height=height)
+    edited = edit_vehicles(edge_traffics)
+    return edited, simulation(replace(simparams, verbose=False), coefficient, mapinfo, edge_traffics, node_traffics)
+
+
+def scalar_history(history: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    履歴の各ステップから`SCALAR_KEYS`のみを取り出す
+    """
+    return [{key: step[key] for key in SCALAR_KEYS} for step in history]
+
+
+def _diff(path: str, a: Any, b: Any, rel_tol: float, abs_tol: float, out: List[str]):
+    if isinstance(a, float) or isinstance(b, float):
+        if not (isinstance(a, (int, float)) and isinstance(b, (int, float))
+                and math.isclose(a, b, rel_tol=rel_tol, abs_tol=abs_tol)):
+            out.append(f"{path}: {a!r} != {b!r}")
+    elif isinstance(a, dict) and isinstance(b, dict):
+        if a.keys() != b.keys():
+            out.append(f"{path}: keys {sorted(a.keys() - b.keys())} / {sorted(b.keys() - a.keys())} differ")
+            return
+        for key in a:
+            if key not in IGNORED_KEYS:
+                _diff(f"{path}.{key}", a[key], b[key], rel_tol, abs_tol, out)
+    elif isinstance(a, (list, tuple)) and isinstance(b, (list, tuple)):
+        if len(a) != len(b):
+            out.append(f"{path}: length {len(a)} != {len(b)}")
+            return
+        for i, (x, y) in enumerate(zip(a, b)):
+            _diff(f"{path}[{i}]", x, y, rel_tol, abs_tol, out)
+    elif a != b:
+        out.append(f"{path}: {a!r} != {b!r}")
+
+
+def compare_histories(reference: List[Dict[str, Any]], candidate: List[Dict[str, Any]],
+                      rel_tol: float = 1e-9, abs_tol: float = 1e-9, limit: int = 10) -> List[str]:
+    """
+    2つの履歴をステップごとに比較し, 不一致の説明を最大`limit`件返す(一致すれば空)
+
+    浮動小数点数(Time Wastedの逐次集計など)は`rel_tol`, `abs_tol`の範囲で一致とみなす
+    """
+    mismatches: List[str] = []
+    if len(reference) != len(candidate):
+        mismatches.append(f"history length {len(reference)} != {len(candidate)}")
+    for reference_step, candidate_step in zip(reference, candidate):
+        _diff(f"[time {reference_step.get('time')}]", reference_step, candidate_step, rel_tol, abs_tol, mismatches)
+        if len(mismatches) >= limit:
+            break
+    return mismatches[:limit]
+
+
+def check_equivalence(mapgenparam: MapGenerationParam, simparams: SimulationParams, coefficient: Coefficient,
+                      engines: List[int], width: int = 6, height: int = 6,
+                      rel_tol: float = 1e-9, abs_tol: float = 1e-9) -> Dict[int, List[str]]:
+    """
+    参照実装と各`engines`の履歴を比較し, 方式ごとの不一致の説明を返す
+    """
+    reference = run_history(VEHICLE_ENGINE_LIST, mapgenparam, simparams, coefficient, width, height)
+    return {
+        engine: compare_histories(reference, run_history(engine, mapgenparam, simparams, coefficient, width, height),
+                                  rel_tol=rel_tol, abs_tol=abs_tol)
+        for engine in engines
+    }
+
+
+def check_vehicle_edits(mapgenparam: MapGenerationParam, simparams: SimulationParams, coefficient: Coefficient,
+                        engines: List[int], width: int = 6, height: int = 6,
+                        rel_tol: float = 1e-9, abs_tol: float = 1e-9) -> Dict[int, List[str]]:
+    """
+    `vehicles`を書き換えた後の車両位置と履歴を参照実装と比較し, 方式ごとの不一致の説明を返す
+    """
+    reference_edited, reference = run_edited_history(VEHICLE_ENGINE_LIST, mapgenparam, simparams, coefficient,
+                                                     width, height)
+    results = {}
+    for engine in engines:
+        edited, history = run_edited_history(engine, mapgenparam, simparams, coefficient, width, height)
+        mismatches: List[str] = []
+        _diff("[edited]", reference_edited, edited, rel_tol, abs_tol, mismatches)
+        results[engine] = mismatches[:10] + compare_histories(reference, history, rel_tol=rel_tol, abs_tol=abs_tol)
+    return results
+
+
+def check_partitioned(mapgenparam: MapGenerationParam, simparams: SimulationParams, coefficient: Coefficient,
+                      tiles: List[int], width: int = 6, height: int = 6,
+                      rel_tol: float = 1e-9, abs_tol: float = 1e-9) -> Dict[int, List[str]]:
+    """
+    参照実装と各タイル数での領域分割の実行のスカラー値を比較し, タイル数ごとの不一致の説明を返す
+    """
+    reference = scalar_history(run_history(VEHICLE_ENGINE_LIST, mapgenparam, simparams, coefficient, width, height))
+    return {
+        count: compare_histories(reference, scalar_history(
+            run_partitioned_history(count, mapgenparam, simparams, coefficient, width, height)),
+            rel_tol=rel_tol, abs_tol=abs_tol)
+        for count in tiles
+    }
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--engines", type=int, nargs="*", default=[VEHICLE_ENGINE_ARRAY, VEHICLE_ENGINE_EVENT])
+    parser.add_argument("--tiles", type=int, nargs="*", default=[], help="tile counts of the partitioned engine")
+    parser.add_argument("--strategies", type=int, nargs="+", default=list(STRATEGY_NAMES))
+    parser.add_argument("--seeds", type=int, nargs="+", default=[0, 1])
+    parser.add_argument("--size", type=int, default=6)
+    parser.add_argument("--cars", type=int, default=300)
+    parser.add_argument("--steps", type=int, default=200)
+    parser.add_argument("--sweeps", type=int, default=200, help="num_sweeps of the QUBO solver")
+    args = parser.parse_args(argv)
+
+    failed = False
+    for seed in args.seeds:
+        for strategy in args.strategies:
+            simparams, coefficient, mapgenparam = apply_seed(
+                seed, SimulationParams(update_strategy=strategy, simulation_time=args.steps),
+                Coefficient(num_sweeps=args.sweeps), MapGenerationParam(car_count=args.cars))
+            results = {}
+            if args.engines:
+                results.update({
+                    f"engine={ENGINE_NAMES.get(engine, engine)}": mismatches for engine, mismatches in
+                    check_equivalence(mapgenparam, simparams, coefficient, args.engines, args.size, args.size).items()
+                })
+                results.update({
+                    f"edited engine={ENGINE_NAMES.get(engine, engine)}": mismatches for engine, mismatches in
+                    check_vehicle_edits(mapgenparam, simparams, coefficient, args.engines, args.size, args.size).items()
+                })
+            if args.tiles:
+                results.update({
+                    f"tiles={count}": mismatches for count, mismatches in
+                    check_partitioned(mapgenparam, simparams, coefficient, args.tiles, args.size, args.size).items()
+                })
+            for name, mismatches in results.items():
+                label = f"seed={seed} strategy={STRATEGY_NAMES.get(strategy, strategy)} {name}"
+                if mismatches:
+                    failed = True
+                    print(f"{label}: MISMATCH")
+                    for mismatch in mismatches:
+                        print(f"  {mismatch}")
+                else:
+                    print(f"{label}: OK")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,6 +1,19 @@
 from __future__ import annotations
-import random
-from typing import List
+from typing import List, Tuple
+import numpy as np
+
+from traffic import FLOW_TO, TURNS
+
+
+DIRECTION_CODES = (1, 2, 3, 4)
+"""
+方位コードの一覧 (1:北, 2:南, 3:東, 4:西). 
+
+`MapInfo`の各テーブルでは方位コード`d`を列`d-1`に対応させる. 
+"""
+
+DEFAULT_TURN_WEIGHTS = (0.8, 0.2, 0.0)
+"""進行方向(直進, 右折, 左折)の既定の重み (左折確率0)"""
 
 
 class MapInfo:
@@ -11,13 +24,19 @@ class MapInfo:
     def __init__(
         self, width: int, height: int,
         edge_length:float=1000,
-        edge_speed_limit_array:List[float]=[11.0, 17.0, 22.0, 28.0]
+        edge_speed_limit_array:List[float]=[11.0, 17.0, 22.0, 28.0],
+        rng: np.random.Generator | None = None,
+        turn_weights=DEFAULT_TURN_WEIGHTS,
     ):
         """
         Args: 
             width: マップ横幅
             height: マップ縦幅
+            rng: 制限速度の選択に用いる乱数生成器 (省略時は毎回異なる)
+            turn_weights: 進行方向の重み. `setTurnWeights`を参照
         """
+        if rng is None:
+            rng = np.random.default_rng()
         self._mapwidth=width
         self._mapheight=height
         self._nodes = [
@@ -41,7 +60,7 @@ class MapInfo:
                 if key not in self._edges:
                     # 道路にランダムに制限速度を付す
                     # ここを偏向することで各エッジの制限速度を変更可能
-                    speed=random.choice(edge_speed_limit_array)
+                    speed=edge_speed_limit_array[rng.integers(len(edge_speed_limit_array))]
                     
                     # マップ内最高速度の記録
                     if self._global_max_speed<speed: 
@@ -57,6 +76,70 @@ class MapInfo:
                         speed_limit=speed    
                     )
 
+        self._build_tables()
+        self.setTurnWeights(turn_weights)
+
+    def _build_tables(self):
+        """
+        隣接関係・有向エッジ・進行先の整数テーブルを構築する. 
+
+        ホットパスではオブジェクトをたどる代わりにこれらを参照する. 
+        """
+        w, h = self._mapwidth, self._mapheight
+        node_count = w * h
+
+        # 隣接ノードテーブル (N x 4, 列は北・南・東・西)
+        xs = np.arange(node_count) % w
+        ys = np.arange(node_count) // w
+        self._neighbor_table = np.stack([
+            xs + ((ys - 1) % h) * w,  # 北
+            xs + ((ys + 1) % h) * w,  # 南
+            (xs + 1) % w + ys * w,    # 東
+            (xs - 1) % w + ys * w,    # 西
+        ], axis=1)
+        neighbor_ids = [tuple(row) for row in self._neighbor_table.tolist()]
+        for node, ids in zip(self._nodes, neighbor_ids):
+            node._neighbor_ids = ids
+
+        # 有向エッジのインデックス. 各無向エッジについて(a, b), (b, a)の順に採番する. 
+        # (simulation_initで生成する`edge_traffics`のキー順と一致する)
+        self._directed_index: dict[Tuple[int, int], int] = {}
+        directed_edges: List[Edge] = []
+        for edge in self._edges.values():
+            for key in ((edge.start_id, edge.end_id), (edge.end_id, edge.start_id)):
+                if key not in self._directed_index:
+                    self._directed_index[key] = len(directed_edges)
+                    directed_edges.append(edge)
+        self._directed_keys: List[Tuple[int, int]] = list(self._directed_index.keys())
+
+        self._edge_start = np.array([a for a, _ in self._directed_keys], dtype=np.int64)
+        self._edge_end = np.array([b for _, b in self._directed_keys], dtype=np.int64)
+        self._edge_length = np.array([edge.length for edge in directed_edges], dtype=float)
+        self._edge_speed = np.array([edge.speed_limit for edge in directed_edges], dtype=float)
+
+        # 有向エッジ終点への進入方向 (終点から見た始点の方位. 一致が複数あれば北・南・東・西の順で優先)
+        self._entry_direction = [
+            next(d for d in DIRECTION_CODES if neighbor_ids[b][d - 1] == a)
+            for a, b in self._directed_keys
+        ]
+
+        # (ノード, 進入方向, 進行方向コード) -> 進行先ノード / 流出先有向エッジ
+        self._next_node_ids = [
+            [
+                [ids[FLOW_TO[(d, turn)] - 1] for turn in TURNS]
+                for d in DIRECTION_CODES
+            ]
+            for ids in neighbor_ids
+        ]
+        self._next_edge_ids = [
+            [
+                [self._directed_index[(node_id, next_id)] for next_id in per_direction]
+                for per_direction in per_node
+            ]
+            for node_id, per_node in enumerate(self._next_node_ids)
+        ]
+        self._next_edge_table = np.array(self._next_edge_ids, dtype=np.int64).reshape(node_count, len(DIRECTION_CODES), len(TURNS))
+
 
     
     def width(self):
@@ -82,7 +165,7 @@ class MapInfo:
         2つのノードIDが隣接していれば、その間のEdgeを返す。
         隣接していなければ None を返す。
         """
-        key = tuple(sorted((id1, id2)))
+        key = (id1, id2) if id1 <= id2 else (id2, id1)
         return self._edges.get(key)
     
     def globalMaxSpeed(self) -> float:
@@ -90,6 +173,125 @@ class MapInfo:
         マップ内における最高の制限速度を返す.
         """
         return self._global_max_speed
+
+    def neighborTable(self) -> np.ndarray:
+        """
+        隣接ノードidの(ノード数 x 4)配列を返す. 列は北・南・東・西の順. 
+        """
+        return self._neighbor_table
+
+    def neighborIds(self, nodeid: int) -> Tuple[int, int, int, int]:
+        """
+        `nodeid`の北・南・東・西に隣接するノードidを返す
+        """
+        return self._nodes[nodeid]._neighbor_ids
+
+    def directedEdgeKeys(self) -> List[Tuple[int, int]]:
+        """
+        有向エッジ(始点id, 終点id)の一覧を有向エッジインデックス順に返す
+        """
+        return self._directed_keys
+
+    def directedEdgeIndex(self, start_id: int, end_id: int) -> int | None:
+        """
+        `start_id`から`end_id`への有向エッジのインデックスを返す. 非隣接の場合`None`を返す. 
+        """
+        return self._directed_index.get((start_id, end_id))
+
+    def edgeStartArray(self) -> np.ndarray:
+        """有向エッジごとの始点idの配列を返す"""
+        return self._edge_start
+
+    def edgeEndArray(self) -> np.ndarray:
+        """有向エッジごとの終点idの配列を返す"""
+        return self._edge_end
+
+    def edgeLengthArray(self) -> np.ndarray:
+        """有向エッジごとの道路長の配列を返す"""
+        return self._edge_length
+
+    def edgeSpeedArray(self) -> np.ndarray:
+        """有向エッジごとの制限速度の配列を返す"""
+        return self._edge_speed
+
+    def entryDirection(self, edge_idx: int) -> int:
+        """
+        有向エッジ`edge_idx`の終点への進入方向(1:北, 2:南, 3:東, 4:西)を返す
+        """
+        return self._entry_direction[edge_idx]
+
+    def nextNodeId(self, nodeid: int, direction: int, turn_code: int) -> int:
+        """
+        `nodeid`に`direction`から進入し, 進行方向コード`turn_code`で通過した後に進むノードidを返す
+        """
+        return self._next_node_ids[nodeid][direction - 1][turn_code]
+
+    def nextEdgeIndex(self, nodeid: int, direction: int, turn_code: int) -> int:
+        """
+        `nodeid`に`direction`から進入し, 進行方向コード`turn_code`で通過した後に進む有向エッジのインデックスを返す
+        """
+        return self._next_edge_ids[nodeid][direction - 1][turn_code]
+
+    def nextEdgeTable(self) -> np.ndarray:
+        """
+        (ノード数 x 4 x 3)の流出先有向エッジインデックス表を返す. 
+        軸はノードid, 進入方向-1, 進行方向コードの順. 
+        """
+        return self._next_edge_table
+
+    def setTurnWeights(self, weights):
+        """
+        交差点での進行方向(直進, 右折, 左折)の重みを設定する. 重みは行ごとに正規化される. 
+
+        `weights`は(ノード数 x 4 x 3)の配列に展開できる形で与える. 
+
+        - 長さ3: 全ノード・全進入方向で共通
+        - (4 x 3): 進入方向(北・南・東・西)ごと
+        - (ノード数 x 4 x 3): ノード・進入方向ごと
+        """
+        node_count = self._mapwidth * self._mapheight
+        try:
+            table = np.broadcast_to(np.asarray(weights, dtype=float), (node_count, len(DIRECTION_CODES), len(TURNS)))
+        except ValueError:
+            raise ValueError(f"turn weights of shape {np.shape(weights)} cannot be broadcast to "
+                             f"({node_count}, {len(DIRECTION_CODES)}, {len(TURNS)})") from None
+        totals = table.sum(axis=2, keepdims=True)
+        if (table < 0).any() or (totals <= 0).any():
+            raise ValueError("turn weights must be non-negative with a positive sum for every node and direction")
+        self._turn_probability = table / totals
+
+        # 有向エッジごと(終点ノード, 進入方向)の累積確率. 到着車両の進行方向を一括で引くために用いる
+        # 丸め誤差で確率0の進行方向が選ばれないよう, 以降の確率がすべて0の位置は1とする
+        cumulative = np.cumsum(self._turn_probability, axis=2)
+        remaining = np.cumsum(self._turn_probability[..., ::-1], axis=2)[..., ::-1]
+        cumulative[..., :-1][remaining[..., 1:] == 0] = 1.0
+        cumulative[..., -1] = 1.0
+        entry = np.asarray(self._entry_direction, dtype=np.int64) - 1
+        self._turn_cumulative = cumulative[self._edge_end, entry]
+
+    def turnProbabilityTable(self) -> np.ndarray:
+        """
+        (ノード数 x 4 x 3)の進行方向の確率表を返す. 軸はノードid, 進入方向-1, 進行方向コードの順. 
+        """
+        return self._turn_probability
+
+    def turnCumulativeArray(self) -> np.ndarray:
+        """
+        (有向エッジ数 x 3)の配列を返す. 各行は有向エッジの終点に到着した車両の進行方向の累積確率
+        """
+        return self._turn_cumulative
+
+    def tileAssignment(self, rows: int, cols: int, y_offset: int = 0, x_offset: int = 0) -> np.ndarray:
+        """
+        格子を縦`rows`×横`cols`の矩形のタイルに分け, 各ノードが属するタイルの番号(左上から行優先)を返す
+
+        `y_offset`, `x_offset`を与えるとタイルの境界をその分だけずらす(トーラスの端で折り返す)
+        """
+        width, height = self._mapwidth, self._mapheight
+        y, x = np.divmod(np.arange(width * height), width)
+        y = (y + y_offset) % height
+        x = (x + x_offset) % width
+        return (y * rows // height) * cols + (x * cols // width)
     
 
 
@@ -107,6 +309,8 @@ class Edge:
         
         speed_limit (float): 制限速度[m/s]
     """
+    __slots__ = ("start_id", "end_id", "length", "speed_limit")
+
     def __init__(self, start_id: int, end_id: int, length: float, speed_limit: float):
         self.start_id = start_id
         self.end_id = end_id
@@ -122,47 +326,55 @@ class Node:
         y: 格子状構造のyインデックス
 
         mapref: 親の`MapInfo`クラス
+
+        隣接ノードidは親の`MapInfo`が構築時に設定する. 
     """
+    __slots__ = ("_x", "_y", "_mapref", "_id", "_neighbor_ids")
+
     def __init__(self, x: int, y: int, mapref: MapInfo):
         self._x=x
         self._y=y
         self._mapref=mapref
+        self._id=x+y*mapref.width()
+        self._neighbor_ids: Tuple[int, int, int, int] = ()
 
 
     def getId(self):
         """
         ノードIdを返す. 
         """
-        return self._x+self._y*self._mapref.width()
+        return self._id
 
     def _wrap(self, x, y):
         w, h = self._mapref.width(), self._mapref.height()
         return x % w, y % h
 
+    def neighbor_id(self, direction: int):
+        """
+        方位コード`direction`(1:北, 2:南, 3:東, 4:西)に隣接するノードのIdを返す
+        """
+        return self._neighbor_ids[direction - 1]
+
     def north_id(self):
-        x, y = self._wrap(self._x, self._y - 1)
-        return x + y * self._mapref.width()
+        return self._neighbor_ids[0]
 
     def south_id(self):
-        x, y = self._wrap(self._x, self._y + 1)
-        return x + y * self._mapref.width()
-
-    def west_id(self):
-        x, y = self._wrap(self._x - 1, self._y)
-        return x + y * self._mapref.width()
+        return self._neighbor_ids[1]
 
     def east_id(self):
-        x, y = self._wrap(self._x + 1, self._y)
-        return x + y * self._mapref.width()
+        return self._neighbor_ids[2]
+
+    def west_id(self):
+        return self._neighbor_ids[3]
 
     def north_node(self):
-        return self._mapref.getNode(self.north_id())
+        return self._mapref.getNode(self._neighbor_ids[0])
 
     def south_node(self):
-        return self._mapref.getNode(self.south_id())
+        return self._mapref.getNode(self._neighbor_ids[1])
 
     def west_node(self):
-        return self._mapref.getNode(self.west_id())
+        return self._mapref.getNode(self._neighbor_ids[3])
 
     def east_node(self):
-        return self._mapref.getNode(self.east_id())
\ No newline at end of file
+        return self._mapref.getNode(self._neighbor_ids[2])
@@ -0,0 +1,98 @@
+"""
+可視化を行わないシミュレーションの実行 (ヘッドレス実行)
+
+matplotlib, PIL, IPythonを読み込まず, dimod, nealはそれらでQUBOを解くときにのみ読み込む.
+スイープのワーカーやサーバー上での実行向け. リポジトリのルートで実行する.
+
+    python headless.py --strategy fixed --size 20 --cars 2000 --steps 500 --seed 0
+    python headless.py --strategy qubo --sampler potts --log results/headless.jsonl --metrics results/metrics.csv
+    python headless.py --strategy fixed --size 200 --cars 200000 --steps 200 --tiles 8
+
+集計指標をJSONで標準出力に書き出す.
+"""
+from __future__ import annotations
+from dataclasses import replace
+from time import perf_counter
+from typing import Any, Dict
+import argparse
+import json
+import sys
+
+from param import *
+from history import JsonlHistorySink, SummaryHistorySink
+from instrument import CsvMetricsSink, NULL_INSTRUMENTATION, Recorder
+from simulator import simulation, simulation_init
+
+
+STRATEGIES = {"qubo": UPDATE_STRATEGY_QUBO, "fixed": UPDATE_STRATEGY_FIXED, "random": UPDATE_STRATEGY_RANDOM}
+"""`--strategy`の名前と信号更新の方針"""
+SAMPLERS = {"dimod": SAMPLER_DIMOD, "neal": SAMPLER_NEAL, "potts": SAMPLER_POTTS, "exact": SAMPLER_EXACT}
+"""`--sampler`の名前とサンプラー"""
+ENGINES = {"list": VEHICLE_ENGINE_LIST, "array": VEHICLE_ENGINE_ARRAY, "event": VEHICLE_ENGINE_EVENT}
+"""`--engine`の名前と車両管理方式"""
+
+
+def run_headless(simparams: SimulationParams, coefficient: Coefficient, mapgenparam: MapGenerationParam,
+                 width: int = 6, height: int = 6,
+                 log_path: str | None = None, metrics_path: str | None = None,
+                 tiles: int | None = None) -> Dict[str, Any]:
+    """
+    可視化なしでシミュレーションを実行し, 集計指標を返す
+
+    履歴はメモリに保持しない. `log_path`を与えた場合は履歴をNDJSONで,
+    `metrics_path`を与えた場合はフェーズごとの所要時間をCSVで書き出す.
+    `tiles`を与えた場合はマップを分割してタイルごとのプロセスで実行する(`partitioned.simulation_partitioned`).
+    """
+    simparams = replace(simparams, verbose=False, record_edges=simparams.record_edges and log_path is not None)
+    start = perf_counter()
+    mapinfo, edge_traffics, node_traffics = simulation_init(mapgenparam, width=width, height=height)
+    instrumentation = Recorder([CsvMetricsSink(metrics_path)]) if metrics_path else NULL_INSTRUMENTATION
+    with SummaryHistorySink(JsonlHistorySink(log_path) if log_path else None) as sink:
+        try:
+            if tiles is not None:
+                from partitioned import simulation_partitioned
+                summary = simulation_partitioned(simparams, coefficient, mapinfo, edge_traffics, node_traffics,
+                                                 tiles=tiles, sink=sink, instrumentation=instrumentation)
+            else:
+                summary = simulation(simparams, coefficient, mapinfo, edge_traffics, node_traffics,
+                                     sink=sink, instrumentation=instrumentation)
+        finally:
+            instrumentation.close()
+    summary["wall_time"] = perf_counter() - start
+    return summary
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strategy", choices=STRATEGIES, default="qubo")
+    parser.add_argument("--sampler", choices=SAMPLERS, default="neal")
+    parser.add_argument("--engine", choices=ENGINES, default="list")
+    parser.add_argument("--size", type=int, default=6)
+    parser.add_argument("--cars", type=int, default=100)
+    parser.add_argument("--steps", type=int, default=100)
+    parser.add_argument("--span", type=int, default=10, help="signal update span")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--log", default=None, help="write the history as NDJSON to this path")
+    parser.add_argument("--metrics", default=None, help="write per-step phase timings as CSV to this path")
+    parser.add_argument("--tiles", type=int, default=None, help="split the grid into this many worker processes")
+    parser.add_argument("--resolve-threshold", type=float, default=None,
+                        help="reuse the previous plan while it misses at most this many vehicles per node")
+    parser.add_argument("--solve-cache", type=int, default=0, help="LRU cache size for previously solved states")
+    args = parser.parse_args(argv)
+
+    simparams, coefficient, mapgenparam = apply_seed(
+        args.seed,
+        SimulationParams(update_strategy=STRATEGIES[args.strategy], signal_update_span=args.span,
+                         simulation_time=args.steps),
+        Coefficient(sampler=SAMPLERS[args.sampler],
+                    resolve_threshold=args.resolve_threshold, solve_cache_size=args.solve_cache),
+        MapGenerationParam(car_count=args.cars, vehicle_engine=ENGINES[args.engine]))
+    summary = run_headless(simparams, coefficient, mapgenparam, width=args.size, height=args.size,
+                           log_path=args.log, metrics_path=args.metrics, tiles=args.tiles)
+    json.dump(summary, sys.stdout, indent=2)
+    print()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,416 @@
+from __future__ import annotations
+from typing import Any, Dict, Iterator, List, Tuple
+import json
+import os
+
+import numpy as np
+
+from traffic import FLOWABLE_MODES, MODE_COUNT, TURNS, TURN_CODE, flowable_matrix
+
+
+class HistorySink:
+    """
+    `simulation()`が各ステップの記録(`step_data`)を書き出す先の基底クラス
+
+    `with`文で用いると終了時に`close()`が呼ばれる.
+    """
+    def write(self, step_data: Dict[str, Any]):
+        raise NotImplementedError
+
+    def bind(self, node_traffics: Dict[int, Any]):
+        """
+        `simulation()`が開始時に呼ぶ. 各ステップの`write`の時点の交通状態を直接参照する出力先が用いる
+        """
+
+    def close(self):
+        pass
+
+    def result(self) -> Any:
+        """`simulation()`の戻り値として返す値"""
+        return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ListHistorySink(HistorySink):
+    """
+    全ステップをメモリ上のリストに保持する (従来の`history`)
+    """
+    def __init__(self):
+        self.history: List[Dict[str, Any]] = []
+
+    def write(self, step_data: Dict[str, Any]):
+        self.history.append(step_data)
+
+    def result(self) -> List[Dict[str, Any]]:
+        return self.history
+
+
+class SummaryHistorySink(HistorySink):
+    """
+    履歴を保持せず, 集計指標(Time Wasted合計, 平均流出率, 求解時間)のみを計算する
+
+    `inner`を与えた場合は各ステップをそのまま`inner`にも書き出す(`close`も`inner`へ伝える)
+    """
+    def __init__(self, inner: HistorySink | None = None):
+        self.inner = inner
+        self.steps = 0
+        self.total_time_wasted = 0.0
+        self.total_flow_out = 0
+        self.flowout_ratio_sum = 0.0
+        self.total_solve_time = 0.0
+        self.solve_count = 0
+
+    def write(self, step_data: Dict[str, Any]):
+        self.steps += 1
+        self.total_time_wasted += step_data["timewasted"]
+        self.total_flow_out += step_data["step_flow_out"]
+        self.flowout_ratio_sum += step_data["flowout_ratio"]
+        if step_data["solve_time"] > 0:
+            self.total_solve_time += step_data["solve_time"]
+            self.solve_count += 1
+        if self.inner is not None:
+            self.inner.write(step_data)
+
+    def bind(self, node_traffics: Dict[int, Any]):
+        if self.inner is not None:
+            self.inner.bind(node_traffics)
+
+    def close(self):
+        if self.inner is not None:
+            self.inner.close()
+
+    def result(self) -> Dict[str, Any]:
+        return {
+            "steps": self.steps,
+            "total_time_wasted": self.total_time_wasted,
+            "total_flow_out": self.total_flow_out,
+            "mean_flowout_ratio": self.flowout_ratio_sum / self.steps if self.steps else 0.0,
+            "total_solve_time": self.total_solve_time,
+            "solve_count": self.solve_count,
+        }
+
+
+def _json_keys(mapping: Dict) -> Dict[str, Any]:
+    # JSON化と同じくキーを文字列にそろえる (前ステップとの比較のため)
+    return {str(k): v for k, v in mapping.items()}
+
+
+class JsonlHistorySink(HistorySink):
+    """
+    1ステップ1行のJSON(NDJSON)として逐次書き出す
+
+    `delta=True`の場合, 前ステップから変化したノード・エッジのみを記録する.
+    `keyframe_interval`ステップごと(0なら最初のみ)に全状態を記録するため, その行から読み始められる.
+    保持するのは直前ステップの状態のみで, メモリ使用量はシミュレーション長に依存しない.
+
+    各行は`"keyframe"`(全状態ならtrue)を持つ. 読み出しは`read_history`で行う.
+    """
+    def __init__(self, path: str, delta: bool = True, keyframe_interval: int = 0):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.path = path
+        self.delta = delta
+        self.keyframe_interval = keyframe_interval
+        self._file = open(path, "w", encoding="utf-8")
+        self._count = 0
+        self._prev_nodes: Dict[str, Any] | None = None
+        self._prev_edges: Dict[str, Any] | None = None
+
+    def write(self, step_data: Dict[str, Any]):
+        nodes = _json_keys(step_data.get("nodes", {}))
+        nodes = {k: {"mode": v["mode"], "queues": _json_keys(v["queues"])} for k, v in nodes.items()}
+        edges = step_data.get("edges")
+
+        keyframe = (
+            not self.delta
+            or self._prev_nodes is None
+            or (self.keyframe_interval > 0 and self._count % self.keyframe_interval == 0)
+        )
+
+        record = {k: v for k, v in step_data.items() if k not in ("nodes", "edges")}
+        record["keyframe"] = keyframe
+        if keyframe:
+            record["nodes"] = nodes
+            if edges is not None:
+                record["edges"] = edges
+        else:
+            record["nodes"] = {k: v for k, v in nodes.items() if self._prev_nodes.get(k) != v}
+            if edges is not None:
+                prev_edges = self._prev_edges or {}
+                record["edges"] = {k: v for k, v in edges.items() if prev_edges.get(k) != v}
+
+        self._file.write(json.dumps(record, separators=(",", ":")))
+        self._file.write("\n")
+
+        self._prev_nodes = nodes
+        self._prev_edges = edges
+        self._count += 1
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def result(self) -> str:
+        return self.path
+
+
+def read_history(path: str) -> Iterator[Dict[str, Any]]:
+    """
+    `JsonlHistorySink`の出力を1ステップずつ全状態に復元して返す
+
+    キーはJSONから読み込んだ場合と同じく文字列となる.
+    """
+    nodes: Dict[str, Any] = {}
+    edges: Dict[str, Any] | None = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            keyframe = record.pop("keyframe", True)
+            if keyframe:
+                nodes = record["nodes"]
+                edges = record.get("edges")
+            else:
+                nodes = {**nodes, **record["nodes"]}
+                if "edges" in record:
+                    edges = {**(edges or {}), **record["edges"]}
+            record["nodes"] = nodes
+            if edges is not None:
+                record["edges"] = edges
+            yield record
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    """
+    `JsonlHistorySink`の出力を全ステップ読み込んでリストで返す
+    """
+    return list(read_history(path))
+
+
+SCALAR_DTYPE = np.dtype([
+    ("time", np.int64),
+    ("timewasted", np.float64),
+    ("step_flow_out", np.int64),
+    ("pre_outflow_waiting", np.int64),
+    ("flowout_ratio", np.float64),
+    ("remain_ratio", np.float64),
+    ("solve_time", np.float64),
+])
+"""`ColumnarHistorySink`が1ステップごとに記録するスカラー値"""
+
+QUEUE_DIRECTIONS = (1, 2, 3, 4)
+"""待機台数の配列の方向軸の並び (1:北, 2:南, 3:東, 4:西)"""
+
+FLOWABLE_BY_QUEUE = np.array([
+    [mode_idx in FLOWABLE_MODES[(direction, code)] for mode_idx in range(MODE_COUNT)]
+    for direction in QUEUE_DIRECTIONS for code in range(len(TURNS))
+], dtype=np.int64)
+"""(進入方向 x 進行方向, モード)の0/1行列. 待機台数から流出可能台数$C_{ij}$を求める"""
+
+
+class ColumnarHistorySink(HistorySink):
+    """
+    履歴を列ごとのバイナリファイルとしてディレクトリ`path`に逐次書き出す
+
+    - `scalars.bin`: ステップごとのスカラー値 (`SCALAR_DTYPE`)
+    - `modes.bin`: ノードごとの信号モード (int8, ステップ x ノード)
+    - `queues.bin`: ノード・進入方向・進行方向ごとの待機台数 (int32, ステップ x ノード x 4 x 3)
+    - `flowable.bin`: ノード・モードごとの流出可能台数$C_{ij}$ (int32, ステップ x ノード x 6)
+    - `vehicle_offsets.bin`: 各ステップの車両データの開始位置 (int64)
+    - `vehicle_edge.bin`, `vehicle_pos.bin`: 車両の有向エッジ番号(int32)と位置(float32)
+    - `meta.json`: ノードid・エッジキーの並び
+
+    待機キューは台数のみを記録するため, 車両の並び順は復元されない.
+    読み出しは`ColumnarHistory`で行う.
+
+    `simulation()`から`bind`された場合は, 待機台数を各キューの`TurnQueue.counts()`から,
+    $C_{ij}$を`traffic.flowable_matrix`の行列から直接取るため, 1ステップの処理は車両数によらない.
+    それ以外(`read_history`の履歴を変換する場合など)は`step_data`の待機キューから数える.
+    """
+    def __init__(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self._files = {
+            name: open(os.path.join(path, f"{name}.bin"), "wb")
+            for name in ("scalars", "modes", "queues", "flowable", "vehicle_offsets", "vehicle_edge", "vehicle_pos")
+        }
+        self._node_traffics: Dict[int, Any] | None = None
+        self._node_rows: np.ndarray | None = None
+        self._node_ids: List[str] | None = None
+        self._edge_keys: List[str] | None = None
+        self._vehicle_offset = 0
+        self._count = 0
+
+    def _write_meta(self):
+        with open(os.path.join(self.path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "node_ids": self._node_ids,
+                "edge_keys": self._edge_keys,
+                "steps": self._count,
+            }, f)
+
+    def bind(self, node_traffics: Dict[int, Any]):
+        self._node_traffics = node_traffics
+        # `step_data["nodes"]`と同じ並び(`node_traffics`の順)で流出可能台数の行列の行を取り出す
+        self._node_rows = np.fromiter(node_traffics, dtype=np.int64, count=len(node_traffics))
+
+    def _live_columns(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        node_list = list(self._node_traffics.values())
+        modes = np.array([node.mode for node in node_list], dtype=np.int8)
+        queues = np.array([node.queues[direction].counts() for node in node_list for direction in QUEUE_DIRECTIONS],
+                          dtype=np.int32).reshape(len(node_list), len(QUEUE_DIRECTIONS), len(TURNS))
+        flowable = flowable_matrix(self._node_traffics, len(node_list))[self._node_rows].astype(np.int32)
+        return modes, queues, flowable
+
+    @staticmethod
+    def _record_columns(nodes: Dict[Any, Any]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        node_list = list(nodes.values())
+        modes = np.array([node["mode"] for node in node_list], dtype=np.int8)
+        queues = np.zeros((len(node_list), len(QUEUE_DIRECTIONS), len(TURNS)), dtype=np.int32)
+        for i, node in enumerate(node_list):
+            node_queues = node["queues"]
+            for d_idx, direction in enumerate(QUEUE_DIRECTIONS):
+                turns = node_queues.get(direction, node_queues.get(str(direction), ()))
+                for turn in turns:
+                    queues[i, d_idx, TURN_CODE[turn]] += 1
+        flowable = (queues.reshape(len(node_list), -1) @ FLOWABLE_BY_QUEUE).astype(np.int32)
+        return modes, queues, flowable
+
+    def write(self, step_data: Dict[str, Any]):
+        nodes = step_data.get("nodes", {})
+        edges = step_data.get("edges")
+        if self._node_ids is None:
+            self._node_ids = [str(k) for k in nodes]
+            self._edge_keys = [str(k) for k in edges] if edges is not None else None
+            self._write_meta()
+
+        scalars = np.zeros(1, dtype=SCALAR_DTYPE)
+        for name in SCALAR_DTYPE.names:
+            scalars[name] = step_data.get(name, 0)
+        self._files["scalars"].write(scalars.tobytes())
+
+        if self._node_traffics is not None:
+            modes, queues, flowable = self._live_columns()
+        else:
+            modes, queues, flowable = self._record_columns(nodes)
+        self._files["modes"].write(modes.tobytes())
+        self._files["queues"].write(queues.tobytes())
+        self._files["flowable"].write(flowable.tobytes())
+
+        self._files["vehicle_offsets"].write(np.int64(self._vehicle_offset).tobytes())
+        if edges is not None:
+            positions = list(edges.values())
+            counts = [len(p) for p in positions]
+            edge_idx = np.repeat(np.arange(len(positions), dtype=np.int32), counts)
+            pos = np.fromiter((v for p in positions for v in p), dtype=np.float32, count=sum(counts))
+            self._files["vehicle_edge"].write(edge_idx.tobytes())
+            self._files["vehicle_pos"].write(pos.tobytes())
+            self._vehicle_offset += len(pos)
+
+        self._count += 1
+
+    def close(self):
+        if all(f.closed for f in self._files.values()):
+            return
+        for f in self._files.values():
+            f.close()
+        if self._node_ids is None:
+            self._node_ids, self._edge_keys = [], None
+        self._write_meta()
+
+    def result(self) -> str:
+        return self.path
+
+
+class ColumnarHistory:
+    """
+    `ColumnarHistorySink`の出力をメモリマップで開く読み出しクラス
+
+    開く時点ではファイルを読み込まず, 参照したステップ・列のみが読まれる.
+    `len()`, インデックス参照, 反復で従来の`history`と同じ形式の辞書(キーは文字列)を返すため,
+    `TrafficVisualizer.create_animation`にそのまま渡せる.
+
+    解析には`scalars`(列名で参照可能), `modes`, `queue_counts`, `flowable`, `vehicles(t)`の配列を直接用いる.
+    """
+    def __init__(self, path: str):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        self.node_ids: List[str] = meta["node_ids"]
+        self.edge_keys: List[str] | None = meta["edge_keys"]
+
+        node_count = len(self.node_ids)
+        self.scalars = self._map("scalars", SCALAR_DTYPE)
+        # 書き込み途中で中断された場合も, 完全に書かれたステップまでを扱う
+        steps = len(self.scalars)
+        self.modes = self._map("modes", np.int8, (node_count,))[:steps]
+        self.queue_counts = self._map("queues", np.int32, (node_count, len(QUEUE_DIRECTIONS), len(TURNS)))[:steps]
+        self.flowable = self._map("flowable", np.int32, (node_count, MODE_COUNT))[:steps]
+        if not os.path.exists(os.path.join(path, "flowable.bin")):
+            # 流出可能台数の列がない古い出力では待機台数から求める
+            self.flowable = (self.queue_counts.reshape(len(self.queue_counts), node_count, -1)
+                             @ FLOWABLE_BY_QUEUE).astype(np.int32)
+        self._vehicle_offsets = self._map("vehicle_offsets", np.int64)[:steps]
+        self._vehicle_edge = self._map("vehicle_edge", np.int32)
+        self._vehicle_pos = self._map("vehicle_pos", np.float32)
+        self._steps = min(steps, len(self.modes), len(self.queue_counts), len(self._vehicle_offsets))
+
+    def _map(self, name: str, dtype, shape: Tuple[int, ...] = ()) -> np.ndarray:
+        file_path = os.path.join(self.path, f"{name}.bin")
+        dtype = np.dtype(dtype)
+        item_size = dtype.itemsize * int(np.prod(shape, dtype=np.int64))
+        size = os.path.getsize(file_path) if os.path.exists(file_path) else 0
+        rows = size // item_size if item_size else 0
+        if rows == 0:
+            return np.empty((0, *shape), dtype=dtype)
+        return np.memmap(file_path, dtype=dtype, mode="r", shape=(rows, *shape))
+
+    def __len__(self):
+        return self._steps
+
+    def vehicles(self, t: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        ステップ`t`の車両の(有向エッジ番号, 位置)の配列を返す
+        """
+        start = int(self._vehicle_offsets[t])
+        end = int(self._vehicle_offsets[t + 1]) if t + 1 < self._steps else len(self._vehicle_pos)
+        return self._vehicle_edge[start:end], self._vehicle_pos[start:end]
+
+    def __getitem__(self, t: int) -> Dict[str, Any]:
+        if t < 0:
+            t += self._steps
+        if not 0 <= t < self._steps:
+            raise IndexError(t)
+
+        scalars = self.scalars[t]
+        step_data: Dict[str, Any] = {name: scalars[name].item() for name in SCALAR_DTYPE.names}
+
+        modes = self.modes[t].tolist()
+        counts = self.queue_counts[t].tolist()
+        step_data["nodes"] = {
+            node_id: {
+                "mode": modes[i],
+                "queues": {
+                    str(direction): [turn for code, turn in enumerate(TURNS) for _ in range(counts[i][d_idx][code])]
+                    for d_idx, direction in enumerate(QUEUE_DIRECTIONS)
+                },
+            }
+            for i, node_id in enumerate(self.node_ids)
+        }
+
+        if self.edge_keys is not None:
+            edge_idx, pos = self.vehicles(t)
+            per_edge: List[List[float]] = [[] for _ in self.edge_keys]
+            for e, p in zip(edge_idx.tolist(), pos.tolist()):
+                per_edge[e].append(round(p, 2))
+            step_data["edges"] = dict(zip(self.edge_keys, per_edge))
+        return step_data
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for t in range(self._steps):
+            yield self[t]
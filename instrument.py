@@ -0,0 +1,253 @@
+from __future__ import annotations
+from time import perf_counter
+from typing import Any, Dict, List
+import csv
+import os
+
+
+PHASES = ("edge_update", "signal_update", "qubo_build", "sampling", "decode", "node_flow", "timewasted", "record")
+"""計測するフェーズ. `signal_update`は`qubo_build`・`sampling`・`decode`を含む"""
+
+COUNTERS = ("vehicles_moved", "queue_push", "queue_pop", "qubo_nonzeros", "onehot_violations", "solves_reused",
+            "fixed_nodes")
+"""
+計測するカウンタ
+
+- vehicles_moved: エッジ上で前進させた車両数
+- queue_push: 交差点のキューに入った車両数
+- queue_pop: 交差点から流出した車両数
+- qubo_nonzeros: 求解したQUBOの非ゼロ係数の数 (線形項 + 二次項)
+- onehot_violations: one-hot制約を満たさなかったノード数
+- solves_reused: 交通状態がほとんど変わらず, 解き直さずに過去の解を使った信号更新の数 (`solving/policy.py`)
+- fixed_nodes: 待機車両がなく, 現在のモードに固定して求解から除いたノード数
+"""
+
+GAUGES = ("timewasted", "flowout_ratio", "remain_ratio", "node_count")
+"""ステップごとの値 (`end_step`で与える)"""
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Instrumentation:
+    """
+    計測を行わない既定の実装
+
+    すべての操作は何もしない. 呼び出し側はループ内の集計など追加の計算が必要な箇所だけ
+    `enabled`で分岐すればよい.
+    """
+    enabled = False
+
+    def phase(self, name: str):
+        """
+        `with instrumentation.phase("edge_update"):`の形でブロックの所要時間を計測する
+        """
+        return _NULL_PHASE
+
+    def add_time(self, name: str, seconds: float):
+        """フェーズ`name`に所要時間を加算する"""
+
+    def count(self, name: str, value: int = 1):
+        """カウンタ`name`に`value`を加算する"""
+
+    def end_step(self, time: int, **gauges: Any):
+        """1ステップ分の計測を確定して出力先へ渡す"""
+
+    def close(self):
+        """出力先を閉じる"""
+
+
+NULL_INSTRUMENTATION = Instrumentation()
+"""計測を行わない共有インスタンス"""
+
+
+class _Phase:
+    __slots__ = ("_recorder", "_name", "_start")
+
+    def __init__(self, recorder: "Recorder", name: str):
+        self._recorder = recorder
+        self._name = name
+
+    def __enter__(self):
+        self._start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._recorder.add_time(self._name, perf_counter() - self._start)
+        return False
+
+
+class Recorder(Instrumentation):
+    """
+    フェーズごとの所要時間とカウンタをステップ単位で集計し, `sinks`へ渡す
+
+    各ステップの記録は`{"time": t, "phases": {...}, "counters": {...}, "gauges": {...}}`の辞書
+    """
+    enabled = True
+
+    def __init__(self, sinks: List["MetricsSink"]):
+        self.sinks = list(sinks)
+        self._phases: Dict[str, float] = {}
+        self._counters: Dict[str, int] = {}
+
+    def phase(self, name: str):
+        return _Phase(self, name)
+
+    def add_time(self, name: str, seconds: float):
+        self._phases[name] = self._phases.get(name, 0.0) + seconds
+
+    def count(self, name: str, value: int = 1):
+        self._counters[name] = self._counters.get(name, 0) + value
+
+    def end_step(self, time: int, **gauges: Any):
+        record = {"time": time, "phases": self._phases, "counters": self._counters, "gauges": gauges}
+        for sink in self.sinks:
+            sink.write(record)
+        self._phases = {}
+        self._counters = {}
+
+    def close(self):
+        for sink in self.sinks:
+            sink.close()
+
+
+class MetricsSink:
+    """
+    ステップごとの計測結果の出力先の基底クラス
+    """
+    def write(self, record: Dict[str, Any]):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class MemoryMetricsSink(MetricsSink):
+    """
+    計測結果をメモリ上のリストに保持する
+    """
+    def __init__(self):
+        self.records: List[Dict[str, Any]] = []
+
+    def write(self, record: Dict[str, Any]):
+        self.records.append(record)
+
+    def totals(self) -> Dict[str, float]:
+        """
+        全ステップのフェーズ所要時間とカウンタの合計を返す
+        """
+        totals: Dict[str, float] = {}
+        for record in self.records:
+            for group in ("phases", "counters"):
+                for name, value in record[group].items():
+                    totals[name] = totals.get(name, 0) + value
+        return totals
+
+
+def _flat_fieldnames() -> List[str]:
+    return (["time"] + [f"{name}_seconds" for name in PHASES] + list(COUNTERS) + list(GAUGES))
+
+
+class CsvMetricsSink(MetricsSink):
+    """
+    計測結果を1ステップ1行のCSVへ書き出す. 列は`PHASES`(`*_seconds`), `COUNTERS`, `GAUGES`
+    """
+    def __init__(self, path: str):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=_flat_fieldnames(), extrasaction="ignore")
+        self._writer.writeheader()
+
+    def write(self, record: Dict[str, Any]):
+        row = {"time": record["time"]}
+        row.update({f"{name}_seconds": value for name, value in record["phases"].items()})
+        row.update(record["counters"])
+        row.update(record["gauges"])
+        self._writer.writerow(row)
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+
+class PrometheusTextSink(MetricsSink):
+    """
+    計測結果の累計をPrometheusのtext-file形式(node_exporterのtextfile collector向け)で書き出す
+
+    `every`ステップごとに一時ファイルへ書いてから置き換えるため, 読み取り側が途中の内容を見ることはない
+    """
+    def __init__(self, path: str, every: int = 1, prefix: str = "sa_traffic"):
+        output_dir = os.path.dirname(path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        self.path = path
+        self.every = max(every, 1)
+        self.prefix = prefix
+        self._phases: Dict[str, float] = {}
+        self._counters: Dict[str, int] = {}
+        self._gauges: Dict[str, Any] = {}
+        self._steps = 0
+
+    def write(self, record: Dict[str, Any]):
+        for name, value in record["phases"].items():
+            self._phases[name] = self._phases.get(name, 0.0) + value
+        for name, value in record["counters"].items():
+            self._counters[name] = self._counters.get(name, 0) + value
+        self._gauges = dict(record["gauges"], step=record["time"])
+        self._steps += 1
+        if self._steps % self.every == 0:
+            self._flush()
+
+    def _flush(self):
+        p = self.prefix
+        lines = [
+            f"# HELP {p}_phase_seconds_total Wall time spent in each simulation phase.",
+            f"# TYPE {p}_phase_seconds_total counter",
+        ]
+        lines += [f'{p}_phase_seconds_total{{phase="{name}"}} {value:.9f}' for name, value in sorted(self._phases.items())]
+        for name, value in sorted(self._counters.items()):
+            lines += [f"# TYPE {p}_{name}_total counter", f"{p}_{name}_total {value}"]
+        for name, value in sorted(self._gauges.items()):
+            lines += [f"# TYPE {p}_{name} gauge", f"{p}_{name} {value}"]
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+
+    def close(self):
+        if self._steps % self.every != 0:
+            self._flush()
+
+
+class ConsoleSink(MetricsSink):
+    """
+    計測結果をコンソールへ表示する (従来の`verbose`出力)
+
+    毎ステップの指標を同じ行に上書き表示し, SAを実行したステップではone-hot制約の検査結果を表示する
+    """
+    def write(self, record: Dict[str, Any]):
+        time = record["time"]
+        gauges = record["gauges"]
+        counters = record["counters"]
+        if "sampling" in record["phases"]:
+            violations = counters.get("onehot_violations", 0)
+            node_count = gauges.get("node_count", 0)
+            elapsed = record["phases"].get("signal_update", 0.0)
+            if violations > 0:
+                print(f"\n[Time {time}] SA Optimization complete ({elapsed:.3f}s). "
+                      f"--- Summary: {violations}/{node_count} nodes had one-hot violations. ---")
+            else:
+                print(f"\n[Time {time}] SA Optimization complete ({elapsed:.3f}s). "
+                      f"--- SA Optimization Success: All nodes satisfied one-hot constraint. ---")
+        print(f"\r[Time {time}] Time Waste: {gauges.get('timewasted', 0.0): 8.3f} "
+              f"Outflow Ratio: {gauges.get('flowout_ratio', 0.0): 4.2f} Remain Ratio: {gauges.get('remain_ratio', 0.0): 4.2f}", end="")
@@ -1,37 +1,55 @@
 from graph import *
 from simulator import simulation, simulation_init
 from visualize import TrafficVisualizer
-import json
-import os
+from history import JsonlHistorySink, read_history
 
 from param import SimulationParams, Coefficient, MapGenerationParam
 
-def main(simparams: SimulationParams, coefficient: Coefficient, mapgenparam: MapGenerationParam):
-    
+LOG_PATH = "results/simulation_log.jsonl"
+"""履歴(NDJSON)の出力先"""
+
+def main(simparams: SimulationParams, coefficient: Coefficient, mapgenparam: MapGenerationParam,
+         keep_history: bool = True):
+    """
+    シミュレーションを実行し, 履歴を`LOG_PATH`へ書き出してGIFアニメーションを生成する
+
+    `keep_history`が真なら従来どおり履歴をメモリに保持して返す.
+    偽なら各ステップを逐次ファイルへ書き出すのみで履歴を保持せず, Noneを返す(長時間のシミュレーション向け).
+    """
+
     mapinfo, edge_traffics, node_traffics = simulation_init(mapgenparam, width=6, height=6)
-    
 
 
-    history = simulation(simparams, coefficient , mapinfo, edge_traffics, node_traffics)
-    savelog(history)
-    
+
+    if keep_history:
+        history = simulation(simparams, coefficient , mapinfo, edge_traffics, node_traffics)
+        savelog(history)
+    else:
+        # 各ステップを逐次ファイルへ書き出す (メモリに履歴を保持しない)
+        with JsonlHistorySink(LOG_PATH) as sink:
+            simulation(simparams, coefficient , mapinfo, edge_traffics, node_traffics, sink=sink)
+        print(f"Log saved to {LOG_PATH}")
+        history = None
+
         # ループが終わった後に可視化を呼び出す
     viz = TrafficVisualizer(fps=10)
-    viz.create_animation(history, mapinfo)
-    viz.save_animation()
-    
-    return history 
+    # 保持していない場合, 履歴はファイルから1ステップずつ読み, フレームを保持せず並列に描画したものから順にGIFへ書き出す
+    viz.render_animation(read_history(LOG_PATH) if history is None else history, mapinfo, "results/simulation.gif")
 
+    return history
 
 
-def savelog(history):
+
+def savelog(history, path: str = LOG_PATH):
     """
-    `history`のJSON出力
+    `history`を`JsonlHistorySink`で`path`へ書き出す
+
+    以前はJSON配列として`results/simulation_log.json`へ書き出していた. 読み出しは`history.read_history`で行う.
     """
-    os.makedirs("results", exist_ok=True)
-    with open("results/simulation_log.json", "w", encoding="utf-8") as f:
-        json.dump(history, f, indent=2)
-    print("Log saved to results/simulation_log.json")
+    with JsonlHistorySink(path) as sink:
+        for step_data in history:
+            sink.write(step_data)
+    print(f"Log saved to {path}")
 
 
 
@@ -39,8 +57,4 @@ if __name__ == "__main__":
     simparams = SimulationParams()
     coefficient=Coefficient()
     mapgenparam=MapGenerationParam()
-    main(simparams, coefficient, mapgenparam)
-
-
-
-
+    main(simparams, coefficient, mapgenparam, keep_history=False)
@@ -1,5 +1,5 @@
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Tuple
 from enum import Enum
 
 
@@ -11,8 +11,26 @@ UPDATE_STRATEGY_RANDOM = 2
 """`SimulationParams.update_strategy`にて, 完全ランダムによる信号更新を選択する定数 """
 INITAL_SIGNAL_RANDOM = 0
 """`MapGenerationParam.inital_signal`にて, 完全ランダムな信号初期化を要求する定数"""
+VEHICLE_ENGINE_LIST = 0
+"""`MapGenerationParam.vehicle_engine`にて, エッジごとのPythonリストで車両を管理する定数"""
+VEHICLE_ENGINE_ARRAY = 1
+"""`MapGenerationParam.vehicle_engine`にて, NumPy配列(`VehicleStore`)で車両を一括管理する定数"""
+VEHICLE_ENGINE_EVENT = 2
+"""`MapGenerationParam.vehicle_engine`にて, 到着イベントの優先度付きキュー(`EventVehicleStore`)で車両を管理する定数"""
+PIPELINE_NONE = 0
+"""`SimulationParams.solve_pipeline`にて, シミュレーションを止めてQUBOを解く(同期実行)定数"""
+PIPELINE_THREAD = 1
+"""`SimulationParams.solve_pipeline`にて, QUBOをバックグラウンドのスレッドで解く定数"""
+PIPELINE_PROCESS = 2
+"""`SimulationParams.solve_pipeline`にて, QUBOをバックグラウンドのワーカープロセスで解く定数"""
 SAMPLER_DIMOD = 0
+"""`Coefficient.sampler`にて, `dimod.SimulatedAnnealingSampler`を選択する定数"""
 SAMPLER_NEAL = 1
+"""`Coefficient.sampler`にて, `neal.SimulatedAnnealingSampler`を選択する定数"""
+SAMPLER_POTTS = 2
+"""`Coefficient.sampler`にて, モードを整数で直接扱うPottsモデルのSA(`solving/potts_sa.py`)を選択する定数"""
+SAMPLER_EXACT = 3
+"""`Coefficient.sampler`にて, 動的計画法による厳密解法(`solving/exact_dp.py`)を選択する定数. 細長い小さなマップやタイル向け"""
 
 
 @dataclass
@@ -34,6 +52,63 @@ class Coefficient:
     num_sweeps: int = 4000
     """サンプリングの深さ"""
     sampler: int = SAMPLER_NEAL
+    """
+    QUBOを解くサンプラー
+
+    - 0: dimod
+    - 1: neal
+    - 2: Pottsモデル (one-hotを常に満たすため`lambda3`は使われない)
+    - 3: 厳密解法 (one-hot状態での最適解. 6x6程度までのマップか, `solve_tile_size`が5程度までのタイル分割で用いる.
+      解けないほど大きい場合は警告を出してPottsモデルで解く)
+    """
+    warm_start: bool = False
+    """
+    現在の信号モードを初期状態として低温側から焼きなますか? 
+
+    有効な場合は`num_sweeps`の代わりに`warm_start_sweeps`を上限とし, 状態が変化しなくなった時点で打ち切る.
+    Pottsモデルでのみ有効. nealとdimodでは無視して通常どおり解く
+    (1ビットの反転ではone-hotの壁(`lambda3`)を越えられず, 低温側から始めるとモードが変わらないため)
+    """
+    warm_start_sweeps: int = 500
+    """warm start時のスイープ数の上限"""
+    warm_start_chunk: int = 50
+    """warm start時に凍結(状態が変化しなくなったか)を判定するスイープ間隔"""
+    warm_start_beta_fraction: float = 0.5
+    """
+    warm start時の開始逆温度. 既定の逆温度範囲(高温〜低温)を等比でこの割合だけ低温側に進めた値から始める
+    """
+    seed: int | None = None
+    """
+    サンプラーの乱数シード. 各求解では`(seed, 時刻)`から乱数列を作るため, 同じ時刻の求解は同じ結果になる.
+    Noneなら毎回異なる. nealとPottsモデルで有効 (dimodはグローバルの`random`を用いるため指定できない)
+    """
+    solve_tile_size: int = 0
+    """
+    QUBOをタイルに分割して解く場合のタイルの一辺のノード数 (`solving/tiled.py`). 0なら全体を1つのQUBOとして解く
+    """
+    solve_tile_rounds: int = 2
+    """
+    タイル分割での求解の回数. 2回目以降はタイルの境界を半分ずらし, タイル外のノードを直前の解に固定して解き直す
+    """
+    solve_workers: int | None = None
+    """
+    タイルを並列に解くプロセス数. Noneならタイル数とCPUコア数の小さい方. 1ならプロセスを使わず順に解く
+    """
+    resolve_threshold: float | None = None
+    """
+    前回解いたときから有効なtau(QUBOに項が現れるQ2の組)とその組に現れるノードの$C_{ij}$が変わらず,
+    それ以外のノードで前回の解が取りこぼす1交差点あたりの車両数$\\sum_i (\\max_j C_{ij} - C_{i s_i}) / N$が
+    この値以下なら, 解き直さず前回の解を使う (`solving/policy.py`).
+    0なら前回の解で足りる場合のみ省く. Noneなら毎回解く
+    """
+    solve_cache_size: int = 0
+    """$C_{ij}$と有効なtauが一致する過去の状態の解を再利用するLRUキャッシュの件数. 0なら使わない"""
+    fix_trivial_nodes: bool = False
+    """
+    全モードで$C_{ij}=0$(待機車両がない)のノードを現在のモードに固定し, 残りのノードだけのQUBOを解くか? 
+    固定したノードはどのモードでもエネルギーが変わらないため最適解は変わらないが,
+    サンプラーに渡す問題と乱数の消費が変わるため, 同じシードでも結果は無効時と一致しない. タイル分割(`solve_tile_size`)では用いない
+    """
 
 @dataclass
 class MapGenerationParam:
@@ -46,6 +121,26 @@ class MapGenerationParam:
     car_count: int=100
     """シミュレーション内の車の数"""
     inital_signal: int = INITAL_SIGNAL_RANDOM
+    vehicle_engine: int = VEHICLE_ENGINE_LIST
+    """
+    エッジ上の車両の管理方式
+
+    - 0: エッジごとのPythonリスト
+    - 1: NumPy配列による一括管理 (車両数が多い場合に高速)
+    - 2: 到着イベント駆動 (車両がまばらな大規模マップ・長時間で高速. `dt=1.0`固定)
+    """
+    seed: int | None = None
+    """マップ生成(制限速度, 初期信号, 車両配置)の乱数シード. Noneなら毎回異なる"""
+    turn_weights: List = field(
+        default_factory=lambda: [0.8, 0.2, 0.0]
+    )
+    """
+    交差点での進行方向(直進, 右折, 左折)の重み. 進入方向ごと・ノードごとに正規化される
+
+    - 長さ3のリスト: 全ノード・全進入方向で共通
+    - (4 x 3)の入れ子リスト: 進入方向(北・南・東・西)ごと
+    - (ノード数 x 4 x 3)の入れ子リスト: ノード・進入方向ごと
+    """
 
 @dataclass
 class SimulationParams:
@@ -63,6 +158,57 @@ class SimulationParams:
     """シミュレーション時間設定"""
     show_mode_change: bool = False
     """SA実行後にモード変化をprintするか?"""
+    verbose: bool = True
+    """進行状況やSAの結果をprintするか?"""
+    record_edges: bool = True
+    """
+    履歴に各エッジの車両位置を記録するか?
+
+    Falseにすると毎ステップ全車両を走査する必要がなくなり, イベント駆動エンジンの効果が大きくなる
+    """
+    solve_pipeline: int = PIPELINE_NONE
+    """
+    QUBOによる信号更新の実行方式 (`update_strategy`がQUBOのときのみ有効)
+
+    - 0: 同期実行 (求解が終わるまでシミュレーションを止める)
+    - 1: スレッドで並行実行
+    - 2: ワーカープロセスで並行実行
+
+    並行実行では時刻tの交通状態のスナップショットから解き, 結果を時刻t+`solve_lag`で反映する
+    """
+    solve_lag: int = 1
+    """並行実行時, 求解を始めてから結果を反映するまでのステップ数 (0なら同じステップで待って反映する)"""
+    solve_deadline: float | None = None
+    """
+    並行実行時, 求解開始からの待ち時間の上限 [秒]. 
+    反映するステップまでに間に合わなければ結果を捨てて現在のモードを維持する. Noneなら完了まで待つ
+    捨てた求解が実行中の間は, 次の更新の求解を投入しない
+    """
+    seed: int | None = None
+    """シミュレーション(交差点での進行方向, ランダムな信号更新)の乱数シード. Noneなら毎回異なる"""
 
 
 
+
+
+def apply_seed(seed: int | None, simparams: SimulationParams, coefficient: Coefficient,
+               mapgenparam: MapGenerationParam) -> Tuple[SimulationParams, Coefficient, MapGenerationParam]:
+    """
+    1つのシード`seed`から, マップ生成・シミュレーション・サンプラーに互いに独立なシードを作り,
+    `seed`がNoneの設定にだけ与えたコピーを返す (`seed`がNoneならそのまま返す)
+
+    同じ整数を3つの`default_rng`に渡すと乱数列が同じになり相関するため, `SeedSequence(seed).spawn(3)`で分ける.
+    """
+    if seed is None:
+        return simparams, coefficient, mapgenparam
+    import numpy as np
+    from dataclasses import replace
+    map_seed, sim_seed, solve_seed = (int(child.generate_state(1, np.uint64)[0])
+                                      for child in np.random.SeedSequence(seed).spawn(3))
+    if simparams.seed is None:
+        simparams = replace(simparams, seed=sim_seed)
+    if coefficient.seed is None:
+        coefficient = replace(coefficient, seed=solve_seed)
+    if mapgenparam.seed is None:
+        mapgenparam = replace(mapgenparam, seed=map_seed)
+    return simparams, coefficient, mapgenparam
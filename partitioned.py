@@ -0,0 +1,653 @@
+"""
+格子を矩形のタイルに分割し, タイルごとのワーカープロセスで並列にシミュレーションする (領域分割)
+
+各タイルは自身の交差点(ノード)と, そこへ向かう有向エッジ上の車両を所有する.
+交差点の待機台数・信号モード・エッジ間の受け渡しは共有メモリ上の配列に置き,
+ワーカーはバリアで1ステップごとに同期する.
+
+- タイル境界を越える車両は, 流出元のタイルが行先エッジの「進入台数」に書き込み,
+  次のステップで行先エッジを所有するタイルが位置0に追加する
+- 進行方向・ランダムな信号更新の乱数は, タイルごとに独立な乱数列(`Generator.spawn`)から自分の到着車両・ノードの分だけ引く.
+  `match_serial=True`(検証用)では全タイルが同じ乱数列の複製から全体の分を引いて自分の分を取り出すため,
+  同じシードの`simulation()`と同じ結果になるが, タイルごとの処理量がマップ全体に比例する
+- ステップごとの指標(Time Wasted, 流出台数, 待機台数)はタイルごとの整数の集計をコーディネーター(親プロセス)が合計する
+
+待機車両は(進入方向, 進行方向)ごとの台数のみを保持する. FIFO順は`flow_limit`を超えて待機した場合にのみ影響し,
+その場合は直進・右折・左折の順に流出させる(既定の`flow_limit`=10000では生じない).
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from time import perf_counter
+from typing import Any, Dict, List, Tuple
+import math
+import multiprocessing
+import multiprocessing.connection
+import os
+import threading
+
+import numpy as np
+
+from graph import MapInfo
+from history import HistorySink, ListHistorySink
+from instrument import Instrumentation, NULL_INSTRUMENTATION, Recorder, ConsoleSink
+from param import *
+from traffic import EdgeTraffic, NodeTraffic, FLOWABLE_MODES, MODE_COUNT, MODE_FLOW, TURN_CODE, TURNS
+from vehicles import VehicleStore
+import solving.solve_sa
+from solving.policy import make_policy
+
+
+STAT_FLOW_OUT = 0
+"""タイルごとの集計(`stats`)の列: 流出台数"""
+STAT_PRE_WAITING = 1
+"""タイルごとの集計(`stats`)の列: 流出前の待機台数"""
+STAT_POST_WAITING = 2
+"""タイルごとの集計(`stats`)の列: 流出後の待機台数. 以降の列は行先エッジの速度クラスごとの待機台数"""
+
+
+def tile_grid(width: int, height: int, tiles: int) -> Tuple[int, int]:
+    """
+    `tiles`個のタイルの(行数, 列数)を返す
+
+    行数×列数=`tiles`となる組のうち, タイルが最も正方形に近い(境界のエッジが少ない)ものを選ぶ
+    """
+    if tiles < 1:
+        raise ValueError(f"tiles must be positive, got {tiles}")
+    best = None
+    for rows in range(1, tiles + 1):
+        if tiles % rows:
+            continue
+        cols = tiles // rows
+        if rows > height or cols > width:
+            continue
+        # タイル1枚の境界の長さ (縦横の比が1に近いほど短い)
+        boundary = height / rows + width / cols
+        if best is None or boundary < best[0]:
+            best = (boundary, rows, cols)
+    if best is None:
+        raise ValueError(f"cannot split a {width}x{height} grid into {tiles} tiles")
+    return best[1], best[2]
+
+
+def default_tile_count(width: int, height: int, limit: int | None = None) -> int:
+    """
+    `limit`(省略時はCPUコア数)以下で, `tile_grid`で分割できる最大のタイル数を返す
+
+    例えば6x6のマップを7コアで実行する場合, 7個には分割できないため6を返す.
+    """
+    limit = limit or os.cpu_count() or 1
+    for tiles in range(min(limit, width*height), 1, -1):
+        try:
+            tile_grid(width, height, tiles)
+        except ValueError:
+            continue
+        return tiles
+    return 1
+
+
+@dataclass
+class TileTables:
+    """
+    全タイルが参照するマップの整数・実数テーブル (実行中は変化しない)
+    """
+    edge_start: np.ndarray
+    """有向エッジの始点ノード"""
+    edge_end: np.ndarray
+    """有向エッジの終点ノード"""
+    entry: np.ndarray
+    """有向エッジ終点への進入方向-1"""
+    edge_length: np.ndarray
+    edge_speed: np.ndarray
+    turn_cumulative: np.ndarray
+    """`MapInfo.turnCumulativeArray()`"""
+    next_edge: np.ndarray
+    """`MapInfo.nextEdgeTable()`"""
+    edge_class: np.ndarray
+    """有向エッジの速度クラス (`bind_waste_tally`と同じ分類)"""
+    class_weights: List[float]
+    """速度クラスごとのTime Wastedの重み"""
+    allowed: np.ndarray
+    """(`MODE_COUNT`+1)×4×3の流出許可. 行0は不正なモード(何も流さない)"""
+    flow_limit: int
+
+    @classmethod
+    def from_mapinfo(cls, mapinfo: MapInfo, flow_limit: int) -> "TileTables":
+        class_speeds, edge_class = np.unique(mapinfo.edgeSpeedArray(), return_inverse=True)
+        allowed = np.zeros((MODE_COUNT + 1, 4, len(TURNS)), dtype=bool)
+        for mode, flows in MODE_FLOW.items():
+            for direction, turns in flows.items():
+                for turn in turns:
+                    allowed[mode, direction - 1, TURN_CODE[turn]] = True
+        return cls(
+            edge_start=np.asarray(mapinfo.edgeStartArray(), dtype=np.int64),
+            edge_end=np.asarray(mapinfo.edgeEndArray(), dtype=np.int64),
+            entry=np.array([mapinfo.entryDirection(i) - 1 for i in range(len(mapinfo.directedEdgeKeys()))], dtype=np.int64),
+            edge_length=mapinfo.edgeLengthArray(),
+            edge_speed=mapinfo.edgeSpeedArray(),
+            turn_cumulative=mapinfo.turnCumulativeArray(),
+            next_edge=mapinfo.nextEdgeTable(),
+            edge_class=edge_class.astype(np.int64),
+            class_weights=(class_speeds / mapinfo.globalMaxSpeed()).tolist(),
+            allowed=allowed,
+            flow_limit=flow_limit,
+        )
+
+
+@dataclass
+class TileSpec:
+    """
+    1タイルの所有範囲と初期状態
+    """
+    index: int
+    nodes: np.ndarray
+    """所有するノード"""
+    in_edges: np.ndarray
+    """所有するノードへ向かう有向エッジ (車両を所有する)"""
+    out_edges: np.ndarray
+    """所有するノードから出る有向エッジ (進入台数を書き込む)"""
+    vehicle_edges: np.ndarray
+    """初期車両の有向エッジ (`in_edges`内の位置)"""
+    vehicle_positions: np.ndarray
+    """初期車両の位置"""
+
+
+class SharedState:
+    """
+    名前つき共有メモリ上に置いたNumPy配列の組
+
+    `create`で確保した側(コーディネーター)が`close`で解放する.
+    ワーカーは`layout()`を受け取って`attach`する. `shared=False`なら通常の配列を用いる(プロセス内実行).
+    """
+    def __init__(self, arrays: Dict[str, np.ndarray], blocks: List[shared_memory.SharedMemory], owner: bool):
+        self.arrays = arrays
+        self._blocks = blocks
+        self._owner = owner
+
+    @classmethod
+    def create(cls, specs: Dict[str, Tuple[Tuple[int, ...], str]], shared: bool = True) -> "SharedState":
+        arrays, blocks = {}, []
+        for name, (shape, dtype) in specs.items():
+            if not shared:
+                arrays[name] = np.zeros(shape, dtype=dtype)
+                continue
+            size = max(1, math.prod(shape) * np.dtype(dtype).itemsize)
+            block = shared_memory.SharedMemory(create=True, size=size)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+            arrays[name][...] = 0
+        return cls(arrays, blocks, owner=True)
+
+    def layout(self) -> Dict[str, Tuple[str, Tuple[int, ...], str]]:
+        """
+        {配列名: (共有メモリ名, 形状, dtype)}を返す
+        """
+        return {
+            name: (block.name, array.shape, array.dtype.str)
+            for (name, array), block in zip(self.arrays.items(), self._blocks)
+        }
+
+    @classmethod
+    def attach(cls, layout: Dict[str, Tuple[str, Tuple[int, ...], str]]) -> "SharedState":
+        arrays, blocks = {}, []
+        for name, (block_name, shape, dtype) in layout.items():
+            block = shared_memory.SharedMemory(name=block_name, track=False)
+            blocks.append(block)
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        return cls(arrays, blocks, owner=False)
+
+    def close(self):
+        # 共有メモリを閉じる前に, バッファを参照する配列を手放す
+        self.arrays.clear()
+        for block in self._blocks:
+            block.close()
+            if self._owner:
+                block.unlink()
+        self._blocks = []
+
+
+def _replicate_rng(bit_generator_class, state: Dict[str, Any]) -> np.random.Generator:
+    bit_generator = bit_generator_class()
+    bit_generator.state = state
+    return np.random.Generator(bit_generator)
+
+
+def _is_update_step(time: int, span: int) -> bool:
+    return time % span == 0 and time > 0
+
+
+class Tile:
+    """
+    1タイル分のシミュレーション
+
+    1ステップは`advance` → `enqueue` → (全タイルの同期) → `flow` → (全タイルの同期)の順に呼ぶ.
+    信号を更新するステップでは`enqueue`の後に`update_modes`を呼び, (QUBOでは)コーディネーターがモードを書き込む.
+    `shared_stream`なら全タイルの到着台数を読むため, `advance`と`enqueue`の間でも同期する.
+    """
+    def __init__(self, spec: TileSpec, tables: TileTables, state: SharedState, rng: np.random.Generator,
+                 strategy: int, span: int, dt: float = 1.0, shared_stream: bool = False):
+        self.index = spec.index
+        self.tables = tables
+        self.state = state
+        self.rng = rng
+        self.shared_stream = shared_stream
+        self.strategy = strategy
+        self.span = span
+        self.dt = dt
+
+        self.nodes = spec.nodes
+        self.in_edges = spec.in_edges
+        self.out_edges = spec.out_edges
+        self.in_end = tables.edge_end[self.in_edges]
+        self.in_entry = tables.entry[self.in_edges]
+        self.in_cumulative = tables.turn_cumulative[self.in_edges]
+        self.next_edges = tables.next_edge[self.nodes]
+        self.waste_classes = tables.edge_class[self.next_edges].ravel()
+        self.class_count = len(tables.class_weights)
+
+        self.store = VehicleStore(
+            list(zip(tables.edge_start[self.in_edges].tolist(), self.in_end.tolist())),
+            edge_length=tables.edge_length[self.in_edges],
+            edge_speed=tables.edge_speed[self.in_edges],
+        )
+        self.store.add_many(spec.vehicle_edges, spec.vehicle_positions)
+
+    def advance(self):
+        """
+        前のステップで流入した車両を位置0に追加し, 所有する全車両を進め, エッジごとの到着台数を書き込む
+        """
+        arrays = self.state.arrays
+        entering = arrays["entering"][self.in_edges]
+        if entering.any():
+            self.store.add_many(np.repeat(np.arange(len(self.in_edges)), entering), np.zeros(int(entering.sum())))
+        arrived = self.store.advance(self.dt)
+        arrays["arrivals"][self.in_edges] = np.bincount(arrived, minlength=len(self.in_edges))
+
+    def enqueue(self):
+        """
+        到着した車両の進行方向を引いて待機台数に加える
+
+        乱数は自身の乱数列から自分の到着台数分だけ引く. `shared_stream`なら全タイルが同じ数だけ消費する(`_shared_draws`)
+        """
+        arrays = self.state.arrays
+        queue_counts = arrays["queue_counts"]
+        counts = arrays["arrivals"][self.in_edges]
+        if self.shared_stream:
+            local, draws = self._shared_draws(arrays["arrivals"], counts)
+        else:
+            local = np.repeat(np.arange(len(self.in_edges)), counts)
+            draws = self.rng.random(len(local))
+        if len(local):
+            codes = (self.in_cumulative[local] <= draws[:, None]).sum(axis=1)
+            np.add.at(queue_counts, (self.in_end[local], self.in_entry[local], codes), 1)
+
+        arrays["stats"][self.index, STAT_PRE_WAITING] = queue_counts[self.nodes].sum()
+
+    def _shared_draws(self, arrivals: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        全エッジの到着台数分の乱数を引き, (到着車両の`in_edges`内の位置, その車両の乱数)を返す
+
+        乱数は`simulation()`と同じく有向エッジ順, 同一エッジ内では到着順に1台1つ割り当てられる
+        """
+        total = int(arrivals.sum())
+        hit = np.flatnonzero(counts)
+        if not total:
+            return np.zeros(0, dtype=np.int64), np.zeros(0)
+        draws = self.rng.random(total)
+        offsets = np.cumsum(arrivals) - arrivals
+        n = counts[hit]
+        local = np.repeat(hit, n)
+        draw_index = np.repeat(offsets[self.in_edges[hit]] - (np.cumsum(n) - n), n) + np.arange(len(local))
+        return local, draws[draw_index]
+
+    def update_modes(self, time: int):
+        """
+        固定サイクル・ランダムの方針で所有するノードの信号モードを更新する (QUBOではコーディネーターが書き込む)
+        """
+        modes = self.state.arrays["modes"]
+        if self.strategy == UPDATE_STRATEGY_FIXED:
+            modes[self.nodes] = (time // 10) % 6 + 1
+        elif self.strategy == UPDATE_STRATEGY_RANDOM:
+            if self.shared_stream:
+                modes[self.nodes] = self.rng.integers(1, 7, size=len(modes))[self.nodes]
+            else:
+                modes[self.nodes] = self.rng.integers(1, 7, size=len(self.nodes))
+
+    def flow(self):
+        """
+        信号モードで許可された車両を流出させ, 行先エッジの進入台数とタイルの集計を書き込む
+        """
+        arrays = self.state.arrays
+        tables = self.tables
+        counts = arrays["queue_counts"][self.nodes]
+        modes = arrays["modes"][self.nodes]
+        allowed = tables.allowed[np.where((modes >= 1) & (modes <= MODE_COUNT), modes, 0)]
+
+        out = np.where(allowed, counts, 0)
+        # 1方向あたりflow_limit台まで (直進・右折・左折の順に流す)
+        before = np.cumsum(out, axis=2) - out
+        out = np.minimum(out, np.maximum(tables.flow_limit - before, 0))
+        counts -= out
+        arrays["queue_counts"][self.nodes] = counts
+
+        entering = arrays["entering"]
+        entering[self.out_edges] = 0
+        moved = out > 0
+        np.add.at(entering, self.next_edges[moved], out[moved])
+
+        stats = arrays["stats"][self.index]
+        stats[STAT_FLOW_OUT] = out.sum()
+        stats[STAT_POST_WAITING] = counts.sum()
+        stats[STAT_POST_WAITING + 1:] = np.bincount(self.waste_classes, weights=counts.ravel(),
+                                                    minlength=self.class_count)
+
+
+def _run_tile_worker(spec: TileSpec, tables: TileTables, layout, barrier, rng: np.random.Generator,
+                     strategy: int, span: int, steps: int, shared_stream: bool):
+    """
+    ワーカープロセスで1タイルを`steps`ステップ進める. 同期の順序は`_ProcessTiles`と対応する
+    """
+    state = SharedState.attach(layout)
+    try:
+        tile = Tile(spec, tables, state, rng, strategy, span, shared_stream=shared_stream)
+        for time in range(steps):
+            tile.advance()
+            if shared_stream:
+                # 全タイルの到着台数が書き込まれるのを待つ
+                barrier.wait()
+            tile.enqueue()
+            barrier.wait()
+            if _is_update_step(time, span):
+                tile.update_modes(time)
+                # (QUBOでは)コーディネーターが待機台数を読んでモードを書き込むのを待つ
+                barrier.wait()
+            tile.flow()
+            barrier.wait()
+    except BaseException:
+        # 他のワーカーとコーディネーターの待機を解く
+        barrier.abort()
+        raise
+    finally:
+        tile = None
+        state.close()
+
+
+class _InlineTiles:
+    """
+    全タイルをコーディネーターのプロセス内で順に実行する
+    """
+    def __init__(self, tiles: List[Tile]):
+        self.tiles = tiles
+
+    def step_edges(self, time: int):
+        for tile in self.tiles:
+            tile.advance()
+        for tile in self.tiles:
+            tile.enqueue()
+
+    def update_modes(self, time: int):
+        for tile in self.tiles:
+            tile.update_modes(time)
+
+    def flow(self, time: int):
+        for tile in self.tiles:
+            tile.flow()
+
+    def abort(self):
+        pass
+
+    def close(self):
+        self.tiles = []
+
+
+class _ProcessTiles:
+    """
+    タイルごとのワーカープロセスと同期する
+
+    ワーカーが異常終了した場合はバリアを壊し, コーディネーターの待機を`BrokenBarrierError`で解く
+    """
+    def __init__(self, specs: List[TileSpec], tables: TileTables, state: SharedState, rngs: List[np.random.Generator],
+                 strategy: int, span: int, steps: int, shared_stream: bool):
+        context = multiprocessing.get_context()
+        self.barrier = context.Barrier(len(specs) + 1)
+        self.shared_stream = shared_stream
+        self.processes = [
+            context.Process(target=_run_tile_worker, daemon=True,
+                            args=(spec, tables, state.layout(), self.barrier, rng, strategy, span, steps, shared_stream))
+            for spec, rng in zip(specs, rngs)
+        ]
+        for process in self.processes:
+            process.start()
+        self._closed = threading.Event()
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def _watch(self):
+        pending = {process.sentinel: process for process in self.processes}
+        while pending and not self._closed.is_set():
+            for sentinel in multiprocessing.connection.wait(list(pending), timeout=0.5):
+                process = pending.pop(sentinel)
+                # sentinelが閉じた直後はexitcodeが未確定のことがあるため回収を待つ
+                process.join()
+                if process.exitcode != 0:
+                    self.barrier.abort()
+                    return
+
+    def step_edges(self, time: int):
+        if self.shared_stream:
+            self.barrier.wait()
+        self.barrier.wait()
+
+    def update_modes(self, time: int):
+        self.barrier.wait()
+
+    def flow(self, time: int):
+        self.barrier.wait()
+
+    def abort(self):
+        # 同期を待っているワーカーを終了させる
+        self.barrier.abort()
+
+    def close(self):
+        self._closed.set()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self._watcher.join()
+
+
+def build_tiles(mapinfo: MapInfo, edge_traffics: Dict[Tuple[int, int], EdgeTraffic],
+                tiles: int) -> List[TileSpec]:
+    """
+    マップを`tiles`個の矩形に分割し, 各タイルの所有範囲と初期車両を返す
+    """
+    width, height = mapinfo.width(), mapinfo.height()
+    owner = mapinfo.tileAssignment(*tile_grid(width, height, tiles))
+    edge_keys = mapinfo.directedEdgeKeys()
+    edge_owner = owner[np.asarray(mapinfo.edgeEndArray(), dtype=np.int64)]
+    start_owner = owner[np.asarray(mapinfo.edgeStartArray(), dtype=np.int64)]
+
+    # 初期車両 (有向エッジ順, 同一エッジ内では挿入順)
+    vehicle_edges, vehicle_positions = [], []
+    for edge_idx, key in enumerate(edge_keys):
+        positions = edge_traffics[key].vehicles
+        vehicle_edges.extend([edge_idx] * len(positions))
+        vehicle_positions.extend(positions)
+    vehicle_edges = np.asarray(vehicle_edges, dtype=np.int64)
+    vehicle_positions = np.asarray(vehicle_positions, dtype=float)
+
+    specs = []
+    for index in range(tiles):
+        in_edges = np.flatnonzero(edge_owner == index)
+        local_index = np.full(len(edge_keys), -1, dtype=np.int64)
+        local_index[in_edges] = np.arange(len(in_edges))
+        mine = edge_owner[vehicle_edges] == index
+        specs.append(TileSpec(
+            index=index,
+            nodes=np.flatnonzero(owner == index),
+            in_edges=in_edges,
+            out_edges=np.flatnonzero(start_owner == index),
+            vehicle_edges=local_index[vehicle_edges[mine]],
+            vehicle_positions=vehicle_positions[mine],
+        ))
+    return specs
+
+
+def _flowable_matrix() -> np.ndarray:
+    """
+    (進入方向, 進行方向)ごとの待機台数(12列)から$C_{ij}$(`MODE_COUNT`列)への変換行列
+    """
+    matrix = np.zeros((4 * len(TURNS), MODE_COUNT), dtype=np.int64)
+    for (direction, code), mode_indices in FLOWABLE_MODES.items():
+        matrix[(direction - 1) * len(TURNS) + code, mode_indices] = 1
+    return matrix
+
+
+def simulation_partitioned(simparams: SimulationParams, coefficient: Coefficient, mapinfo: MapInfo,
+                           edge_traffics: Dict[Tuple[int, int], EdgeTraffic], node_traffics: Dict[int, NodeTraffic],
+                           tiles: int | None = None, processes: bool = True,
+                           sink: HistorySink | None = None, instrumentation: Instrumentation | None = None,
+                           rng: np.random.Generator | None = None, match_serial: bool = False) -> Any:
+    """
+    `simulation()`と同じシミュレーションを, マップを`tiles`個のタイルに分割して実行する
+
+    `tiles`を省略するとCPUコア数以下で分割できる最大の数(`default_tile_count`)とする.
+    `processes=False`ならタイルを1プロセス内で順に実行する.
+    `simulation_init`で生成した交通状態を初期状態として読むが, 書き換えはしない.
+
+    各ステップの記録はスカラー値(`time`, `timewasted`, `step_flow_out`, `pre_outflow_waiting`,
+    `flowout_ratio`, `remain_ratio`, `solve_time`)のみ. `solve_time`は`simulation()`と同じく
+    信号を更新するステップでのモード更新(QUBOの求解を含む)の所要時間である.
+    `sink`, `instrumentation`の扱いは`simulation()`と同じ. QUBOは同期実行のみ対応する.
+
+    乱数(進行方向, ランダムな信号更新)はタイルごとに`rng.spawn`で分けた乱数列から引く. 省略時は`simparams.seed`から生成する.
+    `match_serial=True`なら全タイルが`rng`の複製から`simulation()`と同じ順に引くため, 結果は同じシードの`simulation()`と一致する.
+    検証用で, 各タイルが毎ステップ全体の到着台数分の乱数を引くためタイル数を増やしても速くならない.
+    """
+    if simparams.update_strategy == UPDATE_STRATEGY_QUBO and simparams.solve_pipeline != PIPELINE_NONE:
+        raise ValueError("simulation_partitioned does not support solve_pipeline")
+    if sink is None:
+        sink = ListHistorySink()
+    if instrumentation is None:
+        instrumentation = Recorder([ConsoleSink()]) if simparams.verbose else NULL_INSTRUMENTATION
+    if rng is None:
+        rng = np.random.default_rng(simparams.seed)
+    if tiles is None:
+        tiles = default_tile_count(mapinfo.width(), mapinfo.height())
+
+    node_count = mapinfo.width()*mapinfo.height()
+    edge_count = len(mapinfo.directedEdgeKeys())
+    strategy = simparams.update_strategy
+    span = simparams.signal_update_span
+    steps = simparams.simulation_time
+    policy = None
+    if strategy == UPDATE_STRATEGY_QUBO:
+        solving.solve_sa.preload_sampler(coefficient)
+        policy = make_policy(coefficient, mapinfo)
+
+    tables = TileTables.from_mapinfo(mapinfo, next(iter(node_traffics.values())).flow_limit_value)
+    specs = build_tiles(mapinfo, edge_traffics, tiles)
+    state = SharedState.create({
+        "queue_counts": ((node_count, 4, len(TURNS)), "i8"),
+        "modes": ((node_count,), "i8"),
+        "arrivals": ((edge_count,), "i8"),
+        "entering": ((edge_count,), "i8"),
+        "stats": ((tiles, STAT_POST_WAITING + 1 + len(tables.class_weights)), "i8"),
+    }, shared=processes)
+    for node_id, node_traffic in node_traffics.items():
+        state.arrays["modes"][node_id] = node_traffic.mode
+        for direction, queue in node_traffic.queues.items():
+            state.arrays["queue_counts"][node_id, direction - 1] = queue.counts()
+
+    flowable_matrix = _flowable_matrix()
+    total_vehicles = int(state.arrays["queue_counts"].sum()) + sum(len(spec.vehicle_positions) for spec in specs)
+    post_outflow_waiting = int(state.arrays["queue_counts"].sum())
+    total_time_wasted = 0.0
+
+    if simparams.verbose:
+        print(f"--- Partitioned Simulation Started (T={steps}, tiles={tiles}) ---")
+
+    runner = None
+    try:
+        if match_serial:
+            rngs = [_replicate_rng(type(rng.bit_generator), rng.bit_generator.state) for _ in specs]
+        else:
+            rngs = rng.spawn(len(specs))
+        if processes:
+            runner = _ProcessTiles(specs, tables, state, rngs, strategy, span, steps, shared_stream=match_serial)
+        else:
+            runner = _InlineTiles([
+                Tile(spec, tables, state, tile_rng, strategy, span, shared_stream=match_serial)
+                for spec, tile_rng in zip(specs, rngs)
+            ])
+        arrays = state.arrays
+
+        for time in range(steps):
+            # 車両の移動と, 到着した車両の待機列への追加 (simulation()のupdate_edge_trafficに相当)
+            with instrumentation.phase("edge_update"):
+                runner.step_edges(time)
+
+            solve_time = 0.0
+            if _is_update_step(time, span):
+                solve_start = perf_counter()
+                if strategy == UPDATE_STRATEGY_QUBO:
+                    flowable = arrays["queue_counts"].reshape(node_count, -1) @ flowable_matrix
+                    modes = arrays["modes"]
+                    current_modes = np.where((modes >= 1) & (modes <= MODE_COUNT), modes - 1, 0)
+                    new_modes = solving.solve_sa.solve_modes(coefficient, time, flowable, mapinfo,
+                                                             current_modes=current_modes,
+                                                             instrumentation=instrumentation, policy=policy)
+                    for node_id, mode_id in new_modes.items():
+                        modes[node_id] = mode_id
+                runner.update_modes(time)
+                solve_time = perf_counter() - solve_start
+                instrumentation.add_time("signal_update", solve_time)
+
+            with instrumentation.phase("node_flow"):
+                runner.flow(time)
+
+            with instrumentation.phase("timewasted"):
+                totals = arrays["stats"].sum(axis=0).tolist()
+                step_flow_out = totals[STAT_FLOW_OUT]
+                pre_outflow_waiting = totals[STAT_PRE_WAITING]
+                # WasteTally.total()と同じ順に積和をとる
+                step_time_wasted = sum(count * weight for count, weight in
+                                       zip(totals[STAT_POST_WAITING + 1:], tables.class_weights))
+            if instrumentation.enabled:
+                instrumentation.count("vehicles_moved", total_vehicles - post_outflow_waiting)
+                instrumentation.count("queue_push", pre_outflow_waiting - post_outflow_waiting)
+                instrumentation.count("queue_pop", step_flow_out)
+            post_outflow_waiting = totals[STAT_POST_WAITING]
+
+            flowout_ratio = step_flow_out / pre_outflow_waiting if pre_outflow_waiting > 0 else 0.0
+            remain_ratio = post_outflow_waiting / pre_outflow_waiting if pre_outflow_waiting > 0 else 0.0
+            total_time_wasted += step_time_wasted
+            with instrumentation.phase("record"):
+                sink.write({
+                    "time": time,
+                    "timewasted": step_time_wasted,
+                    "step_flow_out": step_flow_out,
+                    "pre_outflow_waiting": pre_outflow_waiting,
+                    "flowout_ratio": flowout_ratio,
+                    "remain_ratio": remain_ratio,
+                    "solve_time": solve_time,
+                })
+            instrumentation.end_step(time, timewasted=step_time_wasted, flowout_ratio=flowout_ratio,
+                                     remain_ratio=remain_ratio, node_count=node_count)
+    except BaseException:
+        if runner is not None:
+            runner.abort()
+        raise
+    finally:
+        arrays = None
+        if runner is not None:
+            runner.close()
+        state.close()
+
+    if simparams.verbose:
+        print("\n--- Simulation Finished ---\n")
+        print(f"Total Time Waste: {total_time_wasted:10.2f}")
+
+    return sink.result()
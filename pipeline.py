@@ -0,0 +1,178 @@
+from __future__ import annotations
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from dataclasses import dataclass
+from time import perf_counter
+from typing import Dict, Tuple
+
+import numpy as np
+
+from graph import MapInfo
+from instrument import Instrumentation, NULL_INSTRUMENTATION
+from param import Coefficient, PIPELINE_PROCESS, PIPELINE_THREAD
+from solving.policy import ResolvePolicy, make_policy
+from solving.solve_sa import current_mode_array, flowable_count_matrix, preload_sampler, solve_modes
+
+
+_worker_mapinfo: MapInfo | None = None
+"""求解ワーカープロセス内で使い回すマップ"""
+_worker_policy: ResolvePolicy | None = None
+"""求解ワーカープロセス内で前回解いた状態を保持する方針"""
+
+
+def _init_solver_worker(mapinfo: MapInfo, coefficient: Coefficient):
+    global _worker_mapinfo, _worker_policy
+    _worker_mapinfo = mapinfo
+    _worker_policy = make_policy(coefficient, mapinfo)
+    preload_sampler(coefficient)
+
+
+class CounterInstrumentation(Instrumentation):
+    """
+    求解ワーカー内でカウンタだけを集計する計測
+
+    フェーズの所要時間はシミュレーションのステップと重なるため記録しない.
+    集計したカウンタは結果とともに呼び出し側へ返し, 呼び出し側の計測に加算する.
+    """
+    enabled = True
+
+    def __init__(self):
+        self.counters: Dict[str, int] = {}
+
+    def count(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+
+def _solve_counted(coefficient: Coefficient, time: int, flowable: np.ndarray, mapinfo: MapInfo,
+                   current_modes: np.ndarray, policy: ResolvePolicy | None,
+                   count: bool) -> Tuple[Dict[int, int], Dict[str, int]]:
+    """
+    `solve_modes`を実行し, (新しいモード, 求解中に集計したカウンタ)を返す. `count`が偽ならカウンタは空
+    """
+    instrumentation = CounterInstrumentation() if count else NULL_INSTRUMENTATION
+    modes = solve_modes(coefficient, time, flowable, mapinfo, current_modes=current_modes, policy=policy,
+                        instrumentation=instrumentation)
+    return modes, instrumentation.counters if count else {}
+
+
+def _solve_in_worker(coefficient: Coefficient, time: int, flowable: np.ndarray, current_modes: np.ndarray,
+                     count: bool) -> Tuple[Dict[int, int], Dict[str, int]]:
+    return _solve_counted(coefficient, time, flowable, _worker_mapinfo, current_modes, _worker_policy, count)
+
+
+@dataclass
+class PendingSolve:
+    """
+    実行中の求解1件
+    """
+    time: int
+    """スナップショットを取った時刻"""
+    apply_time: int
+    """結果を反映する時刻"""
+    submitted: float
+    """求解を始めた時点の`perf_counter()`"""
+    future: Future
+
+
+class SolvePipeline:
+    """
+    QUBOによる信号更新をシミュレーションと並行して実行するクラス
+
+    `submit`で現在の$C_{ij}$とモードのスナップショットを取ってバックグラウンドで解き始め,
+    `lag`ステップ後の`collect`で結果を受け取る. `deadline`秒以内に終わらなかった結果は捨てる.
+    ワーカーは1つのため, 前の求解が(期限切れで捨てたものも含め)まだ実行中なら`submit`は何もしない.
+
+    求解中のカウンタ(`solves_reused`, `fixed_nodes`, `qubo_nonzeros`など)は結果とともに受け取り,
+    反映した求解の分を`instrumentation`に加算する.
+    """
+    def __init__(self, mode: int, coefficient: Coefficient, mapinfo: MapInfo,
+                 lag: int = 1, deadline: float | None = None,
+                 instrumentation: Instrumentation = NULL_INSTRUMENTATION):
+        if lag < 0:
+            raise ValueError(f"lag must be non-negative, got {lag}")
+        self.coefficient = coefficient
+        self.mapinfo = mapinfo
+        self.lag = lag
+        self.deadline = deadline
+        self.instrumentation = instrumentation
+        self.node_count = mapinfo.width()*mapinfo.height()
+
+        if mode == PIPELINE_PROCESS:
+            self._executor = ProcessPoolExecutor(max_workers=1, initializer=_init_solver_worker, initargs=(mapinfo, coefficient))
+            self._solve = _solve_in_worker
+        elif mode == PIPELINE_THREAD:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+            policy = make_policy(coefficient, mapinfo)
+            self._solve = lambda coefficient, time, flowable, current_modes, count: _solve_counted(
+                coefficient, time, flowable, mapinfo, current_modes, policy, count)
+        else:
+            raise ValueError(f"Unknown pipeline mode: {mode}")
+
+        self._pending: deque[PendingSolve] = deque()
+        self._running: Future | None = None
+        """最後に投入した求解 (期限切れで`_pending`から外しても, 終わるまでワーカーを占有する)"""
+        self.applied = 0
+        """反映した求解の数"""
+        self.missed = 0
+        """期限に間に合わず捨てた求解の数"""
+        self.skipped = 0
+        """前の求解が実行中だったため投入しなかった更新の数"""
+
+    def submit(self, time: int, node_traffics: Dict):
+        """
+        時刻`time`の交通状態のスナップショットを取り, 求解を始める
+
+        前の求解がまだ実行中の場合は, ワーカーの後ろに待たせず何もしない(`skipped`に数える).
+        待たせると期限切れの求解の後ろで古いスナップショットが順に解かれ, 以降の求解もすべて遅れるため.
+        """
+        if self._running is not None and not self._running.done():
+            self.skipped += 1
+            return
+        flowable = flowable_count_matrix(node_traffics, self.mapinfo).copy()
+        current_modes = current_mode_array(node_traffics, self.node_count)
+        future = self._executor.submit(self._solve, self.coefficient, time, flowable, current_modes,
+                                       self.instrumentation.enabled)
+        self._running = future
+        self._pending.append(PendingSolve(time, time + self.lag, perf_counter(), future))
+
+    def collect(self, time: int) -> Tuple[Dict[int, int] | None, int | None]:
+        """
+        時刻`time`に反映すべき求解の結果を返す
+
+        戻り値は(新しいモードの辞書, スナップショットの時刻). 反映するものがない,
+        または期限に間に合わなかった場合のモードはNone.
+        複数が該当する場合は最も新しいスナップショットの結果を返す.
+        """
+        result, result_time = None, None
+        while self._pending and self._pending[0].apply_time <= time:
+            pending = self._pending.popleft()
+            timeout = None
+            if self.deadline is not None:
+                timeout = max(0.0, pending.submitted + self.deadline - perf_counter())
+            try:
+                modes, counters = pending.future.result(timeout=timeout)
+            except TimeoutError:
+                # 実行中の求解は止められないため, 結果を捨てるだけにする
+                pending.future.cancel()
+                self.missed += 1
+                continue
+            result, result_time = modes, pending.time
+            for name, value in counters.items():
+                self.instrumentation.count(name, value)
+            self.applied += 1
+        return result, result_time
+
+    def close(self):
+        """
+        未反映の求解を破棄してワーカーを終了する
+        """
+        for pending in self._pending:
+            pending.future.cancel()
+        self._pending.clear()
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
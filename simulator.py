@@ -1,13 +1,16 @@
 from traffic import *
 from graph import *
-import random
-import matplotlib.pyplot as plt
+import numpy as np
 import os
+from time import perf_counter
 from typing import Dict, Tuple, List, Any
-import pdb
-import visualize
 import solving.solve_sa
+from solving.policy import ResolvePolicy, make_policy
 from param import *
+from history import HistorySink, ListHistorySink
+from vehicles import VehicleStore, EventVehicleStore, ArrayEdgeTraffic, get_vehicle_store
+from pipeline import SolvePipeline
+from instrument import Instrumentation, NULL_INSTRUMENTATION, Recorder, ConsoleSink
 
 
 
@@ -22,21 +25,34 @@ def determine_direction(from_id: int, to_id: int, mapinfo: MapInfo) -> int:
 
     to_idノードに対するfrom_idノードの位置を返す
     """
-    to_node = mapinfo.getNode(to_id)
-
-    if   to_node.north_id() == from_id:
-        return 1
-    elif to_node.south_id() == from_id:
-        return 2
-    elif to_node.east_id()  == from_id:
-        return 3
-    elif to_node.west_id()  == from_id:
-        return 4
-    
-    return None
-    
+    edge_idx = mapinfo.directedEdgeIndex(from_id, to_id)
+    if edge_idx is None:
+        return None
+    return mapinfo.entryDirection(edge_idx)
+
 
 
+def draw_turn_codes(mapinfo: MapInfo, edge_indices: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+    """
+    有向エッジ`edge_indices`の終点に到着した車両の進行方向コードを一括で引く
+
+    確率は`MapInfo.turnCumulativeArray()`(終点ノード・進入方向ごと)に従う. 乱数は到着順に1台1つ消費する
+    """
+    cumulative = mapinfo.turnCumulativeArray()[edge_indices]
+    return (cumulative <= rng.random(len(edge_indices))[:, None]).sum(axis=1)
+
+
+def add_arrivals(mapinfo: MapInfo, node_traffics: Dict, edge_indices, rng: np.random.Generator):
+    """
+    有向エッジ`edge_indices`の終端に到達した車両を, 進行方向を引いた上で終点ノードのキューに追加する
+    """
+    edge_indices = np.asarray(edge_indices, dtype=np.int64)
+    if len(edge_indices) == 0:
+        return
+    turn_codes = draw_turn_codes(mapinfo, edge_indices, rng).tolist()
+    end_node_ids = mapinfo.edgeEndArray()[edge_indices].tolist()
+    for edge_idx, end_node_id, code in zip(edge_indices.tolist(), end_node_ids, turn_codes):
+        node_traffics[end_node_id].add_vehicle(mapinfo.entryDirection(edge_idx), TURNS[code])
 
 
 def get_next_node(current_node: Node, direction: int, turn: str) -> Node | None:
@@ -49,15 +65,7 @@ def get_next_node(current_node: Node, direction: int, turn: str) -> Node | None:
     if next_direction is None:
         return None
 
-    if   next_direction == 1:
-        return current_node.north_node()
-    elif next_direction == 2:
-        return current_node.south_node()
-    elif next_direction == 3:
-        return current_node.east_node()
-    elif next_direction == 4:
-        return current_node.west_node()
-    return None
+    return current_node._mapref.getNode(current_node.neighbor_id(next_direction))
 
 def calc_mode_fixedcycle(time: int, edge_traffics: Dict, node_traffics: Dict) -> Dict[int, int]:
     """
@@ -71,54 +79,60 @@ def calc_mode_fixedcycle(time: int, edge_traffics: Dict, node_traffics: Dict) ->
         mode_dict[node_id] = (time // 10) % 6 + 1 
     return mode_dict
 
-def calc_mode_randomcycle(time: int, edge_traffics: Dict, node_Traffics: Dict) -> Dict[int, int]:
+def calc_mode_randomcycle(time: int, edge_traffics: Dict, node_Traffics: Dict,
+                          rng: np.random.Generator | None = None) -> Dict[int, int]:
     """
     信号モード切り替えのロジック (完全ランダム制)
 
     ランダムサイクルによる信号モードを返す
     """
-    
-    mode_dict = {}
-    for node_id in node_Traffics:
-        # 呼び出しごとにモードをランダムに割り当て
-        mode_dict[node_id]= random.randint(1, 6)
-    return mode_dict
+    if rng is None:
+        rng = np.random.default_rng()
+    # 呼び出しごとにモードをランダムに割り当て
+    modes = rng.integers(1, 7, size=len(node_Traffics)).tolist()
+    return dict(zip(node_Traffics, modes))
 
 def calc_step_timewasted(mapinfo: MapInfo, node_traffics: Dict) -> float:
     """
     単位時間あたり(ステップごと)のTime Wasted合計値を計算する
+
+    `bind_waste_tally`で逐次集計が設定されていれば, その合計を定数時間で返す
     """
+    tally = get_waste_tally(node_traffics)
+    if tally is not None:
+        return tally.total()
+
     # 計測されたTime Wasted
     waste = 0.0
     # マップ内最高速度
     max_speed=mapinfo.globalMaxSpeed()
 
+    # 有向エッジごとの重み (制限速度 / マップ内最高速度)
+    edge_weights = (mapinfo.edgeSpeedArray() / max_speed).tolist()
+
     # すべてのノードについて調査
     for node_id, node_traffic in node_traffics.items():
-        current_node= mapinfo.getNode(nodeid=node_id)
         # 各ノードのすべての待機(すべての行先キュー)について調査
         for direction, queue in node_traffic.queues.items():
             for turn in queue:
-                # 行先ノードの取得
-                next_node = get_next_node(current_node, direction, turn)
-
-                if next_node: 
-                    next_node_id=next_node.getId()
-                    # 行先エッジの取得
-                    edge=mapinfo.getEdgeBetween(node_id, next_node_id)
-                    # Wasteの加算
-                    if edge: 
-                        waste += edge.speed_limit / max_speed
+                # 行先エッジの重みを加算
+                waste += edge_weights[mapinfo.nextEdgeIndex(node_id, direction, TURN_CODE[turn])]
     return waste
 
 
 # --- メインロジック ---
 
-def simulation_init(mapgenparam :MapGenerationParam, width: int = 6, height: int = 6, ) -> Tuple[MapInfo, Dict[Tuple[int, int], EdgeTraffic], Dict[int, NodeTraffic]]:
+def simulation_init(mapgenparam :MapGenerationParam, width: int = 6, height: int = 6,
+                    rng: np.random.Generator | None = None) -> Tuple[MapInfo, Dict[Tuple[int, int], EdgeTraffic], Dict[int, NodeTraffic]]:
     """
     シミュレーションの初期設定: マップ、交通オブジェクトの生成、車両の初期配置
+
+    乱数は`rng`から引く. 省略時は`mapgenparam.seed`から生成する
     """  
-    mapinfo = MapInfo(width, height, mapgenparam.edge_length, mapgenparam.edge_speed_limit_array)
+    if rng is None:
+        rng = np.random.default_rng(mapgenparam.seed)
+    mapinfo = MapInfo(width, height, mapgenparam.edge_length, mapgenparam.edge_speed_limit_array, rng=rng,
+                      turn_weights=mapgenparam.turn_weights)
 
     node_traffics: Dict[int, NodeTraffic] = {} 
     edge_traffics: Dict[Tuple[int, int], EdgeTraffic] = {}
@@ -130,16 +144,36 @@ def simulation_init(mapgenparam :MapGenerationParam, width: int = 6, height: int
         edge_traffics[(a, b)] = EdgeTraffic(start_id=a, end_id=b)
         edge_traffics[(b, a)] = EdgeTraffic(start_id=b, end_id=a)
 
+    if mapgenparam.vehicle_engine in (VEHICLE_ENGINE_ARRAY, VEHICLE_ENGINE_EVENT):
+        # 有向エッジの並びはそのままに, 車両を一括管理するストアのビューへ差し替える
+        edge_keys = mapinfo.directedEdgeKeys()
+        store_class = VehicleStore if mapgenparam.vehicle_engine == VEHICLE_ENGINE_ARRAY else EventVehicleStore
+        store = store_class(
+            edge_keys,
+            edge_length=mapinfo.edgeLengthArray(),
+            edge_speed=mapinfo.edgeSpeedArray(),
+        )
+        edge_traffics = {
+            (a, b): ArrayEdgeTraffic(start_id=a, end_id=b, store=store, edge_idx=i)
+            for i, (a, b) in enumerate(edge_keys)
+        }
+
     for node_id in range(width * height):
         node_traffics[node_id] = NodeTraffic()
         if mapgenparam.inital_signal==INITAL_SIGNAL_RANDOM: 
-            node_traffics[node_id].mode=random.randint(1, 6)
+            node_traffics[node_id].mode=int(rng.integers(1, 7))
         else:
             node_traffics[node_id].mode=mapgenparam.inital_signal
 
+    # モードごとの流出可能台数をマップ全体の行列として保持する
+    bind_flowable_matrix(node_traffics, width * height)
+    # Time Wastedを待機車両の増減に合わせて逐次集計する
+    bind_waste_tally(node_traffics, mapinfo)
+
     # 車をランダムに設置する
+    edge_keys = list(edge_traffics.keys())
     for _ in range(mapgenparam.car_count):
-        edge_key = random.choice(list(edge_traffics.keys()))
+        edge_key = edge_keys[rng.integers(len(edge_keys))]
         edge_traffic = edge_traffics[edge_key]
 
         edge = mapinfo.getEdgeBetween(edge_key[0], edge_key[1])
@@ -147,15 +181,29 @@ def simulation_init(mapgenparam :MapGenerationParam, width: int = 6, height: int
             continue
 
         # ランダムな位置（0〜length）に車両を配置
-        position = random.uniform(0, edge.length)
-        edge_traffic.vehicles.append(position)
+        position = rng.uniform(0, edge.length)
+        edge_traffic.add_vehicle(position)
     
     return mapinfo, edge_traffics, node_traffics
 
-def update_edge_traffic(mapinfo: MapInfo, edge_traffics: Dict, node_traffics: Dict, dt: float = 1.0):
+def update_edge_traffic(mapinfo: MapInfo, edge_traffics: Dict, node_traffics: Dict, dt: float = 1.0,
+                        rng: np.random.Generator | None = None):
     """
     エッジ上の車両を移動させ、終点に到達した車両をキューに追加する。
+
+    到達した車両の進行方向はステップごとに`rng`から一括で引く. 
+    乱数はどの車両管理方式でも同じ順(到達した有向エッジの順)に消費される
     """
+    if rng is None:
+        rng = np.random.default_rng()
+    store = get_vehicle_store(edge_traffics)
+    if store is not None:
+        # 配列・イベント実装: 一括で前進させ, 到達した車両のみを処理する
+        add_arrivals(mapinfo, node_traffics, store.advance(dt), rng)
+        return
+
+    # 終端に到達した車両の有向エッジ (到達順)
+    arrivals = []
     for key, traffic in edge_traffics.items():
         # 無向グラフからエッジプロパティを取得
         edge = mapinfo.getEdgeBetween(key[0], key[1])
@@ -172,19 +220,13 @@ def update_edge_traffic(mapinfo: MapInfo, edge_traffics: Dict, node_traffics: Di
                 new_positions.append(new_pos)
             else:
                 # 車両が終端に到達 → Nodeへ移行（交差点待機状態）
-                end_node_id = key[1]
-                
-                # 進入方向の決定
-                direction = determine_direction(key[0], key[1], mapinfo)
-                
-                # 進行方向の決定（左折確率0）
-                turn = random.choices(["straight", "right", "left"], weights=[0.8, 0.2, 0.0])[0]
-                
-                # 終点ノードのキューに追加
-                node_traffics[end_node_id].add_vehicle(direction, turn)
+                arrivals.append(mapinfo.directedEdgeIndex(key[0], key[1]))
                 
         traffic.vehicles = new_positions
 
+    # 進行方向を一括で決定し, 終点ノードのキューに追加
+    add_arrivals(mapinfo, node_traffics, arrivals, rng)
+
 def update_node_traffic(mapinfo: MapInfo, edge_traffics: Dict, node_traffics: Dict):
     """
     交差点キューの車両を信号とフローリミットに従って次エッジへ流出させる。
@@ -200,48 +242,47 @@ def update_node_traffic(mapinfo: MapInfo, edge_traffics: Dict, node_traffics: Di
 
         for (direction, turn), count in flow_result.items():
             total_flow_out += count
-            for _ in range(count):
-                current_node = mapinfo.getNode(node_id)
-                # 次に進むノード（流出先）を取得
-                next_node = get_next_node(current_node, direction, turn)
-                
-                if next_node is None:
-                    continue
-
-                start_id = node_id
-                end_id = next_node.getId()
-                edge_key = (start_id, end_id)
+            # 次に進む有向エッジ（流出先）を取得
+            edge_key = mapinfo.directedEdgeKeys()[mapinfo.nextEdgeIndex(node_id, direction, TURN_CODE[turn])]
 
-                # 次のエッジが存在するか確認（有向エッジ）
-                if edge_key not in edge_traffics:
-                    continue
+            # 次のエッジが存在するか確認（有向エッジ）
+            if edge_key not in edge_traffics:
+                continue
 
+            next_traffic = edge_traffics[edge_key]
+            for _ in range(count):
                 # 新たにエッジに車両を追加（位置 x=0.0）
-                edge_traffics[edge_key].vehicles.append(0.0)
+                next_traffic.add_vehicle(0.0)
     return total_flow_out
 
-def update_signal_modes(simparams: SimulationParams,coefficient:Coefficient ,time: int,  edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo):
+def update_signal_modes(simparams: SimulationParams,coefficient:Coefficient ,time: int,  edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo,
+                        instrumentation: Instrumentation = NULL_INSTRUMENTATION, rng: np.random.Generator | None = None,
+                        policy: ResolvePolicy | None = None):
     """
     信号モードを更新する。
+
+    QUBOによる更新で`policy`を与えた場合, 交通状態がほとんど変わっていなければ解き直さない(`solving/policy.py`)
     """
     # new_modes = calc_mode(time, edge_traffics, node_traffics)
 
     if simparams.update_strategy==UPDATE_STRATEGY_FIXED: 
         new_modes = calc_mode_fixedcycle(time, edge_traffics, node_traffics)
     elif simparams.update_strategy==UPDATE_STRATEGY_QUBO:
-        print(f"\n[Time {time}] Starting SA Optimization...")
-        
         # solve_main を実行して新しいモード配置を取得
         # (solve_main 内で q1, q2, q3 が呼び出され、dimod で解かれる)
-        new_modes = solving.solve_sa.solve_main(coefficient, time, edge_traffics, node_traffics, mapinfo)
-        
-
-            
-        print(f"[Time {time}] Optimization complete.")
+        # 結果の表示は計測結果の出力先(ConsoleSink)が行う
+        new_modes = solving.solve_sa.solve_main(coefficient, time, edge_traffics, node_traffics, mapinfo,
+                                                verbose=False, instrumentation=instrumentation, policy=policy)
     else: 
-        new_modes=calc_mode_randomcycle(time,edge_traffics,node_traffics)
+        new_modes=calc_mode_randomcycle(time,edge_traffics,node_traffics, rng=rng)
     
-    # 取得した辞書 new_modes={node_id: mode_id} を実際のノード状態に反映
+    apply_signal_modes(simparams, new_modes, node_traffics)
+
+
+def apply_signal_modes(simparams: SimulationParams, new_modes: Dict[int, int], node_traffics: Dict):
+    """
+    辞書`new_modes`={node_id: mode_id}を実際のノード状態に反映する
+    """
     for node_id, mode_id in new_modes.items():
         if node_id in node_traffics:
             old_mode = node_traffics[node_id].mode
@@ -253,79 +294,152 @@ def update_signal_modes(simparams: SimulationParams,coefficient:Coefficient ,tim
 
 
 
-from visualize import TrafficVisualizer
-
-def simulation(simparams: SimulationParams, coefficient :Coefficient , mapinfo: MapInfo, edge_traffics: Dict[Tuple[int, int], EdgeTraffic], node_traffics: Dict[int, NodeTraffic]) -> List:
+def simulation(simparams: SimulationParams, coefficient :Coefficient , mapinfo: MapInfo, edge_traffics: Dict[Tuple[int, int], EdgeTraffic], node_traffics: Dict[int, NodeTraffic],
+               sink: HistorySink | None = None, instrumentation: Instrumentation | None = None,
+               rng: np.random.Generator | None = None) -> Any:
     """
     シミュレーションのメインループを実行し、ログ保存とGIF生成を行う。
+
+    各ステップの記録は`sink`へ逐次書き出す. 
+    `sink`を省略した場合はメモリ上に保持し, 履歴のリストを返す. 
+    指定した場合は`sink.result()`を返す(`sink`のcloseは呼び出し側で行う). 
+
+    フェーズごとの所要時間やカウンタは`instrumentation`(`instrument.Recorder`など)へ記録する. 
+    省略した場合は`simparams.verbose`ならコンソール表示のみ, そうでなければ計測を行わない. 
+    指定した場合のcloseは呼び出し側で行う. 
+
+    乱数(進行方向, ランダムな信号更新)は`rng`から引く. 省略時は`simparams.seed`から生成する. 
     """
     
 
     # 記録用リソースの準備
-    history = []
+    if sink is None:
+        sink = ListHistorySink()
+    sink.bind(node_traffics)
+    if instrumentation is None:
+        instrumentation = Recorder([ConsoleSink()]) if simparams.verbose else NULL_INSTRUMENTATION
+    if rng is None:
+        rng = np.random.default_rng(simparams.seed)
+    node_count = mapinfo.width()*mapinfo.height()
 
     total_time_wasted=0.0
     # シミュレーション時間と信号更新周期設定
     simulationtime = simparams.simulation_time
     signal_update=simparams.signal_update_span
 
-    print(f"--- Simulation Started (T={simulationtime}) ---")
+    policy = None
+    if simparams.update_strategy == UPDATE_STRATEGY_QUBO:
+        solving.solve_sa.preload_sampler(coefficient)
+        # 前回の求解からの変化が小さければ解き直さない (無効ならNone)
+        policy = make_policy(coefficient, mapinfo)
+
+    # QUBOの求解を並行実行する場合のパイプライン
+    pipeline = None
+    if simparams.update_strategy == UPDATE_STRATEGY_QUBO and simparams.solve_pipeline != PIPELINE_NONE:
+        pipeline = SolvePipeline(simparams.solve_pipeline, coefficient, mapinfo,
+                                 lag=simparams.solve_lag, deadline=simparams.solve_deadline,
+                                 instrumentation=instrumentation)
+
+    if simparams.verbose:
+        print(f"--- Simulation Started (T={simulationtime}) ---")
+
+    # 車両総数は保存されるため, エッジ上の車両数は(総数 - 待機車両数)で得られる
+    post_outflow_waiting = sum(len(q) for nt in node_traffics.values() for q in nt.queues.values())
+    if instrumentation.enabled:
+        total_vehicles = post_outflow_waiting + sum(len(et.vehicles) for et in edge_traffics.values())
 
     # メインループ
     for time in range(simulationtime):
         
         # --- 物理演算・ロジック ---
         # 車両の移動
-        update_edge_traffic(mapinfo, edge_traffics, node_traffics, dt=1.0)
+        with instrumentation.phase("edge_update"):
+            update_edge_traffic(mapinfo, edge_traffics, node_traffics, dt=1.0, rng=rng)
         
         # 流出前の待機車両総数を計測
         # timewastedと異なり速度で重みづけされない
         pre_outflow_waiting = sum(len(q) for nt in node_traffics.values() for q in nt.queues.values())
+        if instrumentation.enabled:
+            instrumentation.count("vehicles_moved", total_vehicles - post_outflow_waiting)
+            instrumentation.count("queue_push", pre_outflow_waiting - post_outflow_waiting)
 
-        # 信号モードの更新 
+        # 信号モードの更新 (所要時間を計測する)
+        solve_time = 0.0
         if time % signal_update == 0 and time>0: 
-            update_signal_modes(simparams, coefficient ,time, edge_traffics, node_traffics, mapinfo)
+            solve_start = perf_counter()
+            if pipeline is not None:
+                # スナップショットを渡して求解を始め, 結果はsolve_lagステップ後に反映する
+                pipeline.submit(time, node_traffics)
+            else:
+                update_signal_modes(simparams, coefficient ,time, edge_traffics, node_traffics, mapinfo,
+                                    instrumentation=instrumentation, rng=rng, policy=policy)
+            solve_time = perf_counter() - solve_start
+        if pipeline is not None:
+            # 反映時刻に達した求解の結果を受け取る (待ち時間もsolve_timeに含める)
+            wait_start = perf_counter()
+            new_modes, solved_time = pipeline.collect(time)
+            if new_modes is not None:
+                apply_signal_modes(simparams, new_modes, node_traffics)
+                if simparams.verbose:
+                    print(f"\n[Time {time}] Applied SA result from time {solved_time}.")
+            solve_time += perf_counter() - wait_start
+        if solve_time > 0:
+            instrumentation.add_time("signal_update", solve_time)
         
         # 交差点での車両の通過
-        step_flow_out = update_node_traffic(mapinfo, edge_traffics, node_traffics)
+        with instrumentation.phase("node_flow"):
+            step_flow_out = update_node_traffic(mapinfo, edge_traffics, node_traffics)
+        instrumentation.count("queue_pop", step_flow_out)
         # 処理後の待機車両総数を計測
         post_outflow_waiting = sum(len(q) for nt in node_traffics.values() for q in nt.queues.values())
         # 指標計測
-        step_time_wasted = calc_step_timewasted(mapinfo, node_traffics)
+        with instrumentation.phase("timewasted"):
+            step_time_wasted = calc_step_timewasted(mapinfo, node_traffics)
 
         flowout_ratio = step_flow_out / pre_outflow_waiting if pre_outflow_waiting > 0 else 0.0
         remain_ratio = post_outflow_waiting / pre_outflow_waiting if pre_outflow_waiting > 0 else 0.0
-        print(f"\r[Time {time}] Time Waste: {step_time_wasted: 8.3f} Outflow Ratio: {flowout_ratio: 4.2f} Remain Ratio: {remain_ratio: 4.2f}", end="")
         total_time_wasted+=step_time_wasted
-
-        # ログ用オブジェクト
-        step_data = {
-            "time": time,
-            "timewasted": step_time_wasted,
-            "step_flow_out": step_flow_out,
-            "pre_outflow_waiting": pre_outflow_waiting, 
-            "flowout_ratio": flowout_ratio, 
-            "remain_ratio": remain_ratio,
-            "nodes": {
-                node_id: {
-                    "mode": nt.mode,
-                    "queues": {dir_key: list(q) for dir_key, q in nt.queues.items()}
-                } for node_id, nt in node_traffics.items()
-            },
-            "edges": {
-                f"{k[0]}_{k[1]}": [round(v, 2) for v in et.vehicles]
-                for k, et in edge_traffics.items()
+        with instrumentation.phase("record"):
+            # ログ用オブジェクト
+            step_data = {
+                "time": time,
+                "timewasted": step_time_wasted,
+                "step_flow_out": step_flow_out,
+                "pre_outflow_waiting": pre_outflow_waiting, 
+                "flowout_ratio": flowout_ratio, 
+                "remain_ratio": remain_ratio,
+                "solve_time": solve_time,
+                "nodes": {
+                    node_id: {
+                        "mode": nt.mode,
+                        "queues": {dir_key: list(q) for dir_key, q in nt.queues.items()}
+                    } for node_id, nt in node_traffics.items()
+                },
             }
-        }
-        history.append(step_data)
+            if simparams.record_edges:
+                step_data["edges"] = {
+                    f"{k[0]}_{k[1]}": [round(v, 2) for v in et.vehicles]
+                    for k, et in edge_traffics.items()
+                }
+            sink.write(step_data)
+        instrumentation.end_step(time, timewasted=step_time_wasted, flowout_ratio=flowout_ratio,
+                                 remain_ratio=remain_ratio, node_count=node_count)
 
         # 可視化フレームのキャプチャ
         # 毎フレームキャプチャしてGIFの滑らかさを確保
         # viz.capture(mapinfo, edge_traffics, node_traffics, time)
 
-    print("\n--- Simulation Finished ---\n")
-    print(f"Total Time Waste: {total_time_wasted:10.2f}")
+    if pipeline is not None:
+        pipeline.close()
+        if simparams.verbose and pipeline.missed:
+            print(f"\n[Pipeline] {pipeline.missed} SA results missed the deadline and were discarded.")
+        if simparams.verbose and pipeline.skipped:
+            print(f"\n[Pipeline] {pipeline.skipped} signal updates were skipped while a previous solve was still running.")
+
+    if simparams.verbose:
+        print("\n--- Simulation Finished ---\n")
+        print(f"Total Time Waste: {total_time_wasted:10.2f}")
 
 
 
-    return history
\ No newline at end of file
+    return sink.result()
\ No newline at end of file
@@ -0,0 +1,150 @@
+"""
+nealとPottsモデルのSAの求解時間・到達エネルギーを比較するスクリプト
+
+リポジトリのルートで `python -m solving.compare_samplers` として実行する.
+各サイズのマップで固定サイクルのシミュレーションを進めて待機車両を作り, 同じQUBOを両方のサンプラーで解く.
+エネルギーはいずれもQUBO(`dimod.BinaryQuadraticModel`)上の値で比較する.
+
+`python -m solving.compare_samplers gap [高さ...]`では幅`GAP_WIDTH`の細長いマップで厳密解(`solving/exact_dp.py`)を求め,
+nealの`num_sweeps`・`num_reads`ごとに最適値との差を表示する.
+
+`python -m solving.compare_samplers warm [高さ...]`では同じマップの厳密解を初期状態として
+Pottsモデルのwarm start(`warm_start_beta_fraction`が`WARM_FRACTIONS`)で解き, 最適解が保たれるかを検査する.
+保たれなければ終了コード1を返す.
+"""
+from dataclasses import replace
+from time import perf_counter
+import sys
+
+import numpy as np
+import neal
+
+from param import *
+from simulator import simulation, simulation_init
+from solving.solve_sa import build_bqm, build_terms, concat_terms, flowable_count_matrix, get_qubo_structure, solve_potts
+from solving.potts_sa import PottsModel, sample_potts
+from solving.exact_dp import minimize_potts
+
+
+GRID_SIZES = [6, 10, 20, 50, 100]
+"""比較するマップの一辺の長さ"""
+POTTS_SWEEPS = [25, 50, 100, 200, 500, 1000]
+"""Pottsモデルで試すスイープ数"""
+WARMUP_TIME = 60
+"""QUBOを作る前に進めるシミュレーション時間"""
+GAP_WIDTH = 4
+"""最適値との差を測るマップの幅 (厳密解を求められる幅)"""
+GAP_HEIGHTS = [8, 16]
+"""最適値との差を測るマップの高さ"""
+NEAL_SWEEPS = [100, 500, 1000, 4000]
+"""最適値との差を測るnealのスイープ数"""
+NEAL_READS = [1, 10]
+"""最適値との差を測るnealのサンプリング数"""
+WARM_FRACTIONS = [0.95, 1.0]
+"""最適解からのwarm startを検査する`warm_start_beta_fraction`"""
+
+
+def prepare(size: int, seed: int = 0, height: int | None = None):
+    """
+    `size` x `size`(`height`を与えた場合は幅`size`, 高さ`height`)のマップで`WARMUP_TIME`だけシミュレーションを進め, 
+    その時点のQUBOの項を返す
+    """
+    height = size if height is None else height
+    mapgenparam = MapGenerationParam(car_count=3*size*height, vehicle_engine=VEHICLE_ENGINE_ARRAY, seed=seed)
+    mapinfo, edge_traffics, node_traffics = simulation_init(mapgenparam, width=size, height=height)
+    simparams = SimulationParams(update_strategy=UPDATE_STRATEGY_FIXED, simulation_time=WARMUP_TIME,
+                                 verbose=False, record_edges=False, seed=seed)
+    simulation(simparams, Coefficient(), mapinfo, edge_traffics, node_traffics)
+    terms = build_terms(Coefficient(), WARMUP_TIME, flowable_count_matrix(node_traffics, mapinfo), mapinfo)
+    return mapinfo, terms
+
+
+def potts_to_sample(states: np.ndarray) -> dict:
+    sample = {k: 0 for k in range(states.size*6)}
+    for i, mode in enumerate(states):
+        sample[i*6 + int(mode)] = 1
+    return sample
+
+
+def compare(size: int, coefficient: Coefficient):
+    mapinfo, terms = prepare(size)
+    bqm = build_bqm(get_qubo_structure(mapinfo).variable_count, *terms)
+
+    start = perf_counter()
+    sampleset = neal.SimulatedAnnealingSampler().sample(bqm, num_reads=coefficient.num_reads, num_sweeps=coefficient.num_sweeps)
+    neal_time = perf_counter() - start
+    neal_energy = sampleset.first.energy
+    print(f"{size:>4}x{size:<4} neal  sweeps={coefficient.num_sweeps:>5} time={neal_time:8.3f}s energy={neal_energy:.1f}")
+
+    tts = None
+    for sweeps in POTTS_SWEEPS:
+        start = perf_counter()
+        model = PottsModel(mapinfo, *concat_terms(*terms))
+        states, energies = sample_potts(model, num_reads=coefficient.num_reads, num_sweeps=sweeps, seed=0)
+        potts_time = perf_counter() - start
+        best = states[int(np.argmin(energies))]
+        energy = bqm.energy(potts_to_sample(best))
+        print(f"{'':>9} potts sweeps={sweeps:>5} time={potts_time:8.3f}s energy={energy:.1f} (diff {energy - neal_energy:+.1f})")
+        if tts is None and energy <= neal_energy:
+            tts = potts_time
+    if tts is None:
+        print(f"{'':>9} potts did not reach the neal energy")
+    else:
+        print(f"{'':>9} time-to-solution: potts {tts:.3f}s vs neal {neal_time:.3f}s ({neal_time/tts:.1f}x)")
+
+
+def optimality_gap(height: int, width: int = GAP_WIDTH):
+    """
+    `width` x `height`のマップのQUBOを厳密に解き, nealの`num_sweeps`・`num_reads`ごとの最適値との差を表示する
+    """
+    mapinfo, terms = prepare(width, height=height)
+    bqm = build_bqm(get_qubo_structure(mapinfo).variable_count, *terms)
+
+    start = perf_counter()
+    model = PottsModel(mapinfo, *concat_terms(*terms))
+    states, _ = minimize_potts(model, shape=(height, width))
+    exact_time = perf_counter() - start
+    optimum = bqm.energy(potts_to_sample(states))
+    print(f"{width:>4}x{height:<4} exact              time={exact_time:8.3f}s energy={optimum:.1f}")
+
+    for reads in NEAL_READS:
+        for sweeps in NEAL_SWEEPS:
+            start = perf_counter()
+            sampleset = neal.SimulatedAnnealingSampler().sample(bqm, num_reads=reads, num_sweeps=sweeps, seed=0)
+            neal_time = perf_counter() - start
+            energy = sampleset.first.energy
+            print(f"{'':>9} neal  reads={reads:>3} sweeps={sweeps:>5} time={neal_time:8.3f}s energy={energy:.1f} (gap {energy - optimum:+.1f})")
+
+
+def warm_keeps_optimum(height: int, width: int = GAP_WIDTH) -> bool:
+    """
+    `width` x `height`のマップの厳密解を初期状態としてPottsモデルのwarm startで解き,
+    `WARM_FRACTIONS`のすべてで最適解のエネルギーが保たれればTrueを返す
+    """
+    mapinfo, terms = prepare(width, height=height)
+    model = PottsModel(mapinfo, *concat_terms(*terms))
+    optimum, optimum_energy = minimize_potts(model, shape=(height, width))
+    kept = True
+    for fraction in WARM_FRACTIONS:
+        coefficient = replace(Coefficient(), sampler=SAMPLER_POTTS, warm_start=True, warm_start_beta_fraction=fraction)
+        modes = solve_potts(coefficient, terms, mapinfo, current_modes=optimum, rng=np.random.default_rng(0))
+        states = np.array([modes[i] - 1 for i in range(len(optimum))])
+        energy = float(model.energy(states)[0])
+        ok = np.array_equal(states, optimum) or energy <= optimum_energy
+        kept &= ok
+        print(f"{width:>4}x{height:<4} warm  fraction={fraction:.2f} energy={energy:.1f} "
+              f"(optimum {optimum_energy:.1f}): {'OK' if ok else 'LOST'}")
+    return kept
+
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == ["gap"]:
+        for height in [int(arg) for arg in sys.argv[2:]] or GAP_HEIGHTS:
+            optimality_gap(height)
+    elif sys.argv[1:2] == ["warm"]:
+        results = [warm_keeps_optimum(height) for height in [int(arg) for arg in sys.argv[2:]] or GAP_HEIGHTS]
+        sys.exit(0 if all(results) else 1)
+    else:
+        sizes = [int(arg) for arg in sys.argv[1:]] or GRID_SIZES
+        for size in sizes:
+            compare(size, Coefficient())
@@ -0,0 +1,228 @@
+"""
+Pottsモデルのエネルギーの厳密な最小化 (動的計画法)
+
+ノードを順に1つずつ決めていき, まだ決めていない隣接ノードを持つノード(フロンティア)のモードの組ごとに
+それまでの最小エネルギーを表(軸1本が1ノードの状態)として持つ.
+隣接ノードがすべて決まったノードは表の軸を最小化で消し, そのときのモードを復元用に記録する.
+
+行優先の順ではフロンティアは1行分(幅W)のノードとなり, 6^W状態の転送行列法に相当する.
+ただしトーラスでは最初の行が最後の行と結合するため, 最初の行も最後まで残り表は6^(2W)程度になる.
+
+表を小さくするため, ノードごとに線形項と隣接ノードとの結合がまったく同じモードを1つの状態にまとめる(`domain_classes`).
+待機車両のないノードは全モードが同じ1状態に, 待機車両が一部の方向のみのノードは数状態にまとまるため,
+実際の交通状態では表は6^(2W)よりずっと小さく, 幅5〜6のトーラスでも解けることが多い.
+"""
+from __future__ import annotations
+from collections import deque
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+from traffic import MODE_COUNT
+from solving.potts_sa import NEIGHBOR_SLOTS, PottsModel
+
+
+EXACT_MAX_TABLE = MODE_COUNT**9
+"""動的計画法で保持する表の要素数の上限 (float64で約80MB)"""
+
+
+class TableTooLargeError(ValueError):
+    """表の要素数が`EXACT_MAX_TABLE`を超えるため厳密に解けない"""
+
+
+def _adjacency(neighbors: np.ndarray) -> List[set]:
+    """
+    隣接表からノードごとの(自身を除く)隣接ノードの集合を返す. 片方向にしか現れない隣接も両端に入れる
+    """
+    adjacency = [set() for _ in range(len(neighbors))]
+    for i, row in enumerate(neighbors.tolist()):
+        for j in row:
+            if j != i:
+                adjacency[i].add(j)
+                adjacency[j].add(i)
+    return adjacency
+
+
+def table_size(neighbors: np.ndarray, order: np.ndarray, sizes: Sequence[int] | None = None) -> int:
+    """
+    `order`の順にノードを決めたとき, 表の要素数の最大値を返す
+
+    `sizes`はノードごとの状態数 (省略時は全ノード`MODE_COUNT`)
+    """
+    if sizes is None:
+        sizes = [MODE_COUNT]*len(neighbors)
+    adjacency = _adjacency(neighbors)
+    remaining = [len(adjacent) for adjacent in adjacency]
+    done = np.zeros(len(neighbors), dtype=bool)
+    active: List[int] = []
+    largest = 1
+    for v in order.tolist():
+        active.append(v)
+        largest = max(largest, int(np.prod([sizes[u] for u in active], dtype=object)))
+        done[v] = True
+        for u in adjacency[v]:
+            if done[u]:
+                remaining[u] -= 1
+                remaining[v] -= 1
+        active = [u for u in active if remaining[u] > 0]
+    return largest
+
+
+def frontier_width(neighbors: np.ndarray, order: np.ndarray) -> int:
+    """
+    `order`の順にノードを決めたとき, 表が同時に持つ軸(ノード)の数の最大値を返す
+    """
+    adjacency = _adjacency(neighbors)
+    remaining = [len(adjacent) for adjacent in adjacency]
+    done = np.zeros(len(neighbors), dtype=bool)
+    active = 0
+    width = 0
+    for v in order.tolist():
+        active += 1
+        width = max(width, active)
+        done[v] = True
+        for u in adjacency[v]:
+            if done[u]:
+                remaining[u] -= 1
+                remaining[v] -= 1
+                active -= remaining[u] == 0
+        active -= remaining[v] == 0
+    return width
+
+
+def _breadth_first_order(neighbors: np.ndarray) -> np.ndarray:
+    """
+    隣接ノードの最も少ないノード(タイルの角)から幅優先で辿った順を返す. 格子では対角線状に進む
+    """
+    adjacency = _adjacency(neighbors)
+    visited = np.zeros(len(neighbors), dtype=bool)
+    order: List[int] = []
+    for start in sorted(range(len(neighbors)), key=lambda node: len(adjacency[node])):
+        if visited[start]:
+            continue
+        visited[start] = True
+        queue = deque([start])
+        while queue:
+            node = queue.popleft()
+            order.append(node)
+            for neighbor in sorted(adjacency[node]):
+                if not visited[neighbor]:
+                    visited[neighbor] = True
+                    queue.append(neighbor)
+    return np.array(order, dtype=np.int64)
+
+
+def elimination_order(neighbors: np.ndarray, shape: Tuple[int, int] | None = None,
+                      sizes: Sequence[int] | None = None) -> np.ndarray:
+    """
+    ノードを決める順を, 候補のうち表が最も小さくなるものから選んで返す
+
+    `shape`(高さ, 幅)を与えた場合(トーラスのマップ)は行優先と列優先(短い辺に沿って進む方が選ばれる),
+    隣接表だけの部分問題ではノード番号順と角からの幅優先の順を候補とする.
+    タイルがトーラスの端をまたぐとノード番号順ではタイルの途中から始まるため, 幅優先の方が小さくなる.
+    `sizes`(ノードごとの状態数)を与えると, それに基づく表の要素数で比べる.
+    """
+    order = np.arange(len(neighbors))
+    if shape is None:
+        candidates = [order, _breadth_first_order(neighbors)]
+    else:
+        candidates = [order, order.reshape(shape).T.ravel()]
+    return min(candidates, key=lambda candidate: table_size(neighbors, candidate, sizes))
+
+
+def _pair_tables(model: PottsModel) -> Tuple[np.ndarray, Dict[Tuple[int, int], np.ndarray]]:
+    """
+    Pottsモデルの項を, ノードごとの線形項と隣接ノードの組(`i < j`)ごとの6x6の表`[s_i, s_j]`に分ける
+
+    `coupling`は両端のノードの向きで格納されているため, それぞれの半分を足し合わせる.
+    """
+    linear = model.linear.copy()
+    pairs: Dict[Tuple[int, int], np.ndarray] = {}
+    for i in range(model.node_count):
+        for d in range(NEIGHBOR_SLOTS):
+            j = int(model.neighbors[i, d])
+            table = 0.5*model.coupling[i, d]
+            if j == i:
+                linear[i] += np.diag(table)
+            elif i < j:
+                pairs[(i, j)] = pairs.get((i, j), 0) + table
+            else:
+                pairs[(j, i)] = pairs.get((j, i), 0) + table.T
+    return linear, pairs
+
+
+def domain_classes(linear: np.ndarray, pairs: Dict[Tuple[int, int], np.ndarray]) -> List[np.ndarray]:
+    """
+    ノードごとに, 線形項とすべての隣接ノードとの結合の行が一致するモードを同じ状態とみなし,
+    各状態の代表のモード(番号の最も小さいもの)を昇順の配列で返す
+
+    同じ状態のモードはどの解でも入れ替えてエネルギーが変わらないため, 代表だけを調べれば最小値は変わらない.
+    """
+    signatures: List[List[np.ndarray]] = [[row[:, None]] for row in linear]
+    for (i, j), table in pairs.items():
+        signatures[i].append(table)
+        signatures[j].append(table.T)
+    return [np.sort(np.unique(np.hstack(signature), axis=0, return_index=True)[1]).astype(np.int64)
+            for signature in signatures]
+
+
+def minimize_potts(model: PottsModel, order: np.ndarray | None = None,
+                   shape: Tuple[int, int] | None = None) -> Tuple[np.ndarray, float]:
+    """
+    `model`のエネルギーを厳密に最小化し, (各ノードのモード(0-5), 最小エネルギー)を返す
+
+    `order`はノードを決める順. 省略時は`shape`(トーラスのマップの高さ, 幅)を用いて`elimination_order`で選ぶ.
+    最小値が複数ある場合はモード番号の小さい方を選ぶため, 結果は決定的.
+    表の要素数が`EXACT_MAX_TABLE`を超える場合は`TableTooLargeError`を送出する.
+    """
+    linear, pairs = _pair_tables(model)
+    domains = domain_classes(linear, pairs)
+    sizes = [len(domain) for domain in domains]
+    if order is None:
+        order = elimination_order(model.neighbors, shape, sizes)
+    size = table_size(model.neighbors, order, sizes)
+    if size > EXACT_MAX_TABLE:
+        raise TableTooLargeError(f"exact solver needs a table of {size} states, "
+                                 f"more than EXACT_MAX_TABLE ({EXACT_MAX_TABLE}); use a narrower map or tile")
+
+    # 代表のモードのみに絞った線形項と結合
+    linear = [linear[v, domain] for v, domain in enumerate(domains)]
+    pairs = {(i, j): table[np.ix_(domains[i], domains[j])] for (i, j), table in pairs.items()}
+    adjacency = _adjacency(model.neighbors)
+    remaining = [len(adjacent) for adjacent in adjacency]
+    done = np.zeros(model.node_count, dtype=bool)
+
+    table = np.zeros(())
+    active: List[int] = []
+    # 軸を消すごとに (ノード, 残った軸のノード, 残った軸の状態の組ごとの最適な状態)
+    records: List[Tuple[int, List[int], np.ndarray]] = []
+    for v in order.tolist():
+        # vと決定済みの隣接ノードの軸だけを持つ小さな表にまとめてから, 1回で足し込む
+        term = linear[v].reshape([1]*table.ndim + [sizes[v]])
+        for axis, u in enumerate(active):
+            pair = pairs.get((min(u, v), max(u, v)))
+            if pair is None:
+                continue
+            term_shape = [1]*(table.ndim + 1)
+            term_shape[axis] = sizes[u]
+            term_shape[-1] = sizes[v]
+            term = term + (pair if u < v else pair.T).reshape(term_shape)
+        table = table[..., None] + term
+        active.append(v)
+
+        done[v] = True
+        for u in adjacency[v]:
+            if done[u]:
+                remaining[u] -= 1
+                remaining[v] -= 1
+        for u in [u for u in active if remaining[u] == 0]:
+            axis = active.index(u)
+            active.pop(axis)
+            choice = table.argmin(axis=axis)
+            table = np.take_along_axis(table, np.expand_dims(choice, axis), axis=axis).squeeze(axis)
+            records.append((u, list(active), choice.astype(np.int8)))
+
+    states = np.zeros(model.node_count, dtype=np.int64)
+    for u, others, choice in reversed(records):
+        states[u] = choice[tuple(states[others])]
+    modes = np.array([domains[v][state] for v, state in enumerate(states)], dtype=np.int64)
+    return modes, float(table)
@@ -0,0 +1,142 @@
+"""
+交通状態が前回の求解からほとんど変わっていなければ解き直さない, イベント駆動の求解方針
+
+QUBOは$C_{ij}$(`flowable_count_matrix`)とtauの組だけで決まる. Q2の項は両端の$C$が0でなくtauが成り立つ組にのみ現れるため,
+そのような組(有効なtau)と$C_{ij}$を前回解いた状態と比べる.
+
+- 有効なtauが前回と同じで, 有効なtauの組に現れるノード(結合ノード)の$C_{ij}$も前回と同じとき,
+  結合していないノードで前回の解が取りこぼす車両数(`plan_shortfall`)が`Coefficient.resolve_threshold`以下なら
+  前回の解をそのまま使う. $C_{ij}$が前回と同じなら常に使う
+- $C_{ij}$と有効なtauが完全に一致する過去の状態があれば, その解を使う (`Coefficient.solve_cache_size`件のLRUキャッシュ)
+
+Q2の係数は結合ノードの$C$で決まるため, 結合ノードの$C$が変わるとQ2の大きさが変わり, Q1の取りこぼしでは解の悪化を測れない.
+結合ノードの$C$が同じならQ2の項は前回と同一で, 変わりうるのは結合していないノードのQ1(ノードごとに独立)のみとなる.
+前回の解はそれらのノードで取りこぼし0だったため, 現在の取りこぼしがそのまま最適解とのエネルギー差(の`lambda1`倍)であり,
+取りこぼしが0なら前回の解は現在も最適解である.
+閾値を正にすると求解はさらに減るが, 新たに来た車両が次の更新まで赤信号で待つため待ち時間は増える.
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import Callable, Dict, Tuple
+import hashlib
+
+import numpy as np
+
+from graph import MapInfo
+from param import Coefficient
+from solving.solve_sa import get_qubo_structure
+
+
+def plan_shortfall(flowable: np.ndarray, modes: np.ndarray, nodes: np.ndarray | None = None) -> float:
+    """
+    モード`modes`(0-5)が, ノードごとに最も多く流せるモードに比べて流せない車両数の1交差点あたりの平均
+    $\\sum_i (\\max_j C_{ij} - C_{i s_i}) / N$ を返す
+
+    `nodes`(ノードごとのbool配列)を与えた場合は, そのノードについてのみ和をとる (Nは全ノード数のまま)
+    """
+    served = flowable[np.arange(len(flowable)), modes]
+    shortfall = flowable.max(axis=1) - served
+    if nodes is not None:
+        shortfall = shortfall[nodes]
+    return float(shortfall.sum()) / max(len(flowable), 1)
+
+
+class ResolvePolicy:
+    """
+    1つのシミュレーションの間, 前回解いた状態と過去の解を保持し, 解き直すかどうかを決めるクラス
+
+    `solve`に求解の関数を渡すと, 解き直す必要がある場合のみ呼び出す.
+    """
+    def __init__(self, coefficient: Coefficient, mapinfo: MapInfo):
+        self.threshold = coefficient.resolve_threshold
+        self.cache_size = coefficient.solve_cache_size
+        self.tau_threshold = coefficient.tau_threshold
+        self.structure = get_qubo_structure(mapinfo)
+
+        self._last_flowable: np.ndarray | None = None
+        self._last_tau: np.ndarray | None = None
+        self._last_modes: Dict[int, int] | None = None
+        self._last_plan: np.ndarray | None = None
+        self._cache: OrderedDict[bytes, Dict[int, int]] = OrderedDict()
+        self.solved = 0
+        """実際に解いた回数"""
+        self.reused = 0
+        """解き直さずに過去の解を使った回数"""
+
+    def active_tau(self, time: int, flowable: np.ndarray) -> np.ndarray:
+        """
+        Q2の組のうち, tauが成り立ち両端の$C$が0でない(QUBOに項が現れる)組をTrueとする配列を返す
+        """
+        structure = self.structure
+        return (structure.tau_mask(time, self.tau_threshold)
+                & (flowable[structure.pair_node, structure.pair_mode] != 0)
+                & (flowable[structure.pair_neighbor, structure.pair_neighbor_mode] != 0))
+
+    def coupled_nodes(self, tau: np.ndarray) -> np.ndarray:
+        """
+        有効なtau`tau`の組のいずれかの端となる(Q2の項を持つ)ノードをTrueとする配列を返す
+        """
+        structure = self.structure
+        coupled = np.zeros(structure.node_count, dtype=bool)
+        coupled[structure.pair_node[tau]] = True
+        coupled[structure.pair_neighbor[tau]] = True
+        return coupled
+
+    def reusable(self, flowable: np.ndarray, tau: np.ndarray) -> bool:
+        """
+        前回解いた状態から解き直さなくてよいほどしか変わっていないか?
+
+        有効なtauと結合ノードの$C$が前回と同じで, 結合していないノードでの前回の解の取りこぼしが閾値以下ならTrue
+        """
+        if self.threshold is None or self._last_modes is None or not np.array_equal(tau, self._last_tau):
+            return False
+        if np.array_equal(flowable, self._last_flowable):
+            return True
+        coupled = self.coupled_nodes(tau)
+        if not np.array_equal(flowable[coupled], self._last_flowable[coupled]):
+            return False
+        return plan_shortfall(flowable, self._last_plan, ~coupled) <= self.threshold
+
+    def solve(self, time: int, flowable: np.ndarray,
+              solve: Callable[[], Dict[int, int]]) -> Tuple[Dict[int, int], bool]:
+        """
+        時刻`time`の$C_{ij}$について, 必要なら`solve()`を呼んで解き, (モードの辞書, 過去の解を使ったか)を返す
+        """
+        tau = self.active_tau(time, flowable)
+        if self.reusable(flowable, tau):
+            self.reused += 1
+            return dict(self._last_modes), True
+
+        key = None
+        if self.cache_size > 0:
+            key = hashlib.blake2b(np.ascontiguousarray(flowable).tobytes() + np.packbits(tau).tobytes()).digest()
+            cached = self._cache.get(key)
+            if cached is not None:
+                self._cache.move_to_end(key)
+                self._remember(flowable, tau, cached)
+                self.reused += 1
+                return dict(cached), True
+
+        modes = solve()
+        self.solved += 1
+        self._remember(flowable, tau, modes)
+        if key is not None:
+            self._cache[key] = dict(modes)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return modes, False
+
+    def _remember(self, flowable: np.ndarray, tau: np.ndarray, modes: Dict[int, int]):
+        self._last_flowable = np.array(flowable, copy=True)
+        self._last_tau = tau
+        self._last_modes = dict(modes)
+        self._last_plan = np.array([modes[i] for i in range(len(flowable))], dtype=np.int64) - 1
+
+
+def make_policy(coefficient: Coefficient, mapinfo: MapInfo) -> ResolvePolicy | None:
+    """
+    `coefficient`で解き直しの判定かキャッシュが有効なら`ResolvePolicy`を, そうでなければNoneを返す
+    """
+    if coefficient.resolve_threshold is None and coefficient.solve_cache_size <= 0:
+        return None
+    return ResolvePolicy(coefficient, mapinfo)
@@ -0,0 +1,211 @@
+from graph import MapInfo
+from traffic import MODE_COUNT
+from typing import List, Tuple
+import math
+import weakref
+import numpy as np
+
+
+NEIGHBOR_SLOTS = 4
+"""1ノードあたりの隣接ノード数 (`MapInfo.neighborTable()`の列数: 北, 南, 東, 西)"""
+
+
+def _greedy_coloring(neighbors: np.ndarray) -> List[np.ndarray]:
+    """
+    隣接ノード同士が異なる色になるよう貪欲に彩色し, 色ごとのノード番号の配列を返す
+
+    偶数x偶数のトーラスでは市松模様の2色, 辺の長さが奇数のときは3色程度になる.
+    """
+    node_count = len(neighbors)
+    colors = np.full(node_count, -1, dtype=np.int64)
+    for node in range(node_count):
+        used = {int(colors[j]) for j in neighbors[node] if j != node}
+        color = 0
+        while color in used:
+            color += 1
+        colors[node] = color
+    return [np.flatnonzero(colors == c) for c in range(colors.max() + 1)]
+
+
+_coloring_cache: "weakref.WeakKeyDictionary[MapInfo, List[np.ndarray]]" = weakref.WeakKeyDictionary()
+
+
+def get_color_classes(mapinfo: MapInfo) -> List[np.ndarray]:
+    """
+    `mapinfo`の彩色(互いに隣接しないノードの組)を返す. マップごとに一度だけ計算される.
+    """
+    classes = _coloring_cache.get(mapinfo)
+    if classes is None:
+        classes = _greedy_coloring(mapinfo.neighborTable())
+        _coloring_cache[mapinfo] = classes
+    return classes
+
+
+class PottsModel:
+    """
+    各ノードがモード(0-5の整数)を1つ取る6状態のPottsモデル
+
+    QUBOの変数$x_{i m}$(添字`i*MODE_COUNT + m`)を「ノード`i`のモードが`m`」と読み替え,
+    one-hotを満たす状態に限ったエネルギーを
+
+    $$ E(s) = \\sum_i h_{i s_i} + \\frac{1}{2} \\sum_i \\sum_d W_{i d}[s_i, s_{n(i, d)}] $$
+
+    として保持する. `n(i, d)`は`neighborTable()`の`d`列目の隣接ノードで,
+    `W`は両端のノードから見た向きでそれぞれ格納するため1/2がかかる.
+
+    同一ノード内の異なるモード間の項(Q3の非対角)はone-hot状態では常に0のため捨てられ,
+    Q3の対角は全モードに一様な定数となる. したがってone-hot状態について`E`はQUBOのエネルギーと一致する.
+
+    `mapinfo`の代わりに(ノード数 x 4)の隣接表を与えると, マップの一部のノードだけの部分問題
+    (`solving/reduction.py`)を扱える. 隣接ノードのない列には自身の番号を置く.
+    """
+    def __init__(self, mapinfo: MapInfo | np.ndarray, rows: np.ndarray, cols: np.ndarray, vals: np.ndarray):
+        if isinstance(mapinfo, np.ndarray):
+            self.node_count = len(mapinfo)
+            self.neighbors = mapinfo
+            self.color_classes = _greedy_coloring(mapinfo)
+        else:
+            self.node_count = mapinfo.width()*mapinfo.height()
+            self.neighbors = mapinfo.neighborTable()
+            self.color_classes = get_color_classes(mapinfo)
+
+        node_r, mode_r = np.divmod(rows, MODE_COUNT)
+        node_c, mode_c = np.divmod(cols, MODE_COUNT)
+
+        # 同一ノード: 同じモードなら線形項, 異なるモードならone-hot状態では0
+        same_node = node_r == node_c
+        diagonal = same_node & (mode_r == mode_c)
+        self.linear = np.bincount(
+            node_r[diagonal]*MODE_COUNT + mode_r[diagonal], weights=vals[diagonal],
+            minlength=self.node_count*MODE_COUNT,
+        ).reshape(self.node_count, MODE_COUNT)
+
+        # 異なるノード: 隣接ノードの列(slot)に振り分け, 両端のノードの向きで加算する
+        off = ~same_node & (vals != 0)
+        node_r, mode_r, node_c, mode_c, v = node_r[off], mode_r[off], node_c[off], mode_c[off], vals[off]
+        slot_r = self._slot(node_r, node_c)
+        slot_c = self._slot(node_c, node_r)
+        size = MODE_COUNT*MODE_COUNT
+        flat = np.concatenate((
+            (node_r*NEIGHBOR_SLOTS + slot_r)*size + mode_r*MODE_COUNT + mode_c,
+            (node_c*NEIGHBOR_SLOTS + slot_c)*size + mode_c*MODE_COUNT + mode_r,
+        ))
+        self.coupling = np.bincount(
+            flat, weights=np.concatenate((v, v)), minlength=self.node_count*NEIGHBOR_SLOTS*size,
+        ).reshape(self.node_count, NEIGHBOR_SLOTS, MODE_COUNT, MODE_COUNT)
+        """`coupling[i, d, m, m']`: ノード`i`がモード`m`, その`d`列目の隣接ノードが`m'`のときのエネルギー(両端分)"""
+
+        # 隣接ノードのモードで引くため, [i, d, m', m]の並びも持っておく
+        self._coupling_by_neighbor = np.ascontiguousarray(self.coupling.transpose(0, 1, 3, 2))
+        # sample_potts用: モードを先頭の軸に置いた[m, (i, d, m')]の表と, 色ごとの添字
+        self._coupling_by_mode = np.ascontiguousarray(self._coupling_by_neighbor.reshape(-1, MODE_COUNT).T)
+        self._class_tables = [self._class_table(nodes) for nodes in self.color_classes]
+
+    def _class_table(self, nodes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        色`nodes`の一括更新に用いる(ノード, 隣接ノード, 表の列の起点, 線形項)を返す
+
+        `_coupling_by_mode[:, base[d, k] + s]`が, ノード`nodes[k]`の`d`列目の隣接ノードがモード`s`のときの
+        `nodes[k]`の各モードの寄与となる. 隣接ノードと起点は(4, len(`nodes`)), 線形項は(6, len(`nodes`))の並び.
+        """
+        neighbors = np.ascontiguousarray(self.neighbors[nodes].T)
+        base = (nodes[None, :]*NEIGHBOR_SLOTS + np.arange(NEIGHBOR_SLOTS)[:, None])*MODE_COUNT
+        return nodes, neighbors, base, np.ascontiguousarray(self.linear[nodes].T)
+
+    def _slot(self, nodes: np.ndarray, others: np.ndarray) -> np.ndarray:
+        """
+        `others`が`nodes`の何列目の隣接ノードかを返す (同じ隣接ノードが複数列にある場合は最初の列)
+        """
+        match = self.neighbors[nodes] == others[:, None]
+        if not match.any(axis=1).all():
+            raise ValueError("PottsModel supports couplings between neighboring nodes only")
+        return match.argmax(axis=1)
+
+    def local_field(self, states: np.ndarray, nodes: np.ndarray) -> np.ndarray:
+        """
+        各読み出し(`states`の行)について, `nodes`のモードを0-5にしたときのエネルギー寄与を返す
+
+        戻り値の形は(読み出し数, `len(nodes)`, `MODE_COUNT`)
+        """
+        field = np.broadcast_to(self.linear[nodes], (len(states), len(nodes), MODE_COUNT)).copy()
+        for d in range(NEIGHBOR_SLOTS):
+            neighbor_states = states[:, self.neighbors[nodes, d]]
+            field += self._coupling_by_neighbor[nodes, d, neighbor_states]
+        return field
+
+    def energy(self, states: np.ndarray) -> np.ndarray:
+        """
+        各読み出し(`states`の行)のエネルギーを返す
+        """
+        states = np.atleast_2d(states)
+        nodes = np.arange(self.node_count)
+        energy = self.linear[nodes, states].sum(axis=1)
+        for d in range(NEIGHBOR_SLOTS):
+            energy += 0.5*self.coupling[nodes, d, states, states[:, self.neighbors[:, d]]].sum(axis=1)
+        return energy
+
+    def default_beta_range(self) -> Tuple[float, float]:
+        """
+        逆温度の範囲を係数の大きさから決める
+
+        高温側は最大のエネルギー差が1/2の確率で受理される値,
+        低温側は最小のエネルギー差が1/100の確率でしか受理されない値とする(nealの既定値と同じ考え方).
+        """
+        spread = np.ptp(self.linear, axis=1) + np.ptp(self.coupling, axis=(2, 3)).sum(axis=1)
+        max_delta = float(spread.max())
+        values = np.concatenate(((self.linear - self.linear.min(axis=1, keepdims=True)).ravel(), np.abs(self.coupling).ravel()))
+        values = values[values > 1e-12]
+        if max_delta <= 0 or len(values) == 0:
+            return 1.0, 1.0
+        return math.log(2)/max_delta, math.log(100)/float(values.min())
+
+
+def sample_potts(model: PottsModel, num_reads: int = 10, num_sweeps: int = 1000,
+                 beta_range: Tuple[float, float] | None = None,
+                 initial_states: np.ndarray | None = None,
+                 seed: int | None = None,
+                 beta_schedule: np.ndarray | None = None,
+                 rng: np.random.Generator | None = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    熱浴法によるSAで`model`のエネルギーを最小化する
+
+    彩色の各色のノードは互いに結合しないため, 色ごとに全ノード・全読み出しを一括で更新する.
+    逆温度は`beta_range`の間を等比で上げる. `beta_schedule`を与えた場合はその列を1スイープずつ用いる.
+    `rng`を与えた場合は`seed`より優先する(区間に分けて呼び出す際に乱数列を引き継ぐため).
+
+    Returns
+    -------
+    states : np.ndarray
+      (読み出し数, ノード数)の最終状態 (モードは0-5)
+    energies : np.ndarray
+      各読み出しのエネルギー
+    """
+    if rng is None:
+        rng = np.random.default_rng(seed)
+    if initial_states is None:
+        states = rng.integers(0, MODE_COUNT, size=(num_reads, model.node_count))
+    else:
+        states = np.array(np.broadcast_to(initial_states, (num_reads, model.node_count)), dtype=np.int64)
+
+    if beta_schedule is not None:
+        betas = beta_schedule
+    else:
+        if beta_range is None:
+            beta_range = model.default_beta_range()
+        betas = np.geomspace(beta_range[0], beta_range[1], num_sweeps) if num_sweeps > 0 else []
+
+    # 局所場(`local_field`と同じ値)はモードを先頭の軸に置いた(6, 読み出し数, ノード数)の並びで計算する.
+    # 6モード・4方向の短い軸に沿った集計を, 連続した(読み出し数, ノード数)の配列どうしの演算にするため
+    for beta in betas:
+        for nodes, neighbors, base, linear in model._class_tables:
+            contributions = np.take(model._coupling_by_mode, base[:, None, :] + states[:, neighbors].transpose(1, 0, 2), axis=1)
+            field = linear[:, None, :] + contributions[:, 0]
+            for d in range(1, NEIGHBOR_SLOTS):
+                field += contributions[:, d]
+            field -= field.min(axis=0)
+            field *= -beta
+            cumulative = np.cumsum(np.exp(field, out=field), axis=0)
+            threshold = rng.random(cumulative.shape[1:])*cumulative[-1]
+            states[:, nodes] = (cumulative[:-1] < threshold).sum(axis=0)
+
+    return states, model.energy(states)
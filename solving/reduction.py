@@ -0,0 +1,108 @@
+"""
+QUBOの一部のノードのモードを固定し, 残りのノードだけの部分問題に縮約する
+
+変数$x_{i m}$(添字`i*MODE_KIND + m`)のうち, 固定したノードの変数は定数(固定したモードのみ1)となる.
+自由なノードとの結合は, 固定側が1のときだけ自由側の線形項に足し込む(折り込み).
+固定したノード同士の項は定数項(`offset`)になる.
+"""
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import List
+import numpy as np
+
+from traffic import MODE_COUNT
+
+
+@dataclass
+class ReducedQubo:
+    """
+    自由なノードだけに縮約したQUBO
+    """
+    nodes: np.ndarray
+    """自由なノード (元のノード番号). 部分問題のノード`k`が`nodes[k]`に対応する"""
+    rows: np.ndarray
+    """部分問題の変数番号 (`k*MODE_KIND + m`) によるCOO形式の行"""
+    cols: np.ndarray
+    vals: np.ndarray
+    neighbors: np.ndarray
+    """(len(`nodes`) x 4)の部分問題での隣接表. 隣接ノードが自由でない列は自身の番号"""
+    offset: float
+    """固定したノードのみからなる項の和 (元のQUBOのエネルギー = 部分問題のエネルギー + `offset`)"""
+
+
+def reduce_qubo(rows: np.ndarray, cols: np.ndarray, vals: np.ndarray, neighbors: np.ndarray,
+                free_nodes: np.ndarray, fixed_modes: np.ndarray | None = None) -> ReducedQubo:
+    """
+    COO形式のQUBOを`free_nodes`だけの部分問題に縮約する
+
+    `free_nodes`以外のノードは`fixed_modes`(全ノード分のモード0-5)に固定し, 結合を折り込む.
+    `fixed_modes`がNoneなら自由でないノードとの結合は捨てる(部分問題を独立に解く).
+    `neighbors`は全体の(ノード数 x 4)の隣接表(`MapInfo.neighborTable()`).
+    """
+    free_nodes = np.asarray(free_nodes, dtype=np.int64)
+    local = np.full(len(neighbors), -1, dtype=np.int64)
+    local[free_nodes] = np.arange(len(free_nodes))
+
+    node_r, mode_r = np.divmod(rows, MODE_COUNT)
+    node_c, mode_c = np.divmod(cols, MODE_COUNT)
+    free_r = local[node_r] >= 0
+    free_c = local[node_c] >= 0
+
+    both = free_r & free_c
+    out_rows = [local[node_r[both]]*MODE_COUNT + mode_r[both]]
+    out_cols = [local[node_c[both]]*MODE_COUNT + mode_c[both]]
+    out_vals = [vals[both]]
+    offset = 0.0
+
+    if fixed_modes is not None:
+        active_r = fixed_modes[node_r] == mode_r
+        active_c = fixed_modes[node_c] == mode_c
+        # 片方のみ固定: 固定側の変数が1なら自由側の線形項となる
+        for fold, node, mode in ((free_r & ~free_c & active_c, node_r, mode_r),
+                                 (~free_r & free_c & active_r, node_c, mode_c)):
+            variables = local[node[fold]]*MODE_COUNT + mode[fold]
+            out_rows.append(variables)
+            out_cols.append(variables)
+            out_vals.append(vals[fold])
+        offset = float(vals[~free_r & ~free_c & active_r & active_c].sum())
+
+    local_neighbors = local[neighbors[free_nodes]]
+    own = np.broadcast_to(np.arange(len(free_nodes))[:, None], local_neighbors.shape)
+    return ReducedQubo(
+        nodes=free_nodes,
+        rows=np.concatenate(out_rows),
+        cols=np.concatenate(out_cols),
+        vals=np.concatenate(out_vals),
+        neighbors=np.where(local_neighbors >= 0, local_neighbors, own),
+        offset=offset,
+    )
+
+
+def partition_qubo(rows: np.ndarray, cols: np.ndarray, vals: np.ndarray, neighbors: np.ndarray,
+                   owner: np.ndarray, fixed_modes: np.ndarray | None = None) -> List[ReducedQubo]:
+    """
+    ノードを`owner`(ノードごとのタイル番号)で分け, タイルごとに`reduce_qubo`した部分問題のリストを返す
+
+    各項は両端のノードのタイルにのみ渡すため, 全体の項を走査するのは一度だけで済む.
+    """
+    tile_count = int(owner.max()) + 1
+    tile_r = owner[rows // MODE_COUNT]
+    tile_c = owner[cols // MODE_COUNT]
+    cross = np.flatnonzero(tile_r != tile_c)
+    # 各項を行側のタイルに, タイルをまたぐ項は列側のタイルにも割り当てる
+    term_tile = np.concatenate((tile_r, tile_c[cross]))
+    term_index = np.concatenate((np.arange(len(rows)), cross))
+    order = np.argsort(term_tile, kind="stable")
+    term_index = term_index[order]
+    bounds = np.searchsorted(term_tile[order], np.arange(tile_count + 1))
+
+    node_order = np.argsort(owner, kind="stable")
+    node_bounds = np.searchsorted(owner[node_order], np.arange(tile_count + 1))
+
+    problems = []
+    for tile in range(tile_count):
+        terms = term_index[bounds[tile]:bounds[tile + 1]]
+        problems.append(reduce_qubo(rows[terms], cols[terms], vals[terms], neighbors,
+                                    node_order[node_bounds[tile]:node_bounds[tile + 1]], fixed_modes))
+    return problems
+
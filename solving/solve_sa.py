@@ -1,10 +1,19 @@
 from graph import *
 from traffic import *
-from typing import Dict, Tuple, List, Any
+from typing import Dict, Tuple, List, Any, TYPE_CHECKING
+import warnings
+import weakref
 import numpy as np
-import dimod
-from param import Coefficient, SAMPLER_DIMOD, SAMPLER_NEAL
-import neal
+from param import Coefficient, SAMPLER_DIMOD, SAMPLER_NEAL, SAMPLER_POTTS, SAMPLER_EXACT
+from solving.potts_sa import PottsModel, sample_potts
+from solving.exact_dp import TableTooLargeError, minimize_potts
+from solving.reduction import reduce_qubo
+from instrument import Instrumentation, NULL_INSTRUMENTATION
+
+# dimod・nealは読み込みに時間がかかるため, QUBOをそれらで解くときに初めてインポートする
+if TYPE_CHECKING:
+    import dimod
+    from solving.policy import ResolvePolicy
 
 MODE_KIND=6
 """
@@ -16,47 +25,32 @@ def get_flowable_count(node_traffic: NodeTraffic, mode: int):
     """
     指定された`node_traffics`にいる車のうち `mode` になったときに流出可能な車の合計台数を返す. 
 
-    論文中の$C_{i j}$に対応する. 
+    論文中の$C_{i j}$に対応する. `NodeTraffic`が保持する値を参照するためO(1)で得られる. 
     """
+    if mode not in MODE_FLOW:
+        return 0
+    return int(node_traffic.flowable[mode - 1])
 
-    allowed_flow = MODE_FLOW.get(mode, {})
-    total_count = 0
-    
-    # ノード内の各進入方向の待ち状況をカウント
-    for direction, allowed_turns in allowed_flow.items():
-        if direction not in node_traffic.queues:
-            continue
-            
-        # その方向のキューの中身（"straight", "right" など）を集計
-        counts = Counter(node_traffic.queues[direction])
-        
-        # 許可されている各動作について、待ち台数を加算
-        for turn_type in allowed_turns:
-            total_count += counts.get(turn_type, 0)
-            
-    return total_count
-
-def q1( edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo, lambda_1:float) -> np.array:
-    matrix_length=mapinfo.width()*mapinfo.height()*MODE_KIND
-    q_matrix=np.zeros((matrix_length, matrix_length), dtype=float)
-
-    for node_id in range(mapinfo.width()*mapinfo.height()):
-        if node_id not in node_traffics:
-            continue
-        
-        # 調査対象のノードの交通状況を参照するよ
-        node_traffic=node_traffics[node_id]
-
+def flowable_count_matrix(node_traffics: Dict, mapinfo: MapInfo) -> np.ndarray:
+    """
+    全ノードの$C_{ij}$を(ノード数 x `MODE_KIND`)の配列で返す. 
 
-        for j in range(MODE_KIND):
-            # モードがj+1のとき(1-6)の想定をここからする
-            mode = j + 1
+    `simulation_init`で生成した`node_traffics`であれば, 常に更新されている行列をそのまま返す. 
+    `node_traffics`に存在しないノードの行は0とする. 
+    """
+    return flowable_matrix(node_traffics, mapinfo.width()*mapinfo.height())
 
-            c_ij = get_flowable_count(node_traffic, mode)
-            k=node_id*MODE_KIND+j
-            q_matrix[k,k]=-lambda_1*c_ij
+def q1( edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo, lambda_1:float,
+        flowable: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Q1の対角項をCOO形式(rows, cols, vals)で返す
 
-    return q_matrix
+    `flowable`に$C_{ij}$の配列を与えた場合は再計算しない
+    """
+    if flowable is None:
+        flowable = flowable_count_matrix(node_traffics, mapinfo)
+    k = np.arange(flowable.size)
+    return k, k, -lambda_1*flowable.ravel()
 
 
 MODE_RELATIONS = {
@@ -71,189 +65,483 @@ MODE_RELATIONS = {
 元論文における, {a', b', c', d'}と{a, b, c, d}のリスト
 """
 
+DIRECTION_COLUMNS = {"north": 0, "south": 1, "east": 2, "west": 3}
+"""
+`MODE_RELATIONS`の方角名から`MapInfo.neighborTable()`の列への対応
+"""
+
+
+class QuboStructure:
+    """
+    マップごとに固定のQUBOの結合構造
+
+    Q2の(ノード, モード)-(隣接ノード, 推奨モード)の組と,
+    Q3のone-hotブロックの添字を構築時に一度だけ計算しておく.
+    各更新では`flowable`と時刻から値だけを埋める.
+    """
+    def __init__(self, mapinfo: MapInfo):
+        self.node_count = mapinfo.width()*mapinfo.height()
+        self.variable_count = self.node_count*MODE_KIND
+
+        # Q2: MODE_RELATIONSを全ノードに展開する
+        relations = [
+            (mode - 1, DIRECTION_COLUMNS[direction], preferred_mode - 1, is_prime)
+            for mode in range(1, MODE_KIND + 1)
+            for direction, preferred_mode, is_prime in MODE_RELATIONS[mode]
+        ]
+        rel_mode, rel_column, rel_preferred, rel_prime = (np.array(v) for v in zip(*relations))
+
+        nodes = np.repeat(np.arange(self.node_count), len(relations))
+        tiled = np.tile(np.arange(len(relations)), self.node_count)
+
+        self.pair_node = nodes
+        self.pair_mode = rel_mode[tiled]
+        self.pair_neighbor = mapinfo.neighborTable()[nodes, rel_column[tiled]]
+        self.pair_neighbor_mode = rel_preferred[tiled]
+        self.pair_prime = rel_prime[tiled].astype(bool)
+
+        # 隣接ノードまでの移動に要する時間(元論文T)
+        edge_idx = np.array([
+            mapinfo.directedEdgeIndex(int(a), int(b)) for a, b in zip(self.pair_node, self.pair_neighbor)
+        ], dtype=np.int64)
+        self.pair_time_need = mapinfo.edgeLengthArray()[edge_idx] / mapinfo.edgeSpeedArray()[edge_idx]
+
+        self.pair_k1 = self.pair_node*MODE_KIND + self.pair_mode
+        self.pair_k2 = self.pair_neighbor*MODE_KIND + self.pair_neighbor_mode
+
+        # Q3: 同一ノード内の(j, k)の全組
+        block = np.arange(MODE_KIND)
+        block_j, block_k = (a.ravel() for a in np.meshgrid(block, block, indexing="ij"))
+        offsets = np.repeat(np.arange(self.node_count)*MODE_KIND, len(block_j))
+        self.onehot_rows = offsets + np.tile(block_j, self.node_count)
+        self.onehot_cols = offsets + np.tile(block_k, self.node_count)
+        self.onehot_diagonal = self.onehot_rows == self.onehot_cols
+
+    def tau_mask(self, time: int, tau_threshold: float) -> np.ndarray:
+        """
+        元論文のtau (t mod T approx 0)が成立するQ2の組をTrueとする配列を返す
+        """
+        remainder = np.mod(time, self.pair_time_need)
+        return (remainder <= tau_threshold) | (np.abs(self.pair_time_need - remainder) <= tau_threshold)
+
+
+_structure_cache: "weakref.WeakKeyDictionary[MapInfo, QuboStructure]" = weakref.WeakKeyDictionary()
+
+
+def get_qubo_structure(mapinfo: MapInfo) -> QuboStructure:
+    """
+    `mapinfo`に対応する`QuboStructure`を返す. マップごとに一度だけ構築される. 
+    """
+    structure = _structure_cache.get(mapinfo)
+    if structure is None:
+        structure = QuboStructure(mapinfo)
+        _structure_cache[mapinfo] = structure
+    return structure
 
 
 def q2(time: int, edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo,
-        lambda_2: float, lambda2t: float, lambda2f: float, tau_threshold: float) -> np.array:
+        lambda_2: float, lambda2t: float, lambda2f: float, tau_threshold: float,
+        flowable: np.ndarray | None = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
     """
     Q2(論文準拠)の計算をするメソッド
+
+    各項`val`を`[k1, k2]`と`[k2, k1]`に`val/2`ずつ分けたCOO形式(rows, cols, vals)で返す
     """
-    matrix_length=mapinfo.width()*mapinfo.height()*MODE_KIND
-    
-    q_matrix=np.zeros((matrix_length, matrix_length), dtype=float)
-    
-    # まずは各ノードの交差点状況を取得する
-    for node_id in range(mapinfo.width()*mapinfo.height()):
-        node_traffic = node_traffics.get(node_id)
+    if flowable is None:
+        flowable = flowable_count_matrix(node_traffics, mapinfo)
+    structure = get_qubo_structure(mapinfo)
+
+    c_ij = flowable[structure.pair_node, structure.pair_mode]
+    c_neighbor = flowable[structure.pair_neighbor, structure.pair_neighbor_mode]
+    # C_ij=0またはtau=0の項は消去される
+    active = (c_ij != 0) & structure.tau_mask(time, tau_threshold)
 
-        if not node_traffic: continue
+    # 重み(元論文lambda3 or lambda3')
+    weighting = np.where(structure.pair_prime[active], lambda2t, lambda2f)
+    val = -lambda_2 * c_ij[active] * weighting * c_neighbor[active]
 
-        current_node = mapinfo.getNode(node_id)
+    k1 = structure.pair_k1[active]
+    k2 = structure.pair_k2[active]
+    return np.concatenate((k1, k2)), np.concatenate((k2, k1)), np.concatenate((val/2, val/2))
 
-        # 論文中のsum_j/ 各モードに関して考察を行う
-        for j_idx in range(MODE_KIND):
-            # 考察対象モード(1-6)
-            mode_j = j_idx + 1
 
-            c_ij=get_flowable_count(node_traffic, mode_j)
-            # おおもとのC_ijが0なら項は消去される. 
-            if c_ij==0: continue 
+def q3(edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo, lambda_3) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Q3(one-hot制約)をCOO形式(rows, cols, vals)で返す
+
+    同一ノード内で, 対角に`-lambda_3`, 非対角に`lambda_3`を置く
+    """
+    structure = get_qubo_structure(mapinfo)
+    vals = np.where(structure.onehot_diagonal, -lambda_3, lambda_3)
+    return structure.onehot_rows, structure.onehot_cols, vals
 
-            # そのmode_jに対応する4つのターゲット交差点(a', b', c', d')についてループする. 
-            targets = MODE_RELATIONS.get(mode_j, [])
 
-            # directionは隣接する交差点の向きに, preferred_modeはその交差点の"おすすめの"モード
-            # is_primeはlambda_3かlambda_3'のどっちを使うかの議論
-            for direction, preferred_mode, is_prime in targets:
-                neighbor_id=None
-                # 隣接ノードのid特定
-                if direction=="north":
-                    neighbor_id=current_node.north_id()
-                elif direction=="south":
-                    neighbor_id=current_node.south_id()
-                elif direction=="east":
-                    neighbor_id=current_node.east_id()
-                elif direction=="west":
-                    neighbor_id=current_node.west_id()
-                    
+def concat_terms(*terms: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    COO形式の項を連結して1つの(rows, cols, vals)にする
+    """
+    return (np.concatenate([t[0] for t in terms]),
+            np.concatenate([t[1] for t in terms]),
+            np.concatenate([t[2] for t in terms]))
 
-                if neighbor_id is None: 
-                    raise RuntimeError("directionがどの方角でもない実装上の致命的なエラー. どっかで矛盾発声")
 
-                edge = mapinfo.getEdgeBetween(node_id, neighbor_id)
-                if not edge: continue
+def build_bqm(variable_count: int, *terms: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> "dimod.BinaryQuadraticModel":
+    """
+    COO形式の項を足し合わせて`dimod.BinaryQuadraticModel`を生成する
 
-                # 隣接ノードまでの移動に要する時間(元論文T)
-                time_need=edge.length / edge.speed_limit
-                # 元論文 t mod T計算. approx 0か判定したい
-                remainder = time % time_need
-                # 実質的なtauの特定
-                # 結果が偽であればtau=0なので, 以降の処理を省略して次ループへ
-                if not((remainder <= tau_threshold) or (abs(time_need - remainder) <= tau_threshold)): continue
+    重複する添字や`[k1, k2]`, `[k2, k1]`の組は合算される
+    """
+    rows, cols, vals = concat_terms(*terms)
 
-                c_neighbor=get_flowable_count(node_traffics[neighbor_id], preferred_mode)
-                # 重み(元論文lambda3 or lambda3')
-                weighting = lambda2t if is_prime else lambda2f
+    diagonal = rows == cols
+    linear = np.bincount(rows[diagonal], weights=vals[diagonal], minlength=variable_count)
 
-                k1=node_id * MODE_KIND + (mode_j - 1)
-                k2 = neighbor_id * MODE_KIND + (preferred_mode - 1)
+    import dimod
+    off = ~diagonal & (vals != 0)
+    return dimod.BinaryQuadraticModel.from_numpy_vectors(
+        linear, (rows[off], cols[off], vals[off]), 0.0, dimod.BINARY
+    )
 
-                val = -lambda_2 * c_ij * weighting * c_neighbor
 
-                q_matrix[k1, k2] += val/2
-                q_matrix[k2, k1] += val/2
+def decode_one_hot(sample, node_count: int, verbose: bool = True,
+                   instrumentation: Instrumentation = NULL_INSTRUMENTATION) -> Dict[int, int]:
+    """
+    QUBOの解(変数番号からビットへの対応)を{node_id: mode_id}に変換する
 
+    one-hot制約を満たさないノードは, 1つ以上立っていれば最初のモード, 1つも立っていなければモード1とする.
+    違反したノード数は`instrumentation`のカウンタ`onehot_violations`に加算する
+    """
+    node_mode_map = {}
 
+    total_violations=0
+    for i in range(node_count):
+        start = i * MODE_KIND
+        
+        # 当該ノードのビット列を取得
+        node_bits = [sample[start + m] for m in range(MODE_KIND)]
+        active_indices = [m for m, val in enumerate(node_bits) if val == 1]
+        num_active = len(active_indices)
 
+        # --- コンソール出力用：制約違反のチェック ---
+        if num_active != 1:
+            total_violations += 1
+            if verbose:
+                print(f"[SA Warning] Node {i:2d} violated one-hot constraint: "
+                      f"{num_active} bits active (Indices: {active_indices})")
 
+        # 返り値用の暫定処理 (シミュレーション継続のため)
+        # 1つ以上あれば最初の1つ、0個ならデフォルトでモード1を割り当て
+        if num_active >= 1:
+            selected_mode = active_indices[0] + 1
+        else:
+            selected_mode = 1
+            
+        node_mode_map[i] = selected_mode
 
+    instrumentation.count("onehot_violations", total_violations)
+    if verbose:
+        if total_violations > 0:
+            print(f"--- Summary: {total_violations}/{node_count} nodes had one-hot violations. ---")
+        else:
+            print(f"--- SA Optimization Success: All nodes satisfied one-hot constraint. ---")
 
+    return node_mode_map
 
 
+def build_terms(coefficient: Coefficient, time: int, flowable: np.ndarray,
+                mapinfo: MapInfo) -> List[Tuple[np.ndarray, np.ndarray, np.ndarray]]:
+    """
+    $C_{ij}$の配列`flowable`からQ1, Q2, Q3をCOO形式で生成して返す
+    """
+    return [
+        q1(None, None, mapinfo, coefficient.lambda1, flowable=flowable),
+        q2(time, None, None, mapinfo,
+           coefficient.lambda2, coefficient.lambda2t, coefficient.lambda2f,
+           coefficient.tau_threshold, flowable=flowable),
+        q3(None, None, mapinfo, coefficient.lambda3),
+    ]
 
-    return q_matrix
 
-def q3(edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo, lambda_3) -> np.array:
-    matrix_length=mapinfo.width()*mapinfo.height()*MODE_KIND
-    
-    q_matrix=np.zeros((matrix_length, matrix_length), dtype=float)
-    for i in range(mapinfo.width()*mapinfo.height()):
-        start_idx=i*MODE_KIND
-        end_idx=(i+1)*MODE_KIND
+def current_mode_array(node_traffics: Dict, node_count: int) -> np.ndarray:
+    """
+    各ノードの現在のモード(0-5)を配列で返す. `node_traffics`に存在しないノードは0とする
+    """
+    modes = np.zeros(node_count, dtype=np.int64)
+    for node_id, traffic in node_traffics.items():
+        if 1 <= traffic.mode <= MODE_KIND:
+            modes[node_id] = traffic.mode - 1
+    return modes
 
-        for j in range(start_idx, end_idx):
-            for k in range(start_idx, end_idx):
-                if(j == k):
-                    q_matrix[j, k]+= -lambda_3
-                else: 
-                    q_matrix[j, k]+= lambda_3
 
-    return q_matrix
+def preload_sampler(coefficient: Coefficient):
+    """
+    `coefficient.sampler`が用いるライブラリ(dimod, neal)をインポートしておく
 
+    初回の求解の所要時間にインポートの時間が含まれないよう, シミュレーション開始前に呼ぶ
+    """
+    if coefficient.sampler == SAMPLER_NEAL:
+        import neal
+    if coefficient.sampler not in (SAMPLER_POTTS, SAMPLER_EXACT):
+        import dimod
 
 
+def solve_rng(coefficient: Coefficient, time: int) -> np.random.Generator:
+    """
+    時刻`time`の求解に用いる乱数生成器を返す
 
+    `coefficient.seed`と`time`から乱数列を作るため, 同期実行・並行実行のどちらでも同じ時刻の求解は同じ乱数を使う.
+    `seed`がNoneなら毎回異なる
+    """
+    if coefficient.seed is None:
+        return np.random.default_rng()
+    return np.random.default_rng(np.random.SeedSequence([coefficient.seed, time]))
 
 
+def neal_seed(rng: np.random.Generator) -> int:
+    """`rng`からnealに与えるシードを引く (nealが受け付けるのは0以上2^31未満)"""
+    return int(rng.integers(2**31))
 
 
-def solve_main(coefficient: Coefficient, time: int, edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo) -> Dict[int, int]:
+def warm_beta_schedules(beta_range: Tuple[float, float], coefficient: Coefficient) -> List[np.ndarray]:
     """
-    SAで解くメイン実装
-    QUBO matrixの生成, dimodによるSA求解, node-mode形式の辞書オブジェクト生成までをおこない, 
-    各ノードidのキーと, そのノードのモードについての辞書を返す
+    warm start用の逆温度列を`warm_start_chunk`スイープずつに区切って返す
+
+    `beta_range`を等比で`warm_start_beta_fraction`だけ低温側に進めた値から低温端まで等比で上げる
+    """
+    hot, cold = beta_range
+    start = hot**(1 - coefficient.warm_start_beta_fraction) * cold**coefficient.warm_start_beta_fraction
+    betas = np.geomspace(start, cold, max(coefficient.warm_start_sweeps, 1))
+    chunk = max(coefficient.warm_start_chunk, 1)
+    return [betas[i:i + chunk] for i in range(0, len(betas), chunk)]
 
-    Parameters
-    ----------
-    coefficient: Coefficient
-      QUBOのための係数群
-    time : int
-      シミュレーション内時間
-    
-    
 
+def anneal_warm(run_chunk, states: np.ndarray, initial_energy: float,
+                schedules: List[np.ndarray]) -> Tuple[np.ndarray, float]:
     """
+    `schedules`の区間ごとに`run_chunk(states, betas) -> (states, energies)`を呼んで焼きなまし, 
+    区間の間にどの読み出しの状態も変化しなくなった(凍結した)時点で打ち切る.
 
-    matrix_length=mapinfo.width()*mapinfo.height()*MODE_KIND
+    初期状態も候補に含めた最良の状態とそのエネルギーを返すため, 初期状態より悪い解は返らない.
+    """
+    best_state, best_energy = states[0].copy(), initial_energy
+    for betas in schedules:
+        previous = states
+        states, energies = run_chunk(states, betas)
+        k = int(np.argmin(energies))
+        if energies[k] < best_energy:
+            best_state, best_energy = states[k].copy(), float(energies[k])
+        if np.array_equal(previous, states):
+            break
+    return best_state, best_energy
+
+
+def solve_potts(coefficient: Coefficient, terms: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                mapinfo: MapInfo | np.ndarray, current_modes: np.ndarray | None = None,
+                instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                rng: np.random.Generator | None = None) -> Dict[int, int]:
+    """
+    QUBOの項をPottsモデルに変換してSAで解き, {node_id: mode_id}を返す
 
-    q_matrix=np.zeros((matrix_length, matrix_length), dtype=float)
+    状態は常にone-hotを満たすため, 制約違反の検査は不要.
+    `current_modes`(0-5)を与えた場合はそれを初期状態としてwarm startする.
+    `mapinfo`の代わりに隣接表を与えると部分問題(`solving/reduction.py`)を解く.
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+    with instrumentation.phase("qubo_build"):
+        model = PottsModel(mapinfo, *concat_terms(*terms))
+    if instrumentation.enabled:
+        instrumentation.count("qubo_nonzeros", int(np.count_nonzero(model.linear)) + int(np.count_nonzero(model.coupling))//2)
+    with instrumentation.phase("sampling"):
+        if current_modes is None:
+            states, energies = sample_potts(model, num_reads=coefficient.num_reads, num_sweeps=coefficient.num_sweeps, rng=rng)
+            best = states[int(np.argmin(energies))]
+        else:
+            def run_chunk(states, betas):
+                return sample_potts(model, num_reads=coefficient.num_reads, initial_states=states,
+                                    beta_schedule=betas, rng=rng)
+            states = np.tile(current_modes, (coefficient.num_reads, 1))
+            best, _ = anneal_warm(run_chunk, states, float(model.energy(current_modes)[0]),
+                                  warm_beta_schedules(model.default_beta_range(), coefficient))
+    return {i: int(mode) + 1 for i, mode in enumerate(best)}
+
+
+def solve_exact(terms: List[Tuple[np.ndarray, np.ndarray, np.ndarray]], mapinfo: MapInfo | np.ndarray,
+                instrumentation: Instrumentation = NULL_INSTRUMENTATION, coefficient: Coefficient | None = None,
+                current_modes: np.ndarray | None = None, rng: np.random.Generator | None = None) -> Dict[int, int]:
+    """
+    QUBOの項をPottsモデルに変換して動的計画法(`solving/exact_dp.py`)で厳密に解き, {node_id: mode_id}を返す
 
-    q_matrix+=q1(edge_traffics, node_traffics, mapinfo, coefficient.lambda1)
-    q_matrix+=q2(time, edge_traffics, node_traffics, mapinfo, 
-                 coefficient.lambda2, coefficient.lambda2t, coefficient.lambda2f, 
-                 coefficient.tau_threshold)
-    q_matrix+=q3(edge_traffics, node_traffics, mapinfo, coefficient.lambda3)
+    one-hot状態の中での最適解を返す. 乱数・初期状態は用いない.
+    `mapinfo`の代わりに隣接表を与えると部分問題(`solving/reduction.py`)を解く.
+    表が大きすぎて厳密に解けない場合は警告を出し, `coefficient`の設定でPottsモデルのSA(`solve_potts`)で解く.
+    """
+    with instrumentation.phase("qubo_build"):
+        model = PottsModel(mapinfo, *concat_terms(*terms))
+    if instrumentation.enabled:
+        instrumentation.count("qubo_nonzeros", int(np.count_nonzero(model.linear)) + int(np.count_nonzero(model.coupling))//2)
+    shape = None if isinstance(mapinfo, np.ndarray) else (mapinfo.height(), mapinfo.width())
+    try:
+        with instrumentation.phase("sampling"):
+            best, _ = minimize_potts(model, shape=shape)
+    except TableTooLargeError as error:
+        warnings.warn(f"{error}; falling back to the Potts annealer", RuntimeWarning, stacklevel=2)
+        return solve_potts(coefficient or Coefficient(), terms, mapinfo, current_modes=current_modes,
+                           instrumentation=instrumentation, rng=rng)
+    return {i: int(mode) + 1 for i, mode in enumerate(best)}
+
+
+def solve_modes(coefficient: Coefficient, time: int, flowable: np.ndarray, mapinfo: MapInfo,
+                current_modes: np.ndarray | None = None, verbose: bool = False,
+                instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                policy: "ResolvePolicy | None" = None) -> Dict[int, int]:
+    """
+    $C_{ij}$の配列と現在のモードだけからQUBOを生成して解き, {node_id: mode_id}を返す
 
-    qubo_dict={}
-    rows, cols=np.nonzero(q_matrix)
-    for i, j in zip(rows, cols):
-        qubo_dict[(int(i), int(j))]=q_matrix[i,j]
-    
-    if coefficient.sampler == SAMPLER_NEAL: 
-        sampler = neal.SimulatedAnnealingSampler()
-        sampleset = sampler.sample_qubo(qubo_dict, num_reads=coefficient.num_reads, num_sweeps=coefficient.num_sweeps)
+    交通状態(`edge_traffics`, `node_traffics`)を参照しないため, スナップショットを渡して
+    別スレッド・別プロセスで実行できる. 
+    `coefficient.solve_tile_size`が正ならマップをタイルに分割して解く(`solving/tiled.py`). 
+    `coefficient.fix_trivial_nodes`なら自明なノードを現在のモードに固定し, 残りのノードだけを解く(`solve_core`). 
 
-        best_sample=sampleset.first.sample
-    else: 
-            
-        sampler = dimod.SimulatedAnnealingSampler()
-        sampleset = sampler.sample_qubo(qubo_dict, num_reads=coefficient.num_reads, num_sweeps=coefficient.num_sweeps)
+    Parameters
+    ----------
+    flowable : np.ndarray
+      (ノード数 x `MODE_KIND`)の$C_{ij}$
+    current_modes : np.ndarray | None
+      各ノードの現在のモード(0-5). `coefficient.warm_start`のときの初期状態と, 自明なノードの固定に用いる
+    instrumentation : Instrumentation
+      QUBO生成・サンプリング・復号の所要時間と, 非ゼロ係数数・one-hot違反数の記録先
+    policy : ResolvePolicy | None
+      与えた場合, 前回解いた状態からほとんど変わっていなければ解き直さず過去の解を返す(`solving/policy.py`)
+    """
+    if policy is not None:
+        modes, reused = policy.solve(time, flowable, lambda: solve_modes(
+            coefficient, time, flowable, mapinfo, current_modes=current_modes, verbose=verbose,
+            instrumentation=instrumentation))
+        if reused:
+            instrumentation.count("solves_reused")
+        return modes
+
+    if coefficient.solve_tile_size > 0:
+        from solving.tiled import solve_modes_tiled
+        return solve_modes_tiled(coefficient, time, flowable, mapinfo, current_modes=current_modes,
+                                 verbose=verbose, instrumentation=instrumentation)
+
+    structure = get_qubo_structure(mapinfo)
+    with instrumentation.phase("qubo_build"):
+        terms = build_terms(coefficient, time, flowable, mapinfo)
+    if coefficient.fix_trivial_nodes:
+        free_nodes = np.flatnonzero(flowable.any(axis=1))
+        if len(free_nodes) < structure.node_count:
+            return solve_core(coefficient, terms, free_nodes, mapinfo, current_modes=current_modes, verbose=verbose,
+                              instrumentation=instrumentation, rng=solve_rng(coefficient, time))
+    if not coefficient.warm_start:
+        current_modes = None
+    return solve_terms(coefficient, terms, structure.node_count, mapinfo, current_modes=current_modes,
+                       verbose=verbose, instrumentation=instrumentation, rng=solve_rng(coefficient, time))
+
+
+def solve_core(coefficient: Coefficient, terms: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+               free_nodes: np.ndarray, mapinfo: MapInfo, current_modes: np.ndarray | None = None,
+               verbose: bool = False, instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+               rng: np.random.Generator | None = None) -> Dict[int, int]:
+    """
+    `free_nodes`以外のノードを現在のモードに固定して縮約したQUBO(`solving/reduction.py`)を解き,
+    全ノードの{node_id: mode_id}を返す
 
-        best_sample=sampleset.first.sample
+    全モードで$C_{ij}=0$のノードはQ1を持たず, Q2の項もすべて$C_{ij}$との積で0となるため, どのモードでもエネルギーは変わらない.
+    このようなノードを固定しても最適解は失われず, 信号も不要に切り替わらない.
+    `current_modes`がNoneなら固定するノードはモード1とする.
 
-    # 5. 解の形式を変換: {node_id: mode_id}
-    node_mode_map = {}
+    `reduce_qubo`は固定したノードとの結合を自由なノードの線形項に折り込むが, $C_{ij}=0$のノードはQ2の項を持たないため
+    折り込まれる項はない. つまりこの縮約が取り除くのは, もともと他のノードと結合していないノードだけである
+    (結合を持つノードを固定する場合の折り込みはタイル分割(`solving/tiled.py`)で用いている).
+    """
+    node_count = mapinfo.width()*mapinfo.height()
+    fixed_modes = np.zeros(node_count, dtype=np.int64) if current_modes is None else np.asarray(current_modes, dtype=np.int64)
+    instrumentation.count("fixed_nodes", node_count - len(free_nodes))
+    modes = fixed_modes.copy()
+    if len(free_nodes):
+        with instrumentation.phase("qubo_build"):
+            problem = reduce_qubo(*concat_terms(*terms), mapinfo.neighborTable(), free_nodes, fixed_modes)
+        initial = fixed_modes[free_nodes] if coefficient.warm_start and current_modes is not None else None
+        result = solve_terms(coefficient, [(problem.rows, problem.cols, problem.vals)], len(free_nodes),
+                             problem.neighbors, current_modes=initial, verbose=verbose,
+                             instrumentation=instrumentation, rng=rng)
+        modes[free_nodes] = [result[k] - 1 for k in range(len(free_nodes))]
+    return {i: int(mode) + 1 for i, mode in enumerate(modes)}
+
+
+def solve_terms(coefficient: Coefficient, terms: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                node_count: int, topology: MapInfo | np.ndarray, current_modes: np.ndarray | None = None,
+                verbose: bool = False, instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+                rng: np.random.Generator | None = None) -> Dict[int, int]:
+    """
+    COO形式の項の和で表される`node_count`ノード分のQUBOを`coefficient.sampler`で解き, {node_id: mode_id}を返す
 
-    total_violations=0
-    for i in range(mapinfo.width()*mapinfo.height()):
-        start = i * MODE_KIND
-        end = (i + 1) * MODE_KIND
-        
-        # 当該ノードのビット列を取得
-        node_bits = [best_sample[start + m] for m in range(MODE_KIND)]
-        active_indices = [m for m, val in enumerate(node_bits) if val == 1]
-        num_active = len(active_indices)
+    `topology`はマップ, または部分問題の(ノード数 x 4)の隣接表(Pottsモデルと厳密解法でのみ用いる).
+    `current_modes`(0-5)を与えた場合はそれを初期状態とする(Pottsモデルのみ. nealとdimodでは無視する)
+    """
+    if rng is None:
+        rng = np.random.default_rng()
+
+    if coefficient.sampler == SAMPLER_EXACT:
+        return solve_exact(terms, topology, instrumentation=instrumentation, coefficient=coefficient,
+                           current_modes=current_modes, rng=rng)
+
+    if coefficient.sampler == SAMPLER_POTTS:
+        return solve_potts(coefficient, terms, topology, current_modes=current_modes, instrumentation=instrumentation,
+                           rng=rng)
+
+    with instrumentation.phase("qubo_build"):
+        bqm = build_bqm(node_count*MODE_KIND, *terms)
+    if instrumentation.enabled:
+        instrumentation.count("qubo_nonzeros", int(bqm.num_variables + bqm.num_interactions))
+
+    with instrumentation.phase("sampling"):
+        if coefficient.sampler == SAMPLER_NEAL: 
+            import neal
+            sampleset = neal.SimulatedAnnealingSampler().sample(
+                bqm, num_reads=coefficient.num_reads, num_sweeps=coefficient.num_sweeps, seed=neal_seed(rng))
+        else: 
+            # dimodの参照実装はシードを受け付けない
+            import dimod
+            sampleset = dimod.SimulatedAnnealingSampler().sample(
+                bqm, num_reads=coefficient.num_reads, num_sweeps=coefficient.num_sweeps)
 
-        # --- コンソール出力用：制約違反のチェック ---
-        if num_active != 1:
-            total_violations += 1
-            print(f"[SA Warning] Node {i:2d} violated one-hot constraint: "
-                  f"{num_active} bits active (Indices: {active_indices})")
+        best_sample=sampleset.first.sample
 
-        # 返り値用の暫定処理 (シミュレーション継続のため)
-        # 1つ以上あれば最初の1つ、0個ならデフォルトでモード1を割り当て
-        if num_active >= 1:
-            selected_mode = active_indices[0] + 1
-        else:
-            selected_mode = active_indices[0] + 1
-            
-        node_mode_map[i] = selected_mode
+    # 5. 解の形式を変換: {node_id: mode_id}
+    with instrumentation.phase("decode"):
+        return decode_one_hot(best_sample, node_count, verbose=verbose, instrumentation=instrumentation)
 
-    if total_violations > 0:
-        print(f"--- Summary: {total_violations}/{mapinfo.width()*mapinfo.height()} nodes had one-hot violations. ---")
-    else:
-        print(f"--- SA Optimization Success: All nodes satisfied one-hot constraint. ---")
 
-    return node_mode_map
+def solve_main(coefficient: Coefficient, time: int, edge_traffics: Dict, node_traffics: Dict, mapinfo: MapInfo,
+               verbose: bool = True, instrumentation: Instrumentation = NULL_INSTRUMENTATION,
+               policy: "ResolvePolicy | None" = None) -> Dict[int, int]:
+    """
+    SAで解くメイン実装
+    QUBO matrixの生成, dimodによるSA求解, node-mode形式の辞書オブジェクト生成までをおこない, 
+    各ノードidのキーと, そのノードのモードについての辞書を返す
 
+    交通状態から$C_{ij}$と現在のモードを取り出して`solve_modes`を呼ぶ
+
+    Parameters
+    ----------
+    coefficient: Coefficient
+      QUBOのための係数群
+    time : int
+      シミュレーション内時間
+    verbose : bool
+      one-hot制約の検査結果をprintするか
+    policy : ResolvePolicy | None
+      解き直すかどうかを決める方針 (`solve_modes`を参照)
     
+    """
+    node_count = mapinfo.width()*mapinfo.height()
+    flowable = flowable_count_matrix(node_traffics, mapinfo)
+    current_modes = None
+    if coefficient.warm_start or coefficient.fix_trivial_nodes:
+        current_modes = current_mode_array(node_traffics, node_count)
+    return solve_modes(coefficient, time, flowable, mapinfo, current_modes=current_modes, verbose=verbose,
+                       instrumentation=instrumentation, policy=policy)
@@ -0,0 +1,124 @@
+"""
+マップを矩形のタイルに分割し, タイルごとのQUBOをプロセスプールで並列に解く
+
+Q2は隣接ノード間にしか結合がないため, タイルの外のノードのモードを固定すれば
+タイルごとの部分問題(`solving/reduction.py`)は互いに独立に解ける.
+
+1. 1回目はタイル外との結合を捨て(warm startでは現在のモードに固定し), 各タイルを独立に解く
+2. 2回目以降はタイルの境界を半分ずつずらし, タイル外のノードを直前の解に固定して解き直す.
+   前の回の境界ノードが新しいタイルの内側に来るため, 境界をまたぐ結合も最適化される
+
+部分問題の大きさはタイルの大きさで決まるため, マップが大きくなっても1タイルあたりの求解時間は変わらない.
+"""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple
+import math
+import os
+
+import numpy as np
+
+from graph import MapInfo
+from instrument import Instrumentation, NULL_INSTRUMENTATION
+from param import Coefficient
+from solving.reduction import ReducedQubo, partition_qubo
+from solving.solve_sa import build_terms, concat_terms, preload_sampler, solve_rng, solve_terms
+
+
+_executor: ProcessPoolExecutor | None = None
+"""タイルを解くプロセスプール (呼び出し間で使い回す)"""
+_executor_workers = 0
+
+
+def _get_executor(workers: int, coefficient: Coefficient) -> ProcessPoolExecutor:
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers != workers:
+        shutdown_tile_pool()
+        _executor = ProcessPoolExecutor(max_workers=workers, initializer=preload_sampler, initargs=(coefficient,))
+        _executor_workers = workers
+    return _executor
+
+
+def shutdown_tile_pool():
+    """
+    タイルを解くプロセスプールを終了する (次の求解で必要になれば作り直す)
+    """
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown()
+    _executor = None
+    _executor_workers = 0
+
+
+def tile_layout(mapinfo: MapInfo, tile_size: int) -> Tuple[int, int]:
+    """
+    一辺`tile_size`ノード程度のタイルに分けたときの(行数, 列数)を返す
+    """
+    return max(1, math.ceil(mapinfo.height() / tile_size)), max(1, math.ceil(mapinfo.width() / tile_size))
+
+
+def solve_tile(coefficient: Coefficient, problem: ReducedQubo, current_modes: np.ndarray | None,
+               seed: int) -> np.ndarray:
+    """
+    1タイルの部分問題を解き, タイル内のノードのモード(0-5)を`problem.nodes`の順に返す
+    """
+    result = solve_terms(coefficient, [(problem.rows, problem.cols, problem.vals)], len(problem.nodes),
+                         problem.neighbors, current_modes=current_modes, rng=np.random.default_rng(seed))
+    return np.array([result[k] for k in range(len(problem.nodes))], dtype=np.int64) - 1
+
+
+def _solve_tiles(coefficient: Coefficient, problems: List[ReducedQubo], current_modes: List[np.ndarray | None],
+                 seeds: List[int], workers: int) -> List[np.ndarray]:
+    if workers <= 1 or len(problems) <= 1:
+        return [solve_tile(coefficient, *args) for args in zip(problems, current_modes, seeds)]
+    executor = _get_executor(workers, coefficient)
+    chunksize = max(1, math.ceil(len(problems) / workers))
+    return list(executor.map(solve_tile, [coefficient]*len(problems), problems, current_modes, seeds,
+                             chunksize=chunksize))
+
+
+def solve_modes_tiled(coefficient: Coefficient, time: int, flowable: np.ndarray, mapinfo: MapInfo,
+                      current_modes: np.ndarray | None = None, verbose: bool = False,
+                      instrumentation: Instrumentation = NULL_INSTRUMENTATION) -> Dict[int, int]:
+    """
+    `solve_modes`と同じ入出力で, マップを一辺`coefficient.solve_tile_size`ノードのタイルに分けて解く
+
+    タイルごとの乱数のシードは`solve_rng(coefficient, time)`から引くため, 並列実行の順序によらず結果は同じになる.
+    """
+    node_count = mapinfo.width()*mapinfo.height()
+    with instrumentation.phase("qubo_build"):
+        rows, cols, vals = concat_terms(*build_terms(coefficient, time, flowable, mapinfo))
+    if instrumentation.enabled:
+        instrumentation.count("qubo_nonzeros", int(np.count_nonzero(vals)))
+    if not coefficient.warm_start:
+        current_modes = None
+    rng = solve_rng(coefficient, time)
+
+    tile_rows, tile_cols = tile_layout(mapinfo, coefficient.solve_tile_size)
+    workers = coefficient.solve_workers
+    if workers is None:
+        workers = min(tile_rows*tile_cols, os.cpu_count() or 1)
+    neighbors = mapinfo.neighborTable()
+    modes = None if current_modes is None else np.asarray(current_modes, dtype=np.int64)
+
+    for iteration in range(max(1, coefficient.solve_tile_rounds)):
+        # 奇数回目はタイルの境界を半分ずらす
+        shift = coefficient.solve_tile_size // 2 if iteration % 2 else 0
+        owner = mapinfo.tileAssignment(tile_rows, tile_cols, y_offset=shift, x_offset=shift)
+        with instrumentation.phase("qubo_build"):
+            problems = partition_qubo(rows, cols, vals, neighbors, owner, fixed_modes=modes)
+            problems = [problem for problem in problems if len(problem.nodes)]
+        seeds = rng.integers(2**31, size=len(problems)).tolist()
+        initial = [None if modes is None or not coefficient.warm_start else modes[problem.nodes]
+                   for problem in problems]
+        with instrumentation.phase("sampling"):
+            results = _solve_tiles(coefficient, problems, initial, seeds, workers)
+
+        solved = np.zeros(node_count, dtype=np.int64) if modes is None else modes.copy()
+        for problem, local_modes in zip(problems, results):
+            solved[problem.nodes] = local_modes
+        modes = solved
+
+    if verbose:
+        print(f"--- Tiled SA: {tile_rows}x{tile_cols} tiles, {coefficient.solve_tile_rounds} rounds ---")
+    return {i: int(mode) + 1 for i, mode in enumerate(modes)}
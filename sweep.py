@@ -0,0 +1,194 @@
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, asdict, fields, replace
+from itertools import product
+from time import perf_counter
+from typing import Any, Dict, Iterable, List
+import csv
+import hashlib
+import json
+import os
+
+from param import *
+
+
+@dataclass
+class SweepRun:
+    """
+    スイープ内の1回のシミュレーション設定
+    """
+    simparams: SimulationParams
+    coefficient: Coefficient
+    mapgenparam: MapGenerationParam
+    seed: int = 0
+    """各パラメータの`seed`がNoneのときに`apply_seed`で分けて与えるシード"""
+    width: int = 6
+    height: int = 6
+
+    def run_id(self) -> str:
+        """
+        設定内容から決まる識別子. 再開時に実行済みかどうかの判定に用いる
+        """
+        key = json.dumps(
+            [asdict(self.simparams), asdict(self.coefficient), asdict(self.mapgenparam),
+             self.seed, self.width, self.height],
+            sort_keys=True,
+        )
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()[:12]
+
+
+def expand_grid(base: Any, **grid: Iterable) -> List[Any]:
+    """
+    データクラス`base`のフィールドを`grid`の値の直積で置き換えた一覧を返す
+
+    例: `expand_grid(Coefficient(), lambda2=[30, 60], num_sweeps=[1000, 4000])`
+    """
+    names = list(grid.keys())
+    return [replace(base, **dict(zip(names, values))) for values in product(*(grid[name] for name in names))]
+
+
+def build_sweep(
+    simparams: Iterable[SimulationParams],
+    coefficients: Iterable[Coefficient],
+    mapgenparams: Iterable[MapGenerationParam],
+    seeds: Iterable[int],
+    width: int = 6,
+    height: int = 6,
+) -> List[SweepRun]:
+    """
+    各パラメータ群とシードの直積からスイープを生成する
+    """
+    return [
+        SweepRun(simparams=s, coefficient=c, mapgenparam=m, seed=seed, width=width, height=height)
+        for s, c, m, seed in product(list(simparams), list(coefficients), list(mapgenparams), list(seeds))
+    ]
+
+
+def _flatten(prefix: str, params: Any) -> Dict[str, Any]:
+    row = {}
+    for f in fields(params):
+        value = getattr(params, f.name)
+        row[f"{prefix}{f.name}"] = json.dumps(value) if isinstance(value, (list, dict)) else value
+    return row
+
+
+SUMMARY_COLUMNS = ["total_time_wasted", "mean_flowout_ratio", "total_solve_time", "solve_count", "wall_time"]
+"""結果表の集計指標の列"""
+
+
+def result_columns() -> List[str]:
+    """
+    結果表の列名(`run_single`が返す行のキー)を順に返す
+    """
+    return (["run_id", "seed", "width", "height"]
+            + [f"sim_{f.name}" for f in fields(SimulationParams)]
+            + [f"coef_{f.name}" for f in fields(Coefficient)]
+            + [f"map_{f.name}" for f in fields(MapGenerationParam)]
+            + SUMMARY_COLUMNS)
+
+
+def run_single(run: SweepRun) -> Dict[str, Any]:
+    """
+    1回のシミュレーションを実行し, 結果表の1行(設定と集計指標)を返す
+
+    ワーカープロセスから呼ばれるため, printと車両位置の記録は無効化する
+    """
+    # 重いインポートは実行時に行う
+    from history import SummaryHistorySink
+    from simulator import simulation, simulation_init
+
+    simparams, coefficient, mapgenparam = apply_seed(
+        run.seed, replace(run.simparams, verbose=False, record_edges=False), run.coefficient, run.mapgenparam)
+    start = perf_counter()
+    mapinfo, edge_traffics, node_traffics = simulation_init(mapgenparam, width=run.width, height=run.height)
+    summary = simulation(simparams, coefficient, mapinfo, edge_traffics, node_traffics, sink=SummaryHistorySink())
+    wall_time = perf_counter() - start
+
+    row: Dict[str, Any] = {
+        "run_id": run.run_id(),
+        "seed": run.seed,
+        "width": run.width,
+        "height": run.height,
+    }
+    row.update(_flatten("sim_", simparams))
+    row.update(_flatten("coef_", coefficient))
+    row.update(_flatten("map_", mapgenparam))
+    row.update({
+        "total_time_wasted": summary["total_time_wasted"],
+        "mean_flowout_ratio": summary["mean_flowout_ratio"],
+        "total_solve_time": summary["total_solve_time"],
+        "solve_count": summary["solve_count"],
+        "wall_time": wall_time,
+    })
+    return row
+
+
+def completed_run_ids(output_path: str) -> set[str]:
+    """
+    結果表に記録済みの`run_id`を返す
+    """
+    if not os.path.exists(output_path):
+        return set()
+    with open(output_path, newline="", encoding="utf-8") as f:
+        return {row["run_id"] for row in csv.DictReader(f)}
+
+
+def existing_header(output_path: str) -> List[str] | None:
+    """
+    結果表の見出し行を返す. ファイルがないか空ならNone
+    """
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return None
+    with open(output_path, newline="", encoding="utf-8") as f:
+        return next(csv.reader(f), None)
+
+
+def run_sweep(runs: List[SweepRun], output_path: str = "results/sweep.csv", max_workers: int | None = None) -> List[Dict[str, Any]]:
+    """
+    スイープをプロセスプールで並列実行し, 終わった順に結果表(CSV)へ追記する
+
+    `output_path`に記録済みの`run_id`は実行しないため, 中断後に同じ呼び出しで再開できる.
+    既存の結果表の列が今回の行と異なる場合(パラメータのフィールドが変わった場合など)は`ValueError`を送出する.
+    今回実行した行を返す.
+    """
+    columns = result_columns()
+    header = existing_header(output_path)
+    if header is not None and header != columns:
+        raise ValueError(f"columns of {output_path} do not match this sweep "
+                         f"(missing: {sorted(set(columns) - set(header))}, extra: {sorted(set(header) - set(columns))}); "
+                         "write to a new file")
+    done = completed_run_ids(output_path)
+    pending = [run for run in runs if run.run_id() not in done]
+    print(f"Sweep: {len(runs)} runs, {len(runs) - len(pending)} already done, {len(pending)} to run")
+    if not pending:
+        return []
+
+    output_dir = os.path.dirname(output_path)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    rows = []
+    with open(output_path, "a", newline="", encoding="utf-8") as f, ProcessPoolExecutor(max_workers=max_workers) as executor:
+        writer = csv.DictWriter(f, fieldnames=columns)
+        if header is None:
+            writer.writeheader()
+        futures = [executor.submit(run_single, run) for run in pending]
+        for i, future in enumerate(as_completed(futures), start=1):
+            row = future.result()
+            writer.writerow(row)
+            # 中断されても完了分が残るよう1行ごとに書き出す
+            f.flush()
+            rows.append(row)
+            print(f"[{i}/{len(pending)}] {row['run_id']} strategy={row['sim_update_strategy']} seed={row['seed']} "
+                  f"waste={row['total_time_wasted']:.2f} ({row['wall_time']:.1f}s)")
+    return rows
+
+
+if __name__ == "__main__":
+    # QUBO・固定サイクル・ランダムの比較
+    strategies = expand_grid(
+        SimulationParams(),
+        update_strategy=[UPDATE_STRATEGY_QUBO, UPDATE_STRATEGY_FIXED, UPDATE_STRATEGY_RANDOM],
+    )
+    runs = build_sweep(strategies, [Coefficient()], [MapGenerationParam()], seeds=range(5))
+    run_sweep(runs)
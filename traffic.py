@@ -1,6 +1,10 @@
 from __future__ import annotations
 from typing import TYPE_CHECKING
 from collections import Counter # キューの内容を集計するため
+from collections import deque
+from itertools import repeat
+import heapq
+import numpy as np
 
 # 型チェック時のみインポート（循環参照対策）
 if TYPE_CHECKING:
@@ -53,6 +57,112 @@ FLOW_TO = {
 """
 
 
+MODE_COUNT = len(MODE_FLOW)
+"""信号モードの種類の数"""
+
+TURNS = ("straight", "right", "left")
+"""進行方向の一覧. インデックスが進行方向コード(0:直進, 1:右折, 2:左折)に対応する"""
+
+TURN_CODE = {turn: code for code, turn in enumerate(TURNS)}
+"""進行方向の文字列から進行方向コードへの対応"""
+
+
+FLOWABLE_MODES = {
+    (direction, code): [mode - 1 for mode in MODE_FLOW if turn in MODE_FLOW[mode].get(direction, [])]
+    for direction in (1, 2, 3, 4)
+    for code, turn in enumerate(TURNS)
+}
+"""
+(進入方向, 進行方向コード)の車両が流出可能となるモードのインデックス(モードID-1)のリスト
+"""
+
+
+class TurnQueue:
+    """
+    1つの進入方向の待機キュー
+
+    進行方向ごとに到着順の通し番号を`deque`で保持する.
+    通し番号によりFIFO順が復元できるため, 進行方向ごとの台数は`len`で即座に得られ,
+    流出処理のコストは流出台数に比例する.
+
+    反復すると到着順に進行方向の文字列(`"straight"`など)を返すため,
+    従来の`list[str]`のキューと同様に`len`, `list`, `for`で扱える.
+    """
+    __slots__ = ("_lanes", "_next_seq", "_size")
+
+    def __init__(self, turns=()):
+        self._lanes: tuple[deque[int], ...] = tuple(deque() for _ in TURNS)
+        self._next_seq = 0
+        self._size = 0
+        for turn in turns:
+            self.append(turn)
+
+    def append(self, turn: str):
+        self.push(TURN_CODE[turn])
+
+    def push(self, code: int):
+        """進行方向コード`code`の車両を末尾に追加する"""
+        self._lanes[code].append(self._next_seq)
+        self._next_seq += 1
+        self._size += 1
+
+    def count(self, turn: str) -> int:
+        """進行方向`turn`の待機台数を返す"""
+        return len(self._lanes[TURN_CODE[turn]])
+
+    def counts(self) -> tuple[int, ...]:
+        """進行方向コード順の待機台数を返す"""
+        return tuple(map(len, self._lanes))
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        if not self._size:
+            return iter(())
+        lanes = [(lane, code) for code, lane in enumerate(self._lanes) if lane]
+        if len(lanes) == 1:
+            # 1方向のみ待機している場合は並べ替え不要
+            lane, code = lanes[0]
+            return repeat(TURNS[code], len(lane))
+        return (TURNS[code] for _, code in heapq.merge(*(zip(lane, repeat(code)) for lane, code in lanes)))
+
+    def __repr__(self):
+        return f"TurnQueue({list(self)!r})"
+
+    def release(self, allowed_codes: list[int], limit: int) -> dict[str, int]:
+        """
+        許可された進行方向コードの車両を先頭から最大`limit`台取り出す.
+        許可されない車両は順序を保ったまま待機する.
+
+        戻り値は{進行方向: 台数}で, キーは最初に流出した順に並ぶ.
+        """
+        lanes = [(self._lanes[code], code) for code in allowed_codes if self._lanes[code]]
+        if not lanes or limit <= 0:
+            return {}
+
+        # 先頭の到着順に並べておく (戻り値のキー順を従来実装と揃えるため)
+        lanes.sort(key=lambda item: item[0][0])
+
+        if sum(len(lane) for lane, _ in lanes) <= limit:
+            # すべて流出できる場合はまとめて空にする
+            result = {TURNS[code]: len(lane) for lane, code in lanes}
+            for lane, _ in lanes:
+                lane.clear()
+            self._size -= sum(result.values())
+            return result
+
+        result: dict[str, int] = {}
+        for _ in range(limit):
+            # 先頭の通し番号が最も小さい(最も早く到着した)車両を流す
+            lane, code = min(lanes, key=lambda item: item[0][0] if item[0] else self._next_seq)
+            lane.popleft()
+            turn = TURNS[code]
+            result[turn] = result.get(turn, 0) + 1
+        self._size -= limit
+        return result
+
+
 class EdgeTraffic:
     """
     有向エッジにおける交通状況（車両の位置）を管理するクラス
@@ -63,6 +173,12 @@ class EdgeTraffic:
         # 車両の位置リスト (エッジの始点からの距離 [m])
         self.vehicles: list[float] = []
 
+    def add_vehicle(self, position: float = 0.0):
+        """
+        エッジ上の`position`の位置に車両を追加する
+        """
+        self.vehicles.append(position)
+
 class NodeTraffic:
     """
     交差点（ノード）における交通状況（待機車両）を管理するクラス
@@ -70,15 +186,22 @@ class NodeTraffic:
     def __init__(self, flow_limit: int = 10000):
         # 各方位に対して進行希望のリスト（キューとして機能する）
         # 進入方向: 1:北, 2:南, 3:東, 4:西
-        self.queues: dict[int, list[str]] = {
-            1: [],  # 北からの進入待機キュー
-            2: [],  # 南からの進入待機キュー
-            3: [],  # 東からの進入待機キュー
-            4: [],  # 西からの進入待機キュー
+        self.queues: dict[int, TurnQueue] = {
+            1: TurnQueue(),  # 北からの進入待機キュー
+            2: TurnQueue(),  # 南からの進入待機キュー
+            3: TurnQueue(),  # 東からの進入待機キュー
+            4: TurnQueue(),  # 西からの進入待機キュー
         }
         # 1方位から単位時間あたりに流出できる車の最大台数
         self.flow_limit_value = flow_limit 
         self.mode: int = 1  # 現在の信号モード（1〜6）
+        # モードごとの流出可能台数 (論文中のC_ij. インデックスはモードID-1)
+        # `bind_flowable_matrix`によりマップ全体の行列の1行に差し替えられる
+        self.flowable: np.ndarray = np.zeros(MODE_COUNT, dtype=np.int64)
+        # Time Wastedの逐次集計 (`bind_waste_tally`で設定される)
+        self.waste_tally: WasteTally | None = None
+        # [進入方向-1][進行方向コード] -> 行先エッジの速度クラス
+        self._waste_classes: tuple[tuple[int, ...], ...] = ()
 
     def set_mode(self, mode: int):
         """信号モードを設定する"""
@@ -92,8 +215,13 @@ class NodeTraffic:
         - `direction` は親友方向であり, 1:北, 2:南, 3:東, 4:西
         - `turn` は希望進行方向であり, `"straight"`, `"right"`, `"left"`の文字列を受け入れる
         """
-        if direction in self.queues and turn in ["straight", "right", "left"]:
-            self.queues[direction].append(turn)
+        if direction in self.queues and turn in TURN_CODE:
+            code = TURN_CODE[turn]
+            self.queues[direction].push(code)
+            for mode_idx in FLOWABLE_MODES[(direction, code)]:
+                self.flowable[mode_idx] += 1
+            if self.waste_tally is not None:
+                self.waste_tally.class_counts[self._waste_classes[direction - 1][code]] += 1
 
     def flow_out(self, direction: int, allowed_turns: list[str]) -> dict[str, int]:
         """
@@ -101,24 +229,15 @@ class NodeTraffic:
 
         車の流し方はFIFO
         """
-        result: dict[str, int] = Counter()
-        limit = self.flow_limit_value
-        flowed = 0
-        new_queue: list[str] = []
-
-        # キューの先頭から処理
-        for turn in self.queues[direction]:
-            if flowed < limit and turn in allowed_turns:
-                # 許可されており、かつリミットに達していない場合
-                result[turn] += 1
-                flowed += 1
-            else:
-                # 許可されていない、またはリミット超過の場合は待機
-                new_queue.append(turn)
-
-        # キューを更新
-        self.queues[direction] = new_queue
-        return dict(result)
+        allowed_codes = [TURN_CODE[turn] for turn in allowed_turns if turn in TURN_CODE]
+        result = self.queues[direction].release(allowed_codes, self.flow_limit_value)
+        for turn, count in result.items():
+            code = TURN_CODE[turn]
+            for mode_idx in FLOWABLE_MODES[(direction, code)]:
+                self.flowable[mode_idx] -= count
+            if self.waste_tally is not None:
+                self.waste_tally.class_counts[self._waste_classes[direction - 1][code]] -= count
+        return result
 
     def flow_by_mode(self) -> dict[tuple[int, str], int]:
         """
@@ -138,4 +257,111 @@ class NodeTraffic:
                 for turn, count in out.items():
                     result[(direction, turn)] = count
                     
-        return result
\ No newline at end of file
+        return result
+
+
+def bind_flowable_matrix(node_traffics: dict[int, NodeTraffic], node_count: int) -> np.ndarray:
+    """
+    (ノード数 x `MODE_COUNT`)の流出可能台数行列を確保し, 各`NodeTraffic.flowable`をその行のビューに差し替える.
+
+    以降は`add_vehicle`, `flow_out`のたびに行列が更新され続ける.
+    """
+    matrix = np.zeros((node_count, MODE_COUNT), dtype=np.int64)
+    for node_id, node_traffic in node_traffics.items():
+        matrix[node_id] = node_traffic.flowable
+        node_traffic.flowable = matrix[node_id]
+    return matrix
+
+
+def flowable_matrix(node_traffics: dict[int, NodeTraffic], node_count: int) -> np.ndarray:
+    """
+    全ノードの流出可能台数を(ノード数 x `MODE_COUNT`)の配列で返す.
+
+    `bind_flowable_matrix`で束ねられていればその行列をそのまま返す(コピーしない).
+    そうでなければ各ノードの値を集めて新たに生成する(存在しないノードの行は0).
+    """
+    first = node_traffics.get(0)
+    last = node_traffics.get(node_count - 1)
+    if first is not None and last is not None:
+        base = first.flowable.base
+        if base is not None and base.shape == (node_count, MODE_COUNT) and last.flowable.base is base:
+            return base
+
+    matrix = np.zeros((node_count, MODE_COUNT), dtype=np.int64)
+    for node_id, node_traffic in node_traffics.items():
+        matrix[node_id] = node_traffic.flowable
+    return matrix
+
+
+class WasteTally:
+    """
+    待機車両のTime Wasted(行先エッジの制限速度 / マップ内最高速度で重みづけした台数)の逐次集計
+
+    行先エッジの制限速度の種類(速度クラス)ごとに待機台数を整数で保持し,
+    `NodeTraffic.add_vehicle`, `flow_out`のたびに増減させる. 
+    合計は速度クラス数の積和で得られるため, 待機車両数によらず定数時間で求まる. 
+
+    全車両を順に足し合わせる場合と加算順序が異なるため, 浮動小数点の丸め誤差程度の差は生じうる. 
+    """
+    def __init__(self, class_weights: list[float]):
+        self.class_weights = list(class_weights)
+        """速度クラスごとの重み (制限速度 / マップ内最高速度)"""
+        self.class_counts = [0] * len(self.class_weights)
+        """速度クラスごとの待機台数"""
+
+    def total(self) -> float:
+        """
+        全待機車両の重みの合計(1ステップあたりのTime Wasted)を返す
+        """
+        return sum(count * weight for count, weight in zip(self.class_counts, self.class_weights))
+
+    def node_traffic_waste(self, node_traffic: NodeTraffic) -> np.ndarray:
+        """
+        1ノードのTime Wastedを進入方向(1:北, 2:南, 3:東, 4:西)ごとに長さ4の配列で返す
+        """
+        weights = self.class_weights
+        return np.array([
+            sum(count * weights[cls] for count, cls in zip(node_traffic.queues[direction].counts(), classes))
+            for direction, classes in zip((1, 2, 3, 4), node_traffic._waste_classes)
+        ])
+
+    def breakdown(self, node_traffics: dict[int, NodeTraffic], node_count: int) -> np.ndarray:
+        """
+        全ノードのTime Wastedを(ノード数 x 4方向)の配列で返す. 行の和がノードごと, 全体の和が`total()`に対応する
+        """
+        result = np.zeros((node_count, 4))
+        for node_id, node_traffic in node_traffics.items():
+            result[node_id] = self.node_traffic_waste(node_traffic)
+        return result
+
+
+def bind_waste_tally(node_traffics: dict[int, NodeTraffic], mapinfo) -> WasteTally:
+    """
+    Time Wastedの逐次集計を生成し, 各`NodeTraffic`に行先エッジの速度クラスとともに設定する.
+
+    以降は`add_vehicle`, `flow_out`のたびに集計が更新される. 既に待機している車両も集計に含める.
+    """
+    speeds = mapinfo.edgeSpeedArray()
+    class_speeds, edge_class = np.unique(speeds, return_inverse=True)
+    tally = WasteTally((class_speeds / mapinfo.globalMaxSpeed()).tolist())
+    edge_class = edge_class.tolist()
+
+    for node_id, node_traffic in node_traffics.items():
+        node_traffic._waste_classes = tuple(
+            tuple(edge_class[mapinfo.nextEdgeIndex(node_id, direction, code)] for code in range(len(TURNS)))
+            for direction in (1, 2, 3, 4)
+        )
+        node_traffic.waste_tally = tally
+        for direction, classes in zip((1, 2, 3, 4), node_traffic._waste_classes):
+            for count, cls in zip(node_traffic.queues[direction].counts(), classes):
+                tally.class_counts[cls] += count
+    return tally
+
+
+def get_waste_tally(node_traffics: dict[int, NodeTraffic]) -> WasteTally | None:
+    """
+    `bind_waste_tally`で設定された集計を返す. 設定されていなければNoneを返す
+    """
+    for node_traffic in node_traffics.values():
+        return node_traffic.waste_tally
+    return None
@@ -0,0 +1,319 @@
+from __future__ import annotations
+from collections.abc import MutableSequence
+from typing import Dict, List, Tuple
+import heapq
+import math
+import numpy as np
+
+from traffic import EdgeTraffic
+
+
+class VehicleStore:
+    """
+    全有向エッジ上の車両をフラットなNumPy配列(struct-of-arrays)で保持するクラス
+
+    - `_pos`: 各車両のエッジ始点からの距離 [m]
+    - `_edge`: 各車両が所属する有向エッジのインデックス
+    - `_length`, `_speed`: 有向エッジごとの道路長・制限速度
+
+    エッジインデックスは`edge_keys`の並び(= `edge_traffics`の挿入順)に一致する.
+    配列内の並びは挿入順を保つため, エッジごとに安定ソートすると
+    リスト実装(`EdgeTraffic.vehicles`)と同じ順序が得られる.
+    """
+    def __init__(self, edge_keys: List[Tuple[int, int]], edge_length: np.ndarray, edge_speed: np.ndarray):
+        self.edge_keys = list(edge_keys)
+        self.edge_index: Dict[Tuple[int, int], int] = {key: i for i, key in enumerate(self.edge_keys)}
+        self._length = np.asarray(edge_length, dtype=float)
+        self._speed = np.asarray(edge_speed, dtype=float)
+
+        self._pos = np.empty(0, dtype=float)
+        self._edge = np.empty(0, dtype=np.int64)
+
+        # 追加待ちの車両 (次回の配列アクセス時にまとめて連結する)
+        self._pending_pos: list[float] = []
+        self._pending_edge: list[int] = []
+
+        # エッジごとの位置リストのキャッシュ (状態変化で破棄)
+        self._groups: list[tuple[float, ...]] | None = None
+
+    def __len__(self):
+        return len(self._pos) + len(self._pending_pos)
+
+    def edge_count(self) -> int:
+        return len(self.edge_keys)
+
+    def add(self, edge_idx: int, position: float = 0.0):
+        """
+        `edge_idx`の有向エッジに車両を追加する
+        """
+        self._pending_pos.append(position)
+        self._pending_edge.append(edge_idx)
+        self._groups = None
+
+    def add_many(self, edge_indices: np.ndarray, positions: np.ndarray):
+        """
+        `edge_indices[k]`の有向エッジの`positions[k]`の位置に車両をまとめて追加する
+        """
+        self._flush()
+        self._pos = np.concatenate((self._pos, np.asarray(positions, dtype=float)))
+        self._edge = np.concatenate((self._edge, np.asarray(edge_indices, dtype=np.int64)))
+        self._groups = None
+
+    def _flush(self):
+        if not self._pending_pos:
+            return
+        self._pos = np.concatenate((self._pos, np.asarray(self._pending_pos, dtype=float)))
+        self._edge = np.concatenate((self._edge, np.asarray(self._pending_edge, dtype=np.int64)))
+        self._pending_pos.clear()
+        self._pending_edge.clear()
+
+    def advance(self, dt: float = 1.0) -> np.ndarray:
+        """
+        全車両を各エッジの制限速度で`dt`だけ進め, 終端に到達した車両を取り除く.
+
+        戻り値は到達車両の有向エッジインデックスの配列で,
+        エッジインデックス順, 同一エッジ内では挿入順に並ぶ.
+        """
+        self._flush()
+        self._groups = None
+
+        self._pos = self._pos + self._speed[self._edge] * dt
+        arrived = self._pos >= self._length[self._edge]
+        if not arrived.any():
+            return np.empty(0, dtype=np.int64)
+
+        arrived_edges = self._edge[arrived]
+        arrived_edges = arrived_edges[np.argsort(arrived_edges, kind="stable")]
+
+        keep = ~arrived
+        self._pos = self._pos[keep]
+        self._edge = self._edge[keep]
+        return arrived_edges
+
+    def _build_groups(self) -> list[tuple[float, ...]]:
+        self._flush()
+        order = np.argsort(self._edge, kind="stable")
+        sorted_pos = self._pos[order].tolist()
+        bounds = np.concatenate(([0], np.cumsum(np.bincount(self._edge, minlength=self.edge_count())))).tolist()
+        return [tuple(sorted_pos[bounds[i]:bounds[i + 1]]) for i in range(self.edge_count())]
+
+    def positions(self, edge_idx: int) -> tuple[float, ...]:
+        """
+        `edge_idx`の有向エッジ上の車両位置を挿入順のタプルで返す (エッジごとにキャッシュを共有するため変更できない型とする)
+        """
+        if self._groups is None:
+            self._groups = self._build_groups()
+        return self._groups[edge_idx]
+
+    def set_positions(self, edge_idx: int, positions: list[float]):
+        """
+        `edge_idx`の有向エッジ上の車両を`positions`で置き換える
+        """
+        self._flush()
+        keep = self._edge != edge_idx
+        self._pos = np.concatenate((self._pos[keep], np.asarray(positions, dtype=float)))
+        self._edge = np.concatenate((self._edge[keep], np.full(len(positions), edge_idx, dtype=np.int64)))
+        self._groups = None
+
+
+class EventVehicleStore:
+    """
+    到着イベントの優先度付きキューで車両を管理する離散イベント型のストア
+
+    車両はエッジ上を制限速度で等速に進むため, エッジに入った時点で終端への到着ステップが確定する.
+    `advance`ではそのステップに到着する車両だけを取り出し, 他の車両には触れない.
+    位置は`positions`で参照されたときにのみ計算する.
+
+    位置は固定刻み`dt`の逐次加算(`VehicleStore`やリスト実装と同じ浮動小数点演算)で
+    あらかじめ求めた軌跡から引くため, 到着ステップ・位置ともに刻み実行と完全に一致する.
+    `VehicleStore`と同じインターフェースを持ち, `ArrayEdgeTraffic`のストアとして使える.
+    """
+    def __init__(self, edge_keys: List[Tuple[int, int]], edge_length: np.ndarray, edge_speed: np.ndarray, dt: float = 1.0):
+        self.edge_keys = list(edge_keys)
+        self.edge_index: Dict[Tuple[int, int], int] = {key: i for i, key in enumerate(self.edge_keys)}
+        self._length = np.asarray(edge_length, dtype=float)
+        self._speed = np.asarray(edge_speed, dtype=float)
+        if (self._speed * dt <= 0).any():
+            raise ValueError("EventVehicleStore requires positive speed_limit * dt on every edge")
+        self._dt = dt
+
+        # 刻み実行で進んだステップ数
+        self._step = 0
+        self._next_seq = 0
+
+        # 位置0から進入した車両の軌跡 (エッジごとに共有する)
+        self._edge_trajectory = [
+            self._trajectory(0.0, edge_idx) for edge_idx in range(len(self.edge_keys))
+        ]
+
+        # エッジごとの走行中車両 {通し番号: (進入ステップ, 軌跡)} (挿入順 = リスト実装の並び)
+        self._on_edge: list[dict[int, tuple[int, list[float]]]] = [{} for _ in self.edge_keys]
+        # 到着イベント (到着ステップ, エッジインデックス, 通し番号)
+        self._events: list[tuple[int, int, int]] = []
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def edge_count(self) -> int:
+        return len(self.edge_keys)
+
+    def _trajectory(self, position: float, edge_idx: int) -> list[float]:
+        """
+        `position`から逐次加算で進めたときの位置列を, 終端到達まで(到達時の位置を含む)返す
+        """
+        length = self._length[edge_idx]
+        move_distance = self._speed[edge_idx] * self._dt
+        steps = max(1, math.ceil((length - position) / move_distance) + 1)
+        while True:
+            trajectory = np.add.accumulate(np.concatenate(([position], np.full(steps, move_distance))))
+            reached = np.flatnonzero(trajectory[1:] >= length)
+            if len(reached):
+                return trajectory[:reached[0] + 2].tolist()
+            steps *= 2
+
+    def add(self, edge_idx: int, position: float = 0.0):
+        """
+        `edge_idx`の有向エッジに車両を追加し, 到着イベントを登録する
+        """
+        trajectory = self._edge_trajectory[edge_idx] if position == 0.0 else self._trajectory(position, edge_idx)
+        seq = self._next_seq
+        self._next_seq += 1
+        self._on_edge[edge_idx][seq] = (self._step, trajectory)
+        heapq.heappush(self._events, (self._step + len(trajectory) - 1, edge_idx, seq))
+        self._count += 1
+
+    def advance(self, dt: float = 1.0) -> np.ndarray:
+        """
+        1ステップ進め, このステップで終端に到達した車両を取り除く.
+
+        戻り値は到達車両の有向エッジインデックスの配列で,
+        エッジインデックス順, 同一エッジ内では挿入順に並ぶ.
+        """
+        if dt != self._dt:
+            raise ValueError(f"EventVehicleStore was built for dt={self._dt}, got dt={dt}")
+        self._step += 1
+
+        arrived: list[int] = []
+        events = self._events
+        while events and events[0][0] <= self._step:
+            _, edge_idx, seq = heapq.heappop(events)
+            # set_positionsで取り除かれた車両のイベントは無視する
+            if self._on_edge[edge_idx].pop(seq, None) is not None:
+                arrived.append(edge_idx)
+        self._count -= len(arrived)
+        return np.array(arrived, dtype=np.int64)
+
+    def positions(self, edge_idx: int) -> tuple[float, ...]:
+        """
+        `edge_idx`の有向エッジ上の車両位置を挿入順のタプルで返す
+        """
+        step = self._step
+        return tuple(trajectory[step - entry] for entry, trajectory in self._on_edge[edge_idx].values())
+
+    def set_positions(self, edge_idx: int, positions: list[float]):
+        """
+        `edge_idx`の有向エッジ上の車両を`positions`で置き換える
+        """
+        self._count -= len(self._on_edge[edge_idx])
+        self._on_edge[edge_idx] = {}
+        for position in positions:
+            self.add(edge_idx, position)
+
+
+class VehicleList(MutableSequence):
+    """
+    ストア上の1本の有向エッジの車両位置を, リスト実装(`EdgeTraffic.vehicles`)と同じく`list`として扱うビュー
+
+    読み出しは毎回ストアの現在の内容(`positions`)を参照し, 書き換えはそのままストアへ反映する.
+    `append`は`add`を, それ以外の書き換えはエッジの全車両の置き換え(`set_positions`)を用いる.
+    """
+    __slots__ = ("store", "edge_idx")
+
+    def __init__(self, store: VehicleStore | EventVehicleStore, edge_idx: int):
+        self.store = store
+        self.edge_idx = edge_idx
+
+    def _replace(self, edit):
+        positions = list(self.store.positions(self.edge_idx))
+        edit(positions)
+        self.store.set_positions(self.edge_idx, positions)
+
+    def __len__(self):
+        return len(self.store.positions(self.edge_idx))
+
+    def __getitem__(self, index):
+        positions = self.store.positions(self.edge_idx)
+        return list(positions[index]) if isinstance(index, slice) else positions[index]
+
+    def __iter__(self):
+        return iter(self.store.positions(self.edge_idx))
+
+    def __reversed__(self):
+        return reversed(self.store.positions(self.edge_idx))
+
+    def __contains__(self, position):
+        return position in self.store.positions(self.edge_idx)
+
+    def __setitem__(self, index, value):
+        def edit(positions):
+            positions[index] = value
+        self._replace(edit)
+
+    def __delitem__(self, index):
+        def edit(positions):
+            del positions[index]
+        self._replace(edit)
+
+    def insert(self, index: int, position: float):
+        self._replace(lambda positions: positions.insert(index, position))
+
+    def append(self, position: float):
+        self.store.add(self.edge_idx, position)
+
+    def clear(self):
+        self.store.set_positions(self.edge_idx, [])
+
+    def __eq__(self, other):
+        if isinstance(other, (VehicleList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+class ArrayEdgeTraffic(EdgeTraffic):
+    """
+    `VehicleStore`(または`EventVehicleStore`)上の1本の有向エッジを`EdgeTraffic`として見せるビュー
+
+    `vehicles`はストアに書き込む`VehicleList`を返すため, リスト実装と同じく`append`などで書き換えられる.
+    """
+    def __init__(self, start_id: int, end_id: int, store: VehicleStore | EventVehicleStore, edge_idx: int):
+        self.start_id = start_id
+        self.end_id = end_id
+        self.store = store
+        self.edge_idx = edge_idx
+        # 状態を持たないビューのため, エッジごとに1つを使い回す
+        self._vehicles = VehicleList(store, edge_idx)
+
+    @property
+    def vehicles(self) -> VehicleList:
+        return self._vehicles
+
+    @vehicles.setter
+    def vehicles(self, positions: list[float]):
+        self.store.set_positions(self.edge_idx, positions)
+
+    def add_vehicle(self, position: float = 0.0):
+        self.store.add(self.edge_idx, position)
+
+
+def get_vehicle_store(edge_traffics: Dict) -> VehicleStore | EventVehicleStore | None:
+    """
+    `edge_traffics`が`VehicleStore`のビューで構成されていればそのストアを返す.
+    リスト実装の場合は`None`を返す.
+    """
+    for traffic in edge_traffics.values():
+        return getattr(traffic, "store", None)
+    return None
@@ -1,22 +1,21 @@
-import matplotlib.pyplot as plt
 import os
 import io
-from typing import List, Dict, Tuple, Any
-from collections import Counter
-from PIL import Image
+import struct
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from itertools import islice
+from typing import List, Dict, Tuple, Any, Iterable, Callable
+from collections import Counter, deque
+from PIL import Image, GifImagePlugin
 import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.collections import LineCollection, PolyCollection
+from matplotlib.patches import FancyArrow
 from traffic import FLOW_TO, MODE_FLOW
 from collections import Counter
 
-# --- ここでインポート ---
-try:
-    from IPython.display import display, Image as IPImage
-    from IPython import get_ipython
-    HAS_IPYTHON = True
-except ImportError:
-    HAS_IPYTHON = False
-# ----------------------
-
 
 
 # グラフ情報・交通情報のインポート（構造のみ必要）
@@ -42,167 +41,355 @@ DISPLAY_DIRECTION_VECTORS = {
     4: (-1, 0)
 }
 
-class TrafficVisualizer:
-    def __init__(self, fps: int = 10):
-        self.frames = []
-        self.fps = fps
-        # self.fig は create_animation 内で毎回生成・破棄
-    def _get_node_coords(self, node_id: int, mapinfo: MapInfo) -> tuple[float, float]:
-        """
-        ノードIDから(x, y)座標を計算する。
-        左上(0,0)から右へ進み、端に到達したら下の行へ移動する仕様に対応。
-        """
-        x = node_id % mapinfo.width()
-        y = node_id // mapinfo.width()
-        return float(x), float(y)
-    
-    def _generate_frame(self, step_data: Dict[str, Any], mapinfo: MapInfo) -> Image.Image:
-        """
-        1ステップのデータから画像を生成して返す。
-        """
-        # Figureの設定
-        fig = plt.figure(figsize=(8, 8))
-        ax = fig.gca()
+QUEUE_TEXT_FORMATS = {
+    # 進入方向: (テキストの並び, テキスト位置のずれ)
+    1: ("{r}|{s}|{l}", (0, -QUEUE_TEXT_DISTANCE_NS)),   # 北 (基準点から北へ)
+    2: ("{l}|{s}|{r}", (0, +QUEUE_TEXT_DISTANCE_NS)),   # 南 (基準点から南へ)
+    3: ("{r}\n{s}\n{l}", (+QUEUE_TEXT_DISTANCE_EW, 0)),  # 東 (基準点から東へ)
+    4: ("{l}\n{s}\n{r}", (-QUEUE_TEXT_DISTANCE_EW, 0)),  # 西 (基準点から西へ)
+}
+"""待機台数テキストの進入方向ごとの書式と配置"""
 
+
+class FrameRenderer:
+    """
+    1つのマップについてFigureを使い回してフレームを描画するクラス
+
+    道路とノードは構築時に一度だけ描画し, 背景として保存する.
+    各フレームでは車両の散布図, モード表示の線・矢印, 待機台数テキスト, タイトルのみを更新し,
+    背景の上に描き直してキャンバスのバッファを直接画像にする.
+    """
+    def __init__(self, mapinfo: MapInfo, figsize: Tuple[float, float] = (8, 8), dpi: int = 100):
+        self.mapinfo = mapinfo
         W, H = mapinfo.width(), mapinfo.height()
+        node_count = W * H
+
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.fig.subplots_adjust(left=0.02, right=0.98, bottom=0.02, top=0.94)
+        ax = self.ax = self.fig.add_subplot()
         ax.set_xlim(-0.5, W - 0.5)
         ax.set_ylim(-0.5, H - 0.5)
         ax.set_aspect('equal')
         ax.invert_yaxis()
         ax.axis('off')
 
-        # 1. edge(lightgray)と車両の描画
-        edges_log = step_data.get("edges", {})
-        for edge_id_str, vehicle_positions in edges_log.items():
-            sid, eid = map(int, edge_id_str.split('_'))
+        self._coords = np.array([self._node_coords(i) for i in range(node_count)])
+
+        # --- 静的な描画: 道路(lightgray)とノード点 ---
+        # 有向エッジごとの(始点座標, 終点座標, 方向ベクトル, 道路長)
+        self._edge_geometry: Dict[str, Tuple[float, float, float, float, int, int, float]] = {}
+        segments = []
+        for sid, eid in mapinfo.directedEdgeKeys():
             s_node = mapinfo.getNode(sid)
-            e_node = mapinfo.getNode(eid)
-            edge = mapinfo.getEdgeBetween(sid, eid)
-            
-            xs, ys = self._get_node_coords(sid, mapinfo)
-            xe, ye = self._get_node_coords(eid, mapinfo)
-            
-            # 以下デバッグ用テキスト
-            # print(f"{s_node.getId()}: E{s_node.east_id()} W{s_node.west_id()} N{s_node.north_id()} S{s_node.south_id()}")
-            
-            
             # 方角ベクトルの決定 (sidから見たeidの方向)
             if eid == s_node.north_id():   dx, dy = 0, -1
             elif eid == s_node.south_id(): dx, dy = 0, 1
             elif eid == s_node.east_id():  dx, dy = 1, 0
             elif eid == s_node.west_id():  dx, dy = -1, 0
             else: continue
+            xs, ys = self._coords[sid]
+            xe, ye = self._coords[eid]
+            edge = mapinfo.getEdgeBetween(sid, eid)
+            self._edge_geometry[f"{sid}_{eid}"] = (xs, ys, xe, ye, dx, dy, edge.length)
+            # 2分割でワープに対応
+            segments.append([(xs, ys), (xs + dx * 0.5, ys + dy * 0.5)])
+            segments.append([(xe, ye), (xe - dx * 0.5, ye - dy * 0.5)])
+        ax.add_collection(LineCollection(segments, colors='lightgray', linewidths=1, zorder=1))
+        ax.scatter(self._coords[:, 0], self._coords[:, 1], s=8 ** 2, c='k', zorder=3)
 
-            # エッジの線を描画 (2分割でワープに対応)
-            # sidから0.5まで
-            ax.plot([xs, xs + dx * 0.5], [ys, ys + dy * 0.5], color='lightgray', lw=1, zorder=1)
-            # eidから-0.5まで (逆算)
-            ax.plot([xe, xe - dx * 0.5], [ye, ye - dy * 0.5], color='lightgray', lw=1, zorder=1)
-
-            # 車両のプロット
-            # 進行度合いrで分岐する.
-            for pos in vehicle_positions:
-                r = pos / edge.length
-                if r <= 0.5:
-                    # sidから進む
-                    dvx, dvy = xs + dx * r, ys + dy * r
-                else:
-                    # eidから戻る
-                    dvx, dvy = xe - dx * (1 - r), ye - dy * (1 - r)
-                
-                # トーラス補正をかけて描画
-                ax.plot(dvx, dvy, 'ro', markersize=4, zorder=10)
-        nodes_log = step_data["nodes"]
-
-        # 1. ノードとモードの描画
-        for node_id_key, data in nodes_log.items():
+        # --- 動的な描画対象 ---
+        self._mode_lines = LineCollection([], colors='blue', linewidths=2, alpha=0.7, zorder=2)
+        self._mode_arrows = PolyCollection([], facecolors='blue', edgecolors='blue', zorder=4)
+        self._vehicles = ax.scatter([], [], s=4 ** 2, c='r', zorder=10)
+        ax.add_collection(self._mode_lines)
+        ax.add_collection(self._mode_arrows)
+        self._queue_texts: Dict[Tuple[int, int], Any] = {}
+        self._title = ax.set_title("", fontsize=12)
+
+        # モードごとの進入元の線分と進行先の矢印 (ノード座標からの相対座標)
+        arrow_templates = {
+            code: FancyArrow(0, 0, vec[0] * ARROW_LENGTH_MODE_TO, vec[1] * ARROW_LENGTH_MODE_TO,
+                             head_width=0.1, head_length=0.12, length_includes_head=True).get_xy()
+            for code, vec in DISPLAY_DIRECTION_VECTORS.items()
+        }
+        self._mode_shapes: Dict[int, Tuple[List[np.ndarray], List[np.ndarray]]] = {}
+        for mode, allowed_entries in MODE_FLOW.items():
+            lines, arrows = [], []
+            for entry_dir, turns in allowed_entries.items():
+                from_vec = DISPLAY_DIRECTION_VECTORS[entry_dir]
+                lines.append(np.array([(0, 0), (from_vec[0] * ARROW_LENGTH_MODE_FROM, from_vec[1] * ARROW_LENGTH_MODE_FROM)]))
+                for turn in turns:
+                    to_dir_code = FLOW_TO.get((entry_dir, turn))
+                    if to_dir_code:
+                        arrows.append(arrow_templates[to_dir_code])
+            self._mode_shapes[mode] = (lines, arrows)
+
+        # 動的な描画対象を隠した状態で背景を保存する
+        self._dynamic = [self._mode_lines, self._mode_arrows, self._vehicles, self._title]
+        for artist in self._dynamic:
+            artist.set_visible(False)
+        self.canvas.draw()
+        self._background = self.canvas.copy_from_bbox(self.fig.bbox)
+        for artist in self._dynamic:
+            artist.set_visible(True)
+
+    def _node_coords(self, node_id: int) -> Tuple[float, float]:
+        return float(node_id % self.mapinfo.width()), float(node_id // self.mapinfo.width())
+
+    def _queue_text(self, node_id: int, entry_dir: int):
+        key = (node_id, entry_dir)
+        text = self._queue_texts.get(key)
+        if text is None:
+            x, y = self._coords[node_id]
+            offset = QUEUE_TEXT_FORMATS[entry_dir][1]
+            text = self.ax.text(x + offset[0], y + offset[1], "",
+                                color='darkgreen', fontsize=8,
+                                ha='center', va='center',
+                                fontweight='bold',
+                                # 背景を白くして読みやすくする（任意）
+                                bbox=dict(facecolor='white', alpha=0.6, edgecolor='none', pad=1))
+            self._queue_texts[key] = text
+        return text
+
+    def render(self, step_data: Dict[str, Any]) -> Image.Image:
+        """
+        1ステップのデータから画像を生成して返す
+        """
+        # 1. 車両 (進行度合いrで分岐する)
+        points = []
+        for edge_id_str, vehicle_positions in step_data.get("edges", {}).items():
+            if not vehicle_positions:
+                continue
+            geometry = self._edge_geometry.get(edge_id_str)
+            if geometry is None:
+                continue
+            xs, ys, xe, ye, dx, dy, length = geometry
+            r = np.asarray(vehicle_positions, dtype=float) / length
+            # sidから進む / eidから戻る
+            first = r <= 0.5
+            px = np.where(first, xs + dx * r, xe - dx * (1 - r))
+            py = np.where(first, ys + dy * r, ye - dy * (1 - r))
+            points.append(np.column_stack((px, py)))
+        self._vehicles.set_offsets(np.concatenate(points) if points else np.empty((0, 2)))
+
+        # 2. モードと待機台数
+        lines, arrows, texts = [], [], []
+        for node_id_key, data in step_data["nodes"].items():
             # JSON化の過程でキーが文字列になっている可能性があるためint変換
             node_id = int(node_id_key)
-            x, y = self._get_node_coords(node_id, mapinfo)
-
-            # ノード点 (交差点)
-            ax.plot(x, y, 'ko', markersize=8, zorder=3)
-
-            # モード番号の表示 (ノードのすぐ右上に小さく表示)
-            mode = data.get("mode", "?")
-            if mode in MODE_FLOW:
-                allowed_entries = MODE_FLOW[mode] # 例: {1: ["straight", "right"]}
-                
-                for entry_dir, turns in allowed_entries.items():
-                    # --- A. 進入元の表示 (矢印なし灰色直線) ---
-                    # DISPLAY_DIRECTION_VECTORSを使って進入元(方角)のベクトルを取得
-                    from_vec = DISPLAY_DIRECTION_VECTORS[entry_dir]
-                    # 交差点から「進入元方位」へ伸びる線（車はここからやってくる）
-                    ax.plot([x, x + from_vec[0] * ARROW_LENGTH_MODE_FROM],
-                            [y, y + from_vec[1] * ARROW_LENGTH_MODE_FROM],
-                            color='blue', linewidth=2, alpha=0.7, zorder=2)
-
-                    # --- B. 進行先の表示 (矢印あり青色直線) ---
-                    for turn in turns:
-                        # FLOW_TOから進行先の方位コードを取得
-                        to_dir_code = FLOW_TO.get((entry_dir, turn))
-                        if to_dir_code:
-                            to_vec = DISPLAY_DIRECTION_VECTORS[to_dir_code]
-                            # 交差点から「進行先方位」へ向かう矢印
-                            ax.arrow(x, y, 
-                                     to_vec[0] * ARROW_LENGTH_MODE_TO, 
-                                     to_vec[1] * ARROW_LENGTH_MODE_TO,
-                                     head_width=0.1, head_length=0.12, 
-                                     fc='blue', ec='blue', zorder=4,
-                                     length_includes_head=True)
-                            
-            
-            queues = data.get("queues", {})
-            for entry_dir_str, turn_list in queues.items():
+            origin = self._coords[node_id]
+
+            shapes = self._mode_shapes.get(data.get("mode"))
+            if shapes is not None:
+                lines.extend(line + origin for line in shapes[0])
+                arrows.extend(arrow + origin for arrow in shapes[1])
+
+            for entry_dir_str, turn_list in data.get("queues", {}).items():
                 if not turn_list:
                     continue
-                
                 entry_dir = int(entry_dir_str)
-                counts = Counter(turn_list)
-                
-                # 各方向のカウント（存在しない場合は0）
-                l_cnt = counts.get("left", 0)
-                s_cnt = counts.get("straight", 0)
-                r_cnt = counts.get("right", 0)
-
-                # 方位に応じたフォーマットと配置
-                if entry_dir == 1: # 北 (基準点から北へ)
-                    q_text = f"{r_cnt}|{s_cnt}|{l_cnt}"
-                    tx, ty = x, y - QUEUE_TEXT_DISTANCE_NS
-                elif entry_dir == 2: # 南 (基準点から南へ)
-                    q_text = f"{l_cnt}|{s_cnt}|{r_cnt}"
-                    tx, ty = x, y + QUEUE_TEXT_DISTANCE_NS
-                elif entry_dir == 3: # 東 (基準点から東へ)
-                    q_text = f"{r_cnt}\n{s_cnt}\n{l_cnt}"
-                    tx, ty = x + QUEUE_TEXT_DISTANCE_EW, y
-                elif entry_dir == 4: # 西 (基準点から西へ)
-                    q_text = f"{l_cnt}\n{s_cnt}\n{r_cnt}"
-                    tx, ty = x - QUEUE_TEXT_DISTANCE_EW, y
-                else:
+                if entry_dir not in QUEUE_TEXT_FORMATS:
                     continue
+                counts = Counter(turn_list)
+                text = self._queue_text(node_id, entry_dir)
+                text.set_text(QUEUE_TEXT_FORMATS[entry_dir][0].format(
+                    l=counts.get("left", 0), s=counts.get("straight", 0), r=counts.get("right", 0)))
+                texts.append(text)
+        self._mode_lines.set_segments(lines)
+        self._mode_arrows.set_verts(arrows)
 
-                # テキストの描画
-                ax.text(tx, ty, q_text, 
-                        color='darkgreen', fontsize=8, 
-                        ha='center', va='center', 
-                        fontweight='bold',
-                        # 背景を白くして読みやすくする（任意）
-                        bbox=dict(facecolor='white', alpha=0.6, edgecolor='none', pad=1))
+        # 3. ステップ情報の表示
+        self._title.set_text(f"Time: {step_data['time']} (Waste: {step_data['timewasted']: .03f})")
 
-        # 2. ステップ情報の表示
-        ax.set_title(f"Time: {step_data['time']} (Waste: {step_data['timewasted']: .03f})", fontsize=12)
+        # 背景の上に動的な描画対象のみをzorder順に描く
+        self.canvas.restore_region(self._background)
+        for artist in sorted(self._dynamic + texts, key=lambda a: a.get_zorder()):
+            self.fig.draw_artist(artist)
 
-        # MatplotlibのFigureをPIL Imageに変換
-        buf = io.BytesIO()
-        fig.savefig(buf, format='png', bbox_inches='tight', dpi=100)
-        buf.seek(0)
-        img = Image.open(buf)
-        
-        plt.close(fig) # メモリ解放
-        return img
+        buf = np.asarray(self.canvas.buffer_rgba())
+        return Image.fromarray(buf.copy(), mode="RGBA")
+
+
+@dataclass
+class EncodedFrame:
+    """
+    ストリーミング書き出し用にエンコード済みの1フレーム
+    """
+    size: Tuple[int, int]
+    data: bytes
+    """GIF: 画像記述子以降のブロック列, PNG: zlib圧縮済みの画像データ(IDATの中身)"""
+    header: bytes = b""
+    """PNG: IHDRチャンクの中身 (GIFでは未使用)"""
+
+
+def encode_gif_frame(image: Image.Image, duration: int) -> EncodedFrame:
+    """
+    画像を減色してGIFの1フレーム(ローカルカラーテーブル付き)にエンコードする
+    """
+    frame = image.convert("RGB").quantize(256, method=Image.Quantize.FASTOCTREE)
+    data = GifImagePlugin.getdata(frame, duration=duration, include_color_table=True)
+    return EncodedFrame(frame.size, b"".join(data))
+
+
+def _png_chunks(png: bytes):
+    pos = 8
+    while pos < len(png):
+        length, kind = struct.unpack(">I4s", png[pos:pos + 8])
+        yield kind, png[pos + 8:pos + 8 + length]
+        pos += length + 12
+
+
+def encode_png_frame(image: Image.Image, duration: int) -> EncodedFrame:
+    """
+    画像をPNGとしてエンコードし, APNGの1フレーム分のIHDRと画像データを取り出す
+    """
+    buf = io.BytesIO()
+    image.convert("RGB").save(buf, format="PNG")
+    header, data = b"", []
+    for kind, body in _png_chunks(buf.getvalue()):
+        if kind == b"IHDR":
+            header = body
+        elif kind == b"IDAT":
+            data.append(body)
+    return EncodedFrame(image.size, b"".join(data), header)
+
+
+class GifStreamWriter:
+    """
+    エンコード済みのフレームを受け取った順にGIFファイルへ追記するクラス
+
+    PillowのGIF保存(`save_all`)は全フレームを保持してから書き出すため, 
+    こちらは各フレームにローカルカラーテーブルを持たせてヘッダ・フレーム・終端を逐次書き込む. 
+    """
+    def __init__(self, output_path: str, duration: int, frame_count: int | None = None, loop: int = 0):
+        self.output_path = output_path
+        self.duration = duration
+        self.loop = loop
+        self._fp = None
+
+    def write(self, frame: EncodedFrame):
+        if self._fp is None:
+            self._fp = open(self.output_path, "wb")
+            width, height = frame.size
+            # 論理画面記述子 (グローバルカラーテーブルなし) とループ回数の拡張ブロック
+            self._fp.write(b"GIF89a" + struct.pack("<HHBBB", width, height, 0, 0, 0))
+            self._fp.write(b"!\xff\x0bNETSCAPE2.0\x03\x01" + struct.pack("<H", self.loop) + b"\x00")
+        self._fp.write(frame.data)
+
+    def close(self):
+        if self._fp is not None:
+            self._fp.write(b";")
+            self._fp.close()
+            self._fp = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+class ApngStreamWriter(GifStreamWriter):
+    """
+    エンコード済みのフレームを受け取った順にAPNG(アニメーションPNG)ファイルへ追記するクラス
+
+    acTLチャンクの総フレーム数は, 書き込んだフレーム数で`close`時に書き換える. 
+    そのため総フレーム数が事前に分からない履歴(イテレータ)も書き出せる. 
+    """
+    def __init__(self, output_path: str, duration: int, frame_count: int | None = None, loop: int = 0):
+        super().__init__(output_path, duration, frame_count, loop)
+        self._sequence = 0
+        self._written = 0
+        self._actl_offset = 0
+
+    def _chunk(self, kind: bytes, body: bytes):
+        self._fp.write(struct.pack(">I", len(body)) + kind + body + struct.pack(">I", zlib.crc32(kind + body)))
+
+    def write(self, frame: EncodedFrame):
+        if self._fp is None:
+            self._fp = open(self.output_path, "wb")
+            self._fp.write(b"\x89PNG\r\n\x1a\n")
+            self._chunk(b"IHDR", frame.header)
+            # フレーム数は仮に0を書き, closeで書き換える
+            self._actl_offset = self._fp.tell()
+            self._chunk(b"acTL", struct.pack(">II", 0, self.loop))
+        width, height = frame.size
+        self._chunk(b"fcTL", struct.pack(">IIIIIHHBB", self._sequence, width, height, 0, 0, self.duration, 1000, 0, 0))
+        self._sequence += 1
+        if self._written == 0:
+            # 1フレーム目は既定画像としてIDATに格納する
+            self._chunk(b"IDAT", frame.data)
+        else:
+            self._chunk(b"fdAT", struct.pack(">I", self._sequence) + frame.data)
+            self._sequence += 1
+        self._written += 1
+
+    def close(self):
+        if self._fp is not None:
+            self._chunk(b"IEND", b"")
+            self._fp.seek(self._actl_offset)
+            self._chunk(b"acTL", struct.pack(">II", self._written, self.loop))
+            self._fp.close()
+            self._fp = None
+
+
+STREAM_FORMATS: Dict[str, Tuple[Callable[[Image.Image, int], EncodedFrame], type]] = {
+    ".gif": (encode_gif_frame, GifStreamWriter),
+    ".png": (encode_png_frame, ApngStreamWriter),
+    ".apng": (encode_png_frame, ApngStreamWriter),
+}
+"""出力ファイルの拡張子ごとの(フレームのエンコード関数, 書き出しクラス)"""
+
+
+_worker_renderer: FrameRenderer | None = None
+"""描画ワーカープロセス内で使い回す描画器"""
+
+
+def _init_render_worker(mapinfo: MapInfo):
+    global _worker_renderer
+    _worker_renderer = FrameRenderer(mapinfo)
+
+
+def _render_chunk(steps: List[Dict[str, Any]], suffix: str, duration: int) -> List[EncodedFrame]:
+    """
+    ワーカープロセスで連続する数ステップを描画し, エンコード済みのフレームを返す
+    """
+    encode = STREAM_FORMATS[suffix][0]
+    return [encode(_worker_renderer.render(step_data), duration) for step_data in steps]
+
+
+class TrafficVisualizer:
+    def __init__(self, fps: int = 10):
+        self.frames = []
+        self.fps = fps
+        # マップごとに使い回す描画器 (_generate_frame 初回に生成)
+        self._renderer: FrameRenderer | None = None
+    def _get_node_coords(self, node_id: int, mapinfo: MapInfo) -> tuple[float, float]:
+        """
+        ノードIDから(x, y)座標を計算する。
+        左上(0,0)から右へ進み、端に到達したら下の行へ移動する仕様に対応。
+        """
+        x = node_id % mapinfo.width()
+        y = node_id // mapinfo.width()
+        return float(x), float(y)
+    
+    def _generate_frame(self, step_data: Dict[str, Any], mapinfo: MapInfo) -> Image.Image:
+        """
+        1ステップのデータから画像を生成して返す。
+
+        静的なマップの描画はマップごとに一度だけ行い, 以降のフレームで使い回す. 
+        """
+        if self._renderer is None or self._renderer.mapinfo is not mapinfo:
+            self._renderer = FrameRenderer(mapinfo)
+        return self._renderer.render(step_data)
     
     def create_animation(self, history: List[Dict[str, Any]], mapinfo: Any):
-        """history全体を処理してGIFを保存し、Colabなら表示する"""
+        """
+        history全体を処理してGIFを保存し、Colabなら表示する
+
+        `history`には履歴のリストのほか`history.ColumnarHistory`も渡せる
+        """
         
 
 
@@ -246,7 +433,13 @@ class TrafficVisualizer:
         """
         Colab/Jupyter上でframesをもとにGIFを表示する
         """
-        if not (HAS_IPYTHON and get_ipython() is not None):
+        # IPythonはノートブック上での表示にのみ用いるため, ここでインポートする
+        try:
+            from IPython.display import display, Image as IPImage
+            from IPython import get_ipython
+        except ImportError:
+            get_ipython = None
+        if get_ipython is None or get_ipython() is None:
             print("Inline display is only available in Notebook environments.")
             return
         if not self.frames:
@@ -264,5 +457,73 @@ class TrafficVisualizer:
         display(IPImage(data=buf.getvalue(), format='png'))
 
 
+    def render_animation(self, history: Iterable[Dict[str, Any]], mapinfo: MapInfo,
+                         output_path: str = "results/simulation.gif",
+                         workers: int | None = None, chunk_size: int = 16,
+                         frame_count: int | None = None) -> str:
+        """
+        履歴をプロセスプールで並列に描画し, 描画済みのフレームから順にファイルへ書き出す
+
+        `create_animation`と異なりフレームを`self.frames`に保持しないため, 
+        メモリ使用量はステップ数によらず(ワーカー数 x `chunk_size`)フレーム分で抑えられる. 
+
+        Parameters
+        ----------
+        history : Iterable[Dict[str, Any]]
+          履歴. リストのほか`history.read_history`のイテレータや`history.ColumnarHistory`も渡せる
+        output_path : str
+          出力先. 拡張子で形式を選ぶ(`.gif`: GIF, `.png`/`.apng`: APNG)
+        workers : int | None
+          描画ワーカー数. Noneでコア数, 1でプロセスプールを使わずに描画する
+        chunk_size : int
+          1回にワーカーへ渡すステップ数
+        frame_count : int | None
+          総フレーム数. 進捗の表示にのみ用い, 省略時は`len(history)`を用いる(長さのない履歴では表示しない)
+        """
+        suffix = os.path.splitext(output_path)[1].lower()
+        if suffix not in STREAM_FORMATS:
+            raise ValueError(f"Unsupported animation format: {suffix} (expected one of {sorted(STREAM_FORMATS)})")
+        if frame_count is None and hasattr(history, "__len__"):
+            frame_count = len(history)
+        writer_class = STREAM_FORMATS[suffix][1]
+
+        output_dir = os.path.dirname(output_path)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+        duration = int(1000 / self.fps)
+        steps = iter(history)
+        chunks = iter(lambda: list(islice(steps, chunk_size)), [])
+        written = 0
+        with writer_class(output_path, duration, frame_count) as writer:
+            if workers == 1:
+                _init_render_worker(mapinfo)
+                for chunk in chunks:
+                    written += self._write_frames(writer, _render_chunk(chunk, suffix, duration), written, frame_count)
+            else:
+                workers = workers or os.cpu_count() or 1
+                with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker, initargs=(mapinfo,)) as executor:
+                    # 先読みするチャンク数を制限してメモリ使用量を抑える
+                    window = 2 * workers
+                    pending = deque()
+                    for chunk in chunks:
+                        pending.append(executor.submit(_render_chunk, chunk, suffix, duration))
+                        if len(pending) >= window:
+                            written += self._write_frames(writer, pending.popleft().result(), written, frame_count)
+                    while pending:
+                        written += self._write_frames(writer, pending.popleft().result(), written, frame_count)
+
+        print(f"Animation saved to: {output_path} ({written} frames)")
+        return output_path
+
+    @staticmethod
+    def _write_frames(writer, frames: List[EncodedFrame], written: int, frame_count: int | None) -> int:
+        for frame in frames:
+            writer.write(frame)
+        done = written + len(frames)
+        if frame_count and done // 100 != written // 100:
+            print(f"Frame {done}/{frame_count} done.")
+        return len(frames)
+
     def clear_frames(self):
         self.frames=[]
\ No newline at end of file